@@ -0,0 +1,138 @@
+import os
+import threading
+
+import read_csv
+from log_helper import log_message
+
+INFO = "INFO"
+
+# System schema and table holding the manifest; not reported by DescribeTable
+MANIFEST_SCHEMA = "_fivetran_system"
+MANIFEST_TABLE = "applied_files"
+# Manifest entries older than this are pruned, since Fivetran does not retry batches for that long
+MANIFEST_RETENTION_DAYS = 7
+
+
+class AppliedFilesManifest:
+    """
+    Record of the batch files that have been applied to the destination.
+
+    Each applied file is stored with its size, modification time and a fingerprint of its
+    contents, in the same transaction as the data it loaded. When a WriteBatch call times out
+    after the commit, Fivetran retries the whole request, and files that are already in the
+    manifest are skipped instead of being applied a second time. Files are matched on path,
+    size and modification time first; only a file matching an entry is hashed to confirm it.
+
+    A transaction can only write to one DuckDB database, so there is one manifest table per
+    database (see DuckDBHelper.database_for()), in the database that holds the batch's table.
+    """
+
+    def __init__(self, db_helper):
+        self.db_helper = db_helper
+        # Databases whose manifest table is known to exist
+        self._created = set()
+        self._created_lock = threading.Lock()
+        self._table(db_helper.main_database)
+
+    def stat_files(self, paths):
+        """Return a dict of path -> (size, modification time in ns) for the given batch files."""
+        return {path: _file_stat(path) for path in paths}
+
+    def applied_files(self, schema_name, stats):
+        """
+        Return the paths of the files that were applied before.
+
+        A file was applied if the manifest has an entry with its path, size and contents. Size
+        and modification time are a shortcut: a file whose size matches no entry is not read, one
+        whose size and modification time match an entry counts as applied, and one whose size
+        matches with another modification time (e.g. it was rewritten or touched for a retry) is
+        hashed and compared with the entry's fingerprint, and takes over the entry when they
+        match.
+
+        Must be called inside the transaction that applies the batch, so that the check and
+        the record() of a concurrent retry cannot both succeed.
+        """
+        if not stats:
+            return set()
+        table = self._table(schema_name)
+        connection = self.db_helper.get_connection()
+        rows = connection.execute(
+            f"SELECT file_path, file_size, file_mtime_ns, fingerprint FROM {table} "
+            f"WHERE file_path IN (SELECT unnest(?))", [list(stats)]
+        ).fetchall()
+        applied = set()
+        # path -> fingerprint of the files hashed so far, so a file is hashed at most once
+        hashed = {}
+        for path, size, mtime_ns, fingerprint in rows:
+            if path in applied or stats[path][0] != size:
+                continue
+            if stats[path][1] == mtime_ns:
+                applied.add(path)
+                continue
+            if path not in hashed:
+                hashed[path] = read_csv.file_fingerprint(path)
+            if hashed[path] == fingerprint:
+                applied.add(path)
+        # Entries confirmed by their fingerprint take the new modification time, for the shortcut next time
+        refreshed = [[stats[path][1], path, hashed[path]] for path in applied if path in hashed]
+        if refreshed:
+            connection.executemany(
+                f"UPDATE {table} SET file_mtime_ns = ? WHERE file_path = ? AND fingerprint = ?", refreshed)
+        return applied
+
+    def record(self, schema_name, table_name, stats, fingerprints):
+        """
+        Add applied files to the manifest and prune expired entries, in the current transaction.
+
+        A file that is already recorded with the same contents gets its modification time and
+        applied_at refreshed, so recording a retried file never fails on the primary key.
+
+        Args:
+            schema_name: Schema of the batch's table
+            table_name: Name of the batch's table
+            stats: Map of path -> (size, modification time in ns) of the applied files, from stat_files()
+            fingerprints: Map of path -> content fingerprint of the files that were decoded; the
+                other files are hashed here
+        """
+        if not stats:
+            return
+        table = self._table(schema_name)
+        connection = self.db_helper.get_connection()
+        connection.executemany(
+            f"INSERT INTO {table} (file_path, file_size, file_mtime_ns, fingerprint, schema_name, table_name, "
+            f"applied_at) VALUES (?, ?, ?, ?, ?, ?, now()) "
+            f"ON CONFLICT (file_path, fingerprint) DO UPDATE SET file_size = excluded.file_size, "
+            f"file_mtime_ns = excluded.file_mtime_ns, schema_name = excluded.schema_name, "
+            f"table_name = excluded.table_name, applied_at = now()",
+            [[path, size, mtime_ns, fingerprints.get(path) or read_csv.file_fingerprint(path),
+              schema_name, table_name] for path, (size, mtime_ns) in stats.items()],
+        )
+        connection.execute(
+            f"DELETE FROM {table} WHERE applied_at < now() - INTERVAL {int(MANIFEST_RETENTION_DAYS)} DAY"
+        )
+        log_message(INFO, f"Recorded {len(stats)} applied files for {schema_name}.{table_name}")
+
+    def _table(self, schema_name):
+        """Return the qualified manifest table for a schema's database, creating it if missing."""
+        database = self.db_helper.database_for(schema_name)
+        escaped_database = self.db_helper.escape_identifier(database)
+        escaped_schema = self.db_helper.escape_identifier(MANIFEST_SCHEMA)
+        table = f'"{escaped_database}"."{escaped_schema}"."{self.db_helper.escape_identifier(MANIFEST_TABLE)}"'
+        with self._created_lock:
+            if database not in self._created:
+                connection = self.db_helper.get_connection()
+                connection.execute(f'CREATE SCHEMA IF NOT EXISTS "{escaped_database}"."{escaped_schema}"')
+                connection.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} ("
+                    f"file_path VARCHAR NOT NULL, file_size BIGINT NOT NULL, file_mtime_ns BIGINT NOT NULL, "
+                    f"fingerprint VARCHAR NOT NULL, "
+                    f"schema_name VARCHAR NOT NULL, table_name VARCHAR NOT NULL, "
+                    f"applied_at TIMESTAMPTZ NOT NULL, PRIMARY KEY (file_path, fingerprint))"
+                )
+                self._created.add(database)
+        return table
+
+
+def _file_stat(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
@@ -0,0 +1,165 @@
+import argparse
+import asyncio
+import functools
+import grpc
+import sys
+from concurrent import futures
+sys.path.append('sdk_pb2')
+
+from sdk_pb2 import destination_sdk_pb2_grpc
+import log_helper
+import metrics_helper
+import profiling_helper
+from duckdb_helper import STORAGE_LAYOUTS, STORAGE_LAYOUT_SINGLE_FILE
+from main import DestinationImpl, is_port_in_use, log_first_response, log_message
+
+INFO = "INFO"
+
+# Default number of RPCs of each group that may run at the same time
+DEFAULT_MAX_CONCURRENT_WRITES = 1
+DEFAULT_MAX_CONCURRENT_SCHEMA_CHANGES = 2
+DEFAULT_MAX_CONCURRENT_DESCRIBES = 4
+
+
+class AsyncDestinationImpl(DestinationImpl):
+    """
+    asyncio variant of DestinationImpl for use with grpc.aio.
+
+    The synchronous handlers are reused as they are, but everything that blocks on DuckDB or
+    on batch file decryption/decompression runs on executors, so the event loop stays free to
+    answer cheap RPCs such as Test and DescribeTable while a long WriteBatch is running.
+
+    RPCs are grouped by cost and each group gets its own executor, whose size is the group's
+    concurrency limit. Calls beyond the limit wait for a free slot of their own group only:
+      - write:    WriteBatch, WriteHistoryBatch
+      - schema:   CreateTable, AlterTable, Truncate, Migrate
+      - describe: DescribeTable
+    ConfigurationForm and Test do no I/O and are answered directly on the event loop.
+
+    With a profiler, the sampled calls are profiled on the executor thread that runs them,
+    where cProfile can see their work.
+    """
+
+    def __init__(self, max_concurrent_writes=DEFAULT_MAX_CONCURRENT_WRITES,
+                 max_concurrent_schema_changes=DEFAULT_MAX_CONCURRENT_SCHEMA_CHANGES,
+                 max_concurrent_describes=DEFAULT_MAX_CONCURRENT_DESCRIBES, profiler=None):
+        super().__init__()
+        self.profiler = profiler
+        self._executors = {
+            "write": futures.ThreadPoolExecutor(max_workers=max_concurrent_writes,
+                                                thread_name_prefix="write"),
+            "schema": futures.ThreadPoolExecutor(max_workers=max_concurrent_schema_changes,
+                                                 thread_name_prefix="schema"),
+            "describe": futures.ThreadPoolExecutor(max_workers=max_concurrent_describes,
+                                                   thread_name_prefix="describe"),
+        }
+
+    async def _run(self, group, handler, request, context):
+        """Run a synchronous handler on the executor of its RPC group."""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(handler, request, context)
+        if self.profiler is not None:
+            call = functools.partial(self.profiler.call, handler.__name__, call, request, context)
+        return await loop.run_in_executor(self._executors[group], call)
+
+    def shutdown_executors(self):
+        """Wait for running handlers and release the executor threads."""
+        for executor in self._executors.values():
+            executor.shutdown(wait=True)
+
+    async def ConfigurationForm(self, request, context):
+        return super().ConfigurationForm(request, context)
+
+    async def Test(self, request, context):
+        return super().Test(request, context)
+
+    async def DescribeTable(self, request, context):
+        return await self._run("describe", super().DescribeTable, request, context)
+
+    async def CreateTable(self, request, context):
+        return await self._run("schema", super().CreateTable, request, context)
+
+    async def AlterTable(self, request, context):
+        return await self._run("schema", super().AlterTable, request, context)
+
+    async def Truncate(self, request, context):
+        return await self._run("schema", super().Truncate, request, context)
+
+    async def Migrate(self, request, context):
+        return await self._run("schema", super().Migrate, request, context)
+
+    async def WriteBatch(self, request, context):
+        return await self._run("write", super().WriteBatch, request, context)
+
+    async def WriteHistoryBatch(self, request, context):
+        return await self._run("write", super().WriteHistoryBatch, request, context)
+
+
+async def serve(args):
+    servicer = AsyncDestinationImpl(max_concurrent_writes=args.max_concurrent_writes,
+                                    max_concurrent_schema_changes=args.max_concurrent_schema_changes,
+                                    max_concurrent_describes=args.max_concurrent_describes,
+                                    profiler=profiling_helper.profiler_from_args(args, log_message))
+    server = grpc.aio.server(
+        interceptors=[metrics_helper.AsyncMetricsInterceptor(on_first_response=log_first_response)])
+    destination_sdk_pb2_grpc.add_DestinationConnectorServicer_to_server(servicer, server)
+    server.add_insecure_port(f'[::]:{args.port}')
+    metrics_exporter = metrics_helper.exporter_from_args(args)
+    try:
+        if metrics_exporter:
+            metrics_exporter.start()
+        await server.start()
+        print(f"Async destination gRPC server started on port {args.port}...")
+        await server.wait_for_termination()
+    finally:
+        print("Shutting down server...")
+        # Stop server first with grace period to allow in-flight requests to complete
+        await server.stop(grace=5)
+        servicer.shutdown_executors()
+        # Let a running maintenance round finish before the database is closed
+        if DestinationImpl.maintenance_helper:
+            DestinationImpl.maintenance_helper.stop()
+        # Close database connection after all requests have finished
+        if DestinationImpl.db_helper:
+            DestinationImpl.db_helper.close()
+        if metrics_exporter:
+            metrics_exporter.stop()
+        log_helper.flush()
+        print("Destination gRPC server terminated...")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=50052,
+                        help="The server port")
+    parser.add_argument("--max-concurrent-writes", type=int, default=DEFAULT_MAX_CONCURRENT_WRITES,
+                        help="WriteBatch/WriteHistoryBatch calls that may run at the same time")
+    parser.add_argument("--max-concurrent-schema-changes", type=int, default=DEFAULT_MAX_CONCURRENT_SCHEMA_CHANGES,
+                        help="CreateTable/AlterTable/Truncate/Migrate calls that may run at the same time")
+    parser.add_argument("--max-concurrent-describes", type=int, default=DEFAULT_MAX_CONCURRENT_DESCRIBES,
+                        help="DescribeTable calls that may run at the same time")
+    parser.add_argument("--storage-layout", choices=STORAGE_LAYOUTS, default=STORAGE_LAYOUT_SINGLE_FILE,
+                        help="Keep all schemas in destination.db, or give each schema its own database file")
+    parser.add_argument("--log-level", choices=list(log_helper.LEVELS), default=log_helper.INFO,
+                        help="Lowest level of the log messages that are written")
+    parser.add_argument("--lazy-startup", action="store_true",
+                        help="Start serving before DuckDB is loaded and opened; the first RPC that needs it does that")
+    metrics_helper.add_arguments(parser)
+    profiling_helper.add_arguments(parser)
+    args = parser.parse_args()
+    for limit in ("max_concurrent_writes", "max_concurrent_schema_changes", "max_concurrent_describes"):
+        if getattr(args, limit) < 1:
+            parser.error(f"--{limit.replace('_', '-')} must be at least 1")
+
+    # Check if port is already in use BEFORE initializing database connection
+    if is_port_in_use(args.port):
+        raise RuntimeError(f"Port {args.port} is already in use. Another server may be running.")
+
+    DestinationImpl.storage_layout = args.storage_layout
+    DestinationImpl.lazy_startup = args.lazy_startup
+    log_helper.set_level(args.log_level)
+    log_message(INFO, "Using the grpc.aio server")
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        print("\nReceived shutdown signal...")
@@ -0,0 +1,113 @@
+import csv
+import io
+from functools import lru_cache
+
+import type_mapping
+from table_schema import TableSchema
+
+# Rows converted per block
+DEFAULT_BLOCK_ROWS = 4096
+# Compiled converters kept; one per distinct table schema, header and sentinel strings
+CONVERTER_CACHE_SIZE = 256
+
+
+class _Unmodified:
+    """Type of UNMODIFIED."""
+    __slots__ = ()
+
+    def __repr__(self):
+        return "UNMODIFIED"
+
+
+# Value of a cell holding the batch's `unmodified_string`: the column keeps its current value
+UNMODIFIED = _Unmodified()
+
+
+class RowConverter:
+    """
+    Converts blocks of CSV rows of one batch file layout to typed Python values.
+
+    Built by compile_row_converter() for a table schema, a CSV header and the batch's sentinel
+    strings. `convert_block(rows)` takes the rows as lists of str (as `csv.reader` yields them)
+    and returns a list of tuples holding the values of `columns`, in that order: None for
+    `null_string`, UNMODIFIED for `unmodified_string`, and the converted value otherwise.
+    Header columns that are not in the table are left out.
+    """
+    __slots__ = ("columns", "convert_block")
+
+    def __init__(self, columns, convert_block):
+        self.columns = columns
+        self.convert_block = convert_block
+
+
+def compile_row_converter(table, header, null_string, unmodified_string):
+    """
+    Return the RowConverter for a table schema and a CSV header, compiling it on first use.
+
+    Args:
+        table: TableSchema (or `common_pb2.Table`) of the table the rows belong to
+        header: Column names of the CSV file, in file order
+        null_string: The batch's `file_params.null_string`
+        unmodified_string: The batch's `file_params.unmodified_string`
+    """
+    if not isinstance(table, TableSchema):
+        table = TableSchema.from_proto(table)
+    # The schema itself is the cache key: equal schemas share a converter, and a changed one
+    # (e.g. after AlterTable) gets its own
+    return _compile(table, tuple(header), null_string, unmodified_string)
+
+
+@lru_cache(maxsize=CONVERTER_CACHE_SIZE)
+def _compile(table, header, null_string, unmodified_string):
+    columns = []
+    namespace = {"null": null_string, "unmodified_string": unmodified_string, "UNMODIFIED": UNMODIFIED}
+    values = []
+    for index, name in enumerate(header):
+        column = table.column(name)
+        if column is None:
+            continue
+        columns.append(name)
+        converter = type_mapping.python_conversion(column.type)
+        if converter is None:
+            converted = "v"
+        else:
+            namespace[f"convert_{index}"] = converter
+            converted = f"convert_{index}(v)"
+        # One expression per column, specialized for its type; only indexes and the names bound
+        # in `namespace` are generated, never column names or values
+        values.append(f"None if (v := row[{index}]) == null else "
+                      f"UNMODIFIED if v == unmodified_string else {converted}")
+    source = ("def convert_block(rows):\n"
+              f"    return [({', '.join(values)}{',' if len(values) == 1 else ''}) for row in rows]\n")
+    exec(compile(source, f"<row converter for {table.name}>", "exec"), namespace)
+    return RowConverter(tuple(columns), namespace["convert_block"])
+
+
+def read_blocks(csv_text, table, file_params, block_rows=DEFAULT_BLOCK_ROWS):
+    """
+    Parse decoded batch file contents and yield its rows as typed values, in blocks.
+
+    Args:
+        csv_text: Plain CSV contents of a batch file (str or bytes), header first
+        table: TableSchema (or `common_pb2.Table`) of the table the file belongs to
+        file_params: FileParams of the request, for the null and unmodified strings
+        block_rows: Rows per block
+
+    Yields:
+        (column names, list of row tuples) per block; see RowConverter
+    """
+    if isinstance(csv_text, (bytes, bytearray, memoryview)):
+        csv_text = bytes(csv_text).decode("utf-8")
+    reader = csv.reader(io.StringIO(csv_text, newline=""))
+    header = next(reader, None)
+    if header is None:
+        return
+    converter = compile_row_converter(table, header, file_params.null_string, file_params.unmodified_string)
+    block = []
+    for row in reader:
+        block.append(row)
+        if len(block) >= block_rows:
+            yield converter.columns, converter.convert_block(block)
+            block = []
+    if block:
+        yield converter.columns, converter.convert_block(block)
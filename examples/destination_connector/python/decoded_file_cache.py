@@ -0,0 +1,145 @@
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import metrics_helper
+import read_csv
+from log_helper import log_message
+
+INFO = "INFO"
+
+# Decoded bytes the cache keeps in DuckDB temp tables before spilling to Parquet
+DEFAULT_MEMORY_BUDGET_BYTES = 256 * 1024 * 1024  # 256 MiB
+# Extra column of every relation: the row's position in its batch file, starting at 0
+ROW_ORDER_COLUMN = "_fivetran_batch_row"
+
+
+class DecodedFileCache:
+    """
+    Per-request cache of decoded batch files.
+
+    Each batch file is decrypted and decompressed exactly once, on first use, and loaded into a
+    DuckDB temp table with every column read as VARCHAR, so the raw `null_string` and
+    `unmodified_string` markers survive and the load phases decide how to cast. Later phases
+    that consult the same file (e.g. the DELETE and UPDATE that an earliest_start file drives)
+    query the temp table instead of decoding it again. Every relation also carries the position
+    of each row in its file as ROW_ORDER_COLUMN, for phases where the last row of a key wins.
+
+    The decoded size of the files held in temp tables is bounded by `memory_budget_bytes`. When
+    a new file would exceed it, the least recently used tables are spilled to Parquet files in a
+    private temp directory and read from there, which is still much cheaper than decoding again.
+
+    Temp tables belong to the DuckDB cursor of the thread that created them, so a cache must be
+    used from a single thread, and closed when the request is done.
+
+    The decoded rows and bytes of every file are added to the `decoded_rows_total` and
+    `decoded_bytes_total` metrics of its table, and the time to load it into DuckDB to the
+    `load` phase. The content fingerprint of every decoded file is kept in `fingerprints`, for
+    the applied-files manifest.
+    """
+
+    def __init__(self, db_helper, keys, file_params, memory_budget_bytes=DEFAULT_MEMORY_BUDGET_BYTES,
+                 table_name=""):
+        """
+        Args:
+            db_helper: DuckDBHelper of the destination
+            keys: Map of batch file path -> decryption key, from the request
+            file_params: FileParams of the request
+            memory_budget_bytes: Decoded bytes to keep in temp tables before spilling
+            table_name: Qualified name of the table the files belong to, the `table` label of the metrics
+        """
+        self.db_helper = db_helper
+        self.table_name = table_name
+        self.keys = keys
+        self.file_params = file_params
+        self.memory_budget_bytes = memory_budget_bytes
+        self._connection = db_helper.get_connection()
+        self._spill_dir = tempfile.mkdtemp(prefix="fivetran-batch-")
+        # path -> {"table": temp table name, "bytes": decoded size}, least recently used first
+        self._in_memory = OrderedDict()
+        # path -> Parquet file of a spilled table
+        self._spilled = {}
+        self._resident_bytes = 0
+        self.decoded_files = 0
+        # path -> content fingerprint (read_csv.file_fingerprint()) of each decoded file
+        self.fingerprints = {}
+
+    def relation(self, path):
+        """
+        Return a SQL table expression for the decoded contents of a batch file.
+
+        The expression can be used wherever a table name is allowed, e.g. `FROM {relation} AS b`.
+        """
+        if path in self._spilled:
+            return f"read_parquet('{_escape_literal(self._spilled[path])}')"
+        if path not in self._in_memory:
+            self._load(path)
+        self._in_memory.move_to_end(path)
+        return _with_row_order(self._in_memory[path]["table"])
+
+    def columns(self, path):
+        """Return the header of a decoded batch file, in file order."""
+        result = self._connection.execute(f"SELECT * FROM {self.relation(path)} LIMIT 0")
+        return [description[0] for description in result.description if description[0] != ROW_ORDER_COLUMN]
+
+    def close(self):
+        """Drop the temp tables and delete the spill files."""
+        for entry in self._in_memory.values():
+            self._connection.execute(f'DROP TABLE IF EXISTS "{entry["table"]}"')
+        self._in_memory.clear()
+        self._spilled.clear()
+        self._resident_bytes = 0
+        shutil.rmtree(self._spill_dir, ignore_errors=True)
+
+    def _load(self, path):
+        digest = read_csv.fingerprint_digest()
+        decoded = read_csv.decode_file(path, self.keys.get(path), self.file_params, digest)
+        self.fingerprints[path] = digest.hexdigest()
+        size = len(decoded)
+        self._make_room(size)
+
+        table = f"batch_file_{self.decoded_files}"
+        self.decoded_files += 1
+        # DuckDB reads CSV from paths, so the plain text goes through a short-lived file
+        csv_path = os.path.join(self._spill_dir, f"{table}.csv")
+        with open(csv_path, "wb") as csv_file:
+            csv_file.write(decoded)
+        del decoded
+        try:
+            with metrics_helper.timer("phase_duration_seconds", phase="load"):
+                rows = self._connection.execute(
+                    f'CREATE TEMP TABLE "{table}" AS SELECT * FROM read_csv(?, header = true, all_varchar = true, '
+                    f"delim = ',', quote = '\"', escape = '\"', nullstr = ?)",
+                    [csv_path, self.file_params.null_string],
+                ).fetchone()[0]
+        finally:
+            os.remove(csv_path)
+        metrics_helper.increment("decoded_rows_total", rows, table=self.table_name)
+        metrics_helper.increment("decoded_bytes_total", size, table=self.table_name)
+
+        self._in_memory[path] = {"table": table, "bytes": size}
+        self._resident_bytes += size
+        log_message(INFO, f"Decoded batch file {path} ({size} bytes)")
+
+    def _make_room(self, size):
+        """Spill least recently used tables until `size` more bytes fit in the budget."""
+        while self._in_memory and self._resident_bytes + size > self.memory_budget_bytes:
+            path, entry = self._in_memory.popitem(last=False)
+            parquet_path = os.path.join(self._spill_dir, f'{entry["table"]}.parquet')
+            self._connection.execute(
+                f"COPY {_with_row_order(entry['table'])} TO '{_escape_literal(parquet_path)}' (FORMAT PARQUET)"
+            )
+            self._connection.execute(f'DROP TABLE "{entry["table"]}"')
+            self._spilled[path] = parquet_path
+            self._resident_bytes -= entry["bytes"]
+            log_message(INFO, f"Spilled decoded batch file {path} to {parquet_path}")
+
+
+def _with_row_order(table):
+    # The CSV is loaded with insertion order preserved, so rowid is the row's position in the file
+    return f'(SELECT rowid AS "{ROW_ORDER_COLUMN}", * FROM "{table}")'
+
+
+def _escape_literal(value):
+    return value.replace("'", "''")
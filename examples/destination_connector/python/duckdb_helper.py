@@ -1,28 +1,60 @@
-import duckdb
+import os
 import sys
+import threading
+import time
 from contextlib import contextmanager
+from urllib.parse import quote, unquote
 sys.path.append('sdk_pb2')
 
 from sdk_pb2 import common_pb2
+from log_helper import log_message
+import type_mapping
+from table_schema import ColumnSchema, TableSchema
 
 INFO = "INFO"
 WARNING = "WARNING"
 
+# Storage layouts: every schema in the main database file, or one ATTACHed database file per schema
+STORAGE_LAYOUT_SINGLE_FILE = "single_file"
+STORAGE_LAYOUT_PER_SCHEMA = "per_schema"
+STORAGE_LAYOUTS = (STORAGE_LAYOUT_SINGLE_FILE, STORAGE_LAYOUT_PER_SCHEMA)
+# Schemas that always stay in the main database, since their names resolve there first
+MAIN_DATABASE_SCHEMAS = ("main", "information_schema", "pg_catalog")
+
 
 class DuckDBHelper:
     """Helper class for DuckDB operations."""
 
-    def __init__(self, db_path=""):
+    def __init__(self, db_path="", storage_layout=STORAGE_LAYOUT_SINGLE_FILE):
         """
         Initialize DuckDB connection.
 
         Args:
             db_path: Path to database file. If empty, creates in-memory database.
+            storage_layout: STORAGE_LAYOUT_SINGLE_FILE keeps all schemas in `db_path`.
+                STORAGE_LAYOUT_PER_SCHEMA stores each schema in its own database file, in a
+                directory next to `db_path`, which DuckDB ATTACHes under the schema's name.
         """
+        if storage_layout not in STORAGE_LAYOUTS:
+            raise ValueError(f"Unknown storage layout '{storage_layout}', expected one of {STORAGE_LAYOUTS}")
         self.db_path = db_path if db_path else ":memory:"
+        self.storage_layout = storage_layout
+        # Schema name -> path of its attached database file
+        self._attachments = {}
+        self._attachments_lock = threading.Lock()
+        # Each thread gets its own cursor (a DuckDB connection to the same database), since a
+        # single DuckDB connection must not be used from several threads at once
+        self._local = threading.local()
+        self._cursors = []
+        self._cursors_lock = threading.Lock()
         try:
+            # Imported here rather than at module load, see DestinationImpl.lazy_startup
+            import duckdb
             self._connection = duckdb.connect(self.db_path)
+            self.main_database = self._connection.execute("SELECT current_database()").fetchall()[0][0]
             log_message(INFO, f"Connected to DuckDB at: {self.db_path}")
+            if self.storage_layout == STORAGE_LAYOUT_PER_SCHEMA:
+                self._attach_existing_schemas()
         except Exception as e:
             error_message = (f"Failed to initialize DuckDB connection for path '{self.db_path}'. "
                            f"Ensure that the DuckDB module is installed and that the database path is correct. "
@@ -31,8 +63,23 @@ class DuckDBHelper:
             raise RuntimeError(error_message) from e
 
     def get_connection(self):
-        """Get the DuckDB connection."""
-        return self._connection
+        """
+        Get the DuckDB connection for the calling thread.
+
+        Returns a per-thread cursor of the shared database, so helpers can be called from
+        several threads (e.g. the asyncio server's executors). Transactions are per cursor.
+        Read results to the end (fetchall()) outside transactions: a partly read result keeps
+        the cursor's transaction open, and one that has read the catalog makes CHECKPOINT fail.
+        """
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is None:
+            if self._connection is None:
+                raise RuntimeError("DuckDB connection is closed")
+            cursor = self._connection.cursor()
+            self._local.cursor = cursor
+            with self._cursors_lock:
+                self._cursors.append(cursor)
+        return cursor
 
     @contextmanager
     def transaction(self):
@@ -48,16 +95,95 @@ class DuckDBHelper:
                 self.db_helper.drop_column(schema, table, col2)
                 # Both operations succeed or both roll back
         """
+        connection = self.get_connection()
         try:
-            self._connection.begin()
-            yield self._connection
-            self._connection.commit()
+            connection.begin()
+            yield connection
+            connection.commit()
             log_message(INFO, "Transaction committed successfully")
         except Exception as e:
-            self._connection.rollback()
+            connection.rollback()
             log_message(WARNING, f"Transaction rolled back due to error: {str(e)}")
             raise
 
+    def database_for(self, schema_name):
+        """
+        Return the name of the database (DuckDB catalog) that holds the tables of a schema.
+
+        In the per-schema layout each schema is a separate database file attached under the
+        schema's own name, with its tables in that database's `main` schema. Since DuckDB
+        resolves `"schema"."table"` to `"schema".main."table"` when the main database has no
+        such schema, two-part names work the same in both layouts; only catalog queries and
+        statements that must name the database need this router.
+
+        Every attachment has its own WAL and commit path, so batches for tables of different
+        schemas commit in parallel instead of queueing on one file. A transaction can only
+        write to one database, though, so it must stay within one schema.
+        """
+        if self._is_attached_schema(schema_name):
+            return schema_name
+        return self.main_database
+
+    def schema_in_database(self, schema_name):
+        """Return the name of a schema inside the database returned by database_for()."""
+        return "main" if self._is_attached_schema(schema_name) else schema_name
+
+    def database_files(self):
+        """Return a dict of database name -> file path for the main database and all attachments."""
+        files = {self.main_database: self.db_path}
+        with self._attachments_lock:
+            files.update(self._attachments)
+        return {name: path for name, path in files.items() if path != ":memory:"}
+
+    def _is_attached_schema(self, schema_name):
+        return (self.storage_layout == STORAGE_LAYOUT_PER_SCHEMA
+                and schema_name not in MAIN_DATABASE_SCHEMAS
+                and schema_name not in (self.main_database, "system", "temp"))
+
+    def _schema_directory(self):
+        return os.path.splitext(self.db_path)[0] + "_schemas"
+
+    def _attach_schema(self, schema_name):
+        """ATTACH the database file of a schema, creating it if needed."""
+        with self._attachments_lock:
+            if schema_name in self._attachments:
+                return
+            if self.db_path == ":memory:":
+                path = ":memory:"
+            else:
+                os.makedirs(self._schema_directory(), exist_ok=True)
+                path = os.path.join(self._schema_directory(), quote(schema_name, safe="") + ".db")
+            self.get_connection().execute(
+                f"ATTACH IF NOT EXISTS {_sql_string(path)} AS \"{self.escape_identifier(schema_name)}\""
+            )
+            self._attachments[schema_name] = path
+        log_message(INFO, f"Attached database for schema {schema_name}: {path}")
+
+    def _attach_existing_schemas(self):
+        if self.db_path == ":memory:" or not os.path.isdir(self._schema_directory()):
+            return
+        for file_name in sorted(os.listdir(self._schema_directory())):
+            if file_name.endswith(".db"):
+                self._attach_schema(unquote(file_name[:-len(".db")]))
+
+    @contextmanager
+    def _in_database_of(self, schema_name):
+        """
+        Make the database of a schema the cursor's default for the block.
+
+        Needed to replay the CREATE INDEX statements DuckDB reports for attached databases,
+        which name the table without its database.
+        """
+        if not self._is_attached_schema(schema_name):
+            yield
+            return
+        connection = self.get_connection()
+        connection.execute(f'USE "{self.escape_identifier(schema_name)}"')
+        try:
+            yield
+        finally:
+            connection.execute(f'USE "{self.escape_identifier(self.main_database)}"')
+
     def escape_identifier(self, identifier):
         """
         Safely escape an identifier for use in SQL queries.
@@ -93,6 +219,10 @@ class DuckDBHelper:
         if not conn:
             return
         try:
+            with self._cursors_lock:
+                cursors, self._cursors = self._cursors, []
+            for cursor in cursors:
+                cursor.close()
             conn.close()
             log_message(INFO, "DuckDB connection closed")
         except Exception as e:
@@ -106,122 +236,233 @@ class DuckDBHelper:
         query = """
             SELECT COUNT(*) as count
             FROM information_schema.tables
-            WHERE table_schema = ? AND table_name = ?
+            WHERE table_catalog = ? AND table_schema = ? AND table_name = ?
         """
-        result = self._connection.execute(query, [schema_name, table_name]).fetchone()
-        return result[0] > 0
+        result = self.get_connection().execute(query, self._catalog_key(schema_name, table_name)).fetchall()
+        return result[0][0] > 0
 
     def create_schema_if_not_exists(self, schema_name):
-        """Create a schema if it doesn't exist."""
-        sql = f'CREATE SCHEMA IF NOT EXISTS "{self.escape_identifier(schema_name)}"'
-        self._connection.execute(sql)
+        """Create a schema if it doesn't exist (in the per-schema layout, attach its database)."""
+        if self._is_attached_schema(schema_name):
+            self._attach_schema(schema_name)
+        else:
+            sql = f'CREATE SCHEMA IF NOT EXISTS "{self.escape_identifier(schema_name)}"'
+            self.get_connection().execute(sql)
         log_message(INFO, f"Schema created or already exists: {schema_name}")
 
     def create_table(self, schema_name, table):
-        """Create a table with the given schema."""
+        """
+        Create a table with the given schema (a TableSchema).
+
+        Columns flagged `primary_key` are declared as the table's PRIMARY KEY. DuckDB backs the
+        constraint with an ART index, so keyed lookups, updates and deletes (and the merges of
+        WriteBatch) can use the index instead of scanning the whole table.
+        """
         self.create_schema_if_not_exists(schema_name)
 
         column_defs = []
         for column in table.columns:
-            column_def = f'"{self.escape_identifier(column.name)}" {self.map_datatype_to_sql(column.type, column)}'
+            column_def = f'"{self.escape_identifier(column.name)}" {column.sql_type}'
             column_defs.append(column_def)
+        if table.primary_key:
+            column_defs.append(f"PRIMARY KEY ({self._column_list(table.primary_key)})")
 
         columns_str = ", ".join(column_defs)
         sql = f'CREATE TABLE "{self.escape_identifier(schema_name)}"."{self.escape_identifier(table.name)}" ({columns_str})'
 
-        self._connection.execute(sql)
+        self.get_connection().execute(sql)
         log_message(INFO, f"Table created: {schema_name}.{table.name}")
 
     def drop_table(self, schema_name, table_name):
         """Drop a table if it exists."""
         sql = f'DROP TABLE IF EXISTS "{self.escape_identifier(schema_name)}"."{self.escape_identifier(table_name)}"'
-        self._connection.execute(sql)
+        self.get_connection().execute(sql)
         log_message(INFO, f"Table dropped: {schema_name}.{table_name}")
 
     def describe_table(self, schema_name, table_name):
-        """Get table schema information."""
+        """Get table schema information as a TableSchema, or None if the table does not exist."""
         if not self.table_exists(schema_name, table_name):
             return None
 
         query = """
             SELECT column_name, data_type, numeric_precision, numeric_scale, character_maximum_length
             FROM information_schema.columns
-            WHERE table_schema = ? AND table_name = ?
+            WHERE table_catalog = ? AND table_schema = ? AND table_name = ?
             ORDER BY ordinal_position
         """
 
-        result = self._connection.execute(query, [schema_name, table_name]).fetchall()
+        result = self.get_connection().execute(query, self._catalog_key(schema_name, table_name)).fetchall()
+        primary_key = set(self.primary_key_columns(schema_name, table_name))
 
-        # Build table object
-        table_builder_columns = []
-
-        for row in result:
-            column_name = row[0]
-            data_type = row[1]
-            numeric_precision = row[2]
-            numeric_scale = row[3]
-            character_max_length = row[4]
-
-            column_type = self._map_sql_type_to_datatype(data_type)
-            column = common_pb2.Column(
-                name=column_name,
-                type=column_type
-            )
+        columns = []
+        for column_name, data_type, numeric_precision, numeric_scale, character_max_length in result:
+            column_type, type_parameters = type_mapping.parse_sql_type(data_type)
+            decimal = None
+            string_byte_length = 0
 
             # For DECIMAL types, populate precision and scale
-            if column_type == common_pb2.DataType.DECIMAL and numeric_precision is not None:
-                column.params.decimal.precision = int(numeric_precision)
-                column.params.decimal.scale = int(numeric_scale) if numeric_scale is not None else 0
+            if column_type == common_pb2.DataType.DECIMAL:
+                if numeric_precision is not None:
+                    decimal = (int(numeric_precision), int(numeric_scale) if numeric_scale is not None else 0)
+                elif type_parameters:
+                    decimal = (type_parameters[0], type_parameters[1] if len(type_parameters) > 1 else 0)
 
             # For STRING types, populate string_byte_length if available
-            if column_type == common_pb2.DataType.STRING and character_max_length is not None:
-                column.params.string_byte_length = int(character_max_length)
-
-            table_builder_columns.append(column)
+            if column_type == common_pb2.DataType.STRING:
+                if character_max_length is not None:
+                    string_byte_length = int(character_max_length)
+                elif type_parameters:
+                    string_byte_length = type_parameters[0]
 
-        table_obj = common_pb2.Table(
-            name=table_name,
-            columns=table_builder_columns
-        )
+            columns.append(ColumnSchema(column_name, column_type, column_name in primary_key,
+                                        decimal, string_byte_length))
 
-        return table_obj
+        return TableSchema(table_name, tuple(columns))
 
     def add_column(self, schema_name, table_name, column):
-        """Add a column to an existing table."""
-        sql = f'ALTER TABLE "{self.escape_identifier(schema_name)}"."{self.escape_identifier(table_name)}" ADD COLUMN "{self.escape_identifier(column.name)}" {self.map_datatype_to_sql(column.type, column)}'
-        self._connection.execute(sql)
+        """Add a column (a ColumnSchema) to an existing table."""
+        sql = f'ALTER TABLE "{self.escape_identifier(schema_name)}"."{self.escape_identifier(table_name)}" ADD COLUMN "{self.escape_identifier(column.name)}" {column.sql_type}'
+        self.get_connection().execute(sql)
         log_message(INFO, f"Column added: {column.name} to {schema_name}.{table_name}")
 
     def drop_column(self, schema_name, table_name, column_name):
         """Drop a column from a table."""
+        if column_name in self.primary_key_columns(schema_name, table_name):
+            # DuckDB cannot drop a column its primary key depends on, so rebuild without it
+            self.rebuild_table(schema_name, self.describe_table(schema_name, table_name).without_column(column_name))
+            log_message(INFO, f"Column dropped: {column_name} from {schema_name}.{table_name}")
+            return
         sql = f'ALTER TABLE "{self.escape_identifier(schema_name)}"."{self.escape_identifier(table_name)}" DROP COLUMN "{self.escape_identifier(column_name)}"'
-        self._connection.execute(sql)
+        self.get_connection().execute(sql)
         log_message(INFO, f"Column dropped: {column_name} from {schema_name}.{table_name}")
 
     def rename_column(self, schema_name, table_name, old_name, new_name):
         """Rename a column."""
         sql = f'ALTER TABLE "{self.escape_identifier(schema_name)}"."{self.escape_identifier(table_name)}" RENAME COLUMN "{self.escape_identifier(old_name)}" TO "{self.escape_identifier(new_name)}"'
-        self._connection.execute(sql)
+        self.get_connection().execute(sql)
         log_message(INFO, f"Column renamed: {old_name} to {new_name} in {schema_name}.{table_name}")
 
     def truncate_table(self, schema_name, table_name):
         """Truncate a table."""
         sql = f'TRUNCATE TABLE "{self.escape_identifier(schema_name)}"."{self.escape_identifier(table_name)}"'
-        self._connection.execute(sql)
+        self.get_connection().execute(sql)
         log_message(INFO, f"Table truncated: {schema_name}.{table_name}")
 
     def rename_table(self, schema_name, old_name, new_name):
         """Rename a table."""
         sql = f'ALTER TABLE "{self.escape_identifier(schema_name)}"."{self.escape_identifier(old_name)}" RENAME TO "{self.escape_identifier(new_name)}"'
-        self._connection.execute(sql)
+        self.get_connection().execute(sql)
         log_message(INFO, f"Table renamed: {old_name} to {new_name} in {schema_name}")
 
     def copy_table(self, schema_name, from_table, to_table):
         """Copy a table structure and data."""
         sql = f'CREATE TABLE "{self.escape_identifier(schema_name)}"."{self.escape_identifier(to_table)}" AS SELECT * FROM "{self.escape_identifier(schema_name)}"."{self.escape_identifier(from_table)}"'
-        self._connection.execute(sql)
+        self.get_connection().execute(sql)
         log_message(INFO, f"Table copied: {from_table} to {to_table} in {schema_name}")
 
+    def primary_key_columns(self, schema_name, table_name):
+        """Return the primary key columns of a table, in key order (empty if it has none)."""
+        query = """
+            SELECT constraint_column_names
+            FROM duckdb_constraints()
+            WHERE database_name = ? AND schema_name = ? AND table_name = ? AND constraint_type = 'PRIMARY KEY'
+        """
+        rows = self.get_connection().execute(query, self._catalog_key(schema_name, table_name)).fetchall()
+        return list(rows[0][0]) if rows else []
+
+    def rebuild_table(self, schema_name, table, order_by=None):
+        """
+        Recreate a table with a new definition (a TableSchema), keeping its rows.
+
+        DuckDB cannot alter a primary key in place: it can neither drop the constraint, nor
+        change the type of a key column, nor drop a key column. This creates the table as
+        described by `table` under a temporary name, copies the columns that exist in both
+        (cast to their new types), and swaps it in. Secondary indexes are recreated.
+        Run it inside a transaction so the swap is atomic.
+
+        If `order_by` lists columns, the rows are copied in that order (see recluster_table).
+        """
+        current = self.describe_table(schema_name, table.name)
+        indexes = self.secondary_indexes(schema_name, table.name)
+        rebuild_name = f"{table.name}__fivetran_rebuild"
+
+        self.create_table(schema_name, table.renamed(rebuild_name))
+        copied = [column for column in table.columns if column.name in current]
+        select_list = ", ".join(
+            type_mapping.cast(column, f'"{self.escape_identifier(column.name)}"') for column in copied
+        )
+        escaped_schema = self.escape_identifier(schema_name)
+        self.get_connection().execute(
+            f'INSERT INTO "{escaped_schema}"."{self.escape_identifier(rebuild_name)}" '
+            f'({self._column_list([column.name for column in copied])}) '
+            f'SELECT {select_list} FROM "{escaped_schema}"."{self.escape_identifier(table.name)}"'
+            + (f' ORDER BY {self._column_list(order_by)}' if order_by else '')
+        )
+        self.drop_table(schema_name, table.name)
+        self.rename_table(schema_name, rebuild_name, table.name)
+        self._create_indexes(schema_name, indexes)
+        log_message(INFO, f"Table rebuilt: {schema_name}.{table.name} with primary key {list(table.primary_key)}")
+
+    def recluster_table(self, schema_name, table_name, order_by):
+        """
+        Rewrite a table with its rows sorted by the given columns.
+
+        DuckDB keeps min/max zone maps per row group and skips row groups whose range cannot
+        match a filter or join key. Rows that arrived in arbitrary order spread every key range
+        over all row groups; sorting them again lets keyed merges, deletes and time-ranged
+        truncates skip most of the table. Run it inside a transaction.
+        """
+        self.rebuild_table(schema_name, self.describe_table(schema_name, table_name), order_by=order_by)
+        log_message(INFO, f"Table reclustered: {schema_name}.{table_name} by {order_by}")
+
+    def row_count(self, schema_name, table_name):
+        """Return the number of rows in a table."""
+        sql = f'SELECT COUNT(*) FROM "{self.escape_identifier(schema_name)}"."{self.escape_identifier(table_name)}"'
+        return self.get_connection().execute(sql).fetchall()[0][0]
+
+    def secondary_indexes(self, schema_name, table_name):
+        """Return (index name, CREATE statement) for each index of a table besides its primary key."""
+        query = """
+            SELECT index_name, sql
+            FROM duckdb_indexes()
+            WHERE database_name = ? AND schema_name = ? AND table_name = ? AND NOT is_primary
+        """
+        return self.get_connection().execute(query, self._catalog_key(schema_name, table_name)).fetchall()
+
+    def _create_indexes(self, schema_name, indexes):
+        """Replay the CREATE statements returned by secondary_indexes()."""
+        with self._in_database_of(schema_name):
+            for _, sql in indexes:
+                self.get_connection().execute(sql)
+
+    def _catalog_key(self, schema_name, table_name):
+        """Parameters (database, schema, table) for catalog queries about a table."""
+        return [self.database_for(schema_name), self.schema_in_database(schema_name), table_name]
+
+    @contextmanager
+    def suspended_indexes(self, schema_name, table_name):
+        """
+        Drop a table's secondary indexes for the duration of a bulk load and rebuild them after.
+
+        Maintaining an ART index row by row during a large load costs more than building it
+        once over the loaded data. The primary key index stays, since it enforces uniqueness.
+        Use inside a transaction: if the load fails, the rollback restores the dropped indexes.
+        """
+        indexes = self.secondary_indexes(schema_name, table_name)
+        for index_name, _ in indexes:
+            self.get_connection().execute(
+                f'DROP INDEX "{self.escape_identifier(schema_name)}"."{self.escape_identifier(index_name)}"'
+            )
+        if indexes:
+            log_message(INFO, f"Suspended {len(indexes)} indexes on {schema_name}.{table_name}")
+        yield
+        self._create_indexes(schema_name, indexes)
+        if indexes:
+            log_message(INFO, f"Rebuilt {len(indexes)} indexes on {schema_name}.{table_name}")
+
+    def _column_list(self, names):
+        return ", ".join(f'"{self.escape_identifier(name)}"' for name in names)
+
     def _normalize_value(self, value):
         """
         Normalize a Python value for safe binding into DuckDB.
@@ -240,9 +481,52 @@ class DuckDBHelper:
         """Update all rows in a column with a specific value."""
         sql = f'UPDATE "{self.escape_identifier(schema_name)}"."{self.escape_identifier(table_name)}" SET "{self.escape_identifier(column_name)}" = ?'
         normalized_value = self._normalize_value(value)
-        self._connection.execute(sql, [normalized_value])
+        self.get_connection().execute(sql, [normalized_value])
         log_message(INFO, f"Column {column_name} updated in {schema_name}.{table_name}")
 
+    def bulk_insert(self, schema_name, table_name, columns, data):
+        """
+        Insert many rows at engine speed.
+
+        `data` is an Arrow table, a pandas DataFrame or anything else DuckDB can register as a
+        view (any object with the Arrow C stream interface), which DuckDB scans in place, or a
+        dict of typed column buffers: column name -> sequence of Python values, all of the same
+        length, None for NULL. Column buffers are turned into an Arrow table first, which needs
+        the optional `pyarrow` package; Python values keep their full precision (float, Decimal,
+        datetime, bytes, '' as opposed to None) on the way.
+
+        Either way each column is cast to the SQL type that `map_datatype_to_sql()` gives it.
+
+        Args:
+            schema_name: Schema of the target table
+            table_name: Name of the target table
+            columns: ColumnSchema objects of the columns to fill, in data order
+            data: Arrow table, DataFrame or dict of column name -> sequence of values
+
+        Returns:
+            Number of rows inserted
+        """
+        started = time.monotonic()
+        if isinstance(data, dict):
+            data = _arrow_table(columns, data)
+        view_name = f"bulk_insert_{threading.get_ident()}"
+        connection = self.get_connection()
+        connection.register(view_name, data)
+        try:
+            select_list = ", ".join(
+                type_mapping.cast(column, f'"{self.escape_identifier(column.name)}"') for column in columns)
+            sql = (f'INSERT INTO "{self.escape_identifier(schema_name)}"."{self.escape_identifier(table_name)}" '
+                   f'({self._column_list(column.name for column in columns)}) '
+                   f'SELECT {select_list} FROM "{view_name}"')
+            rows = connection.execute(sql).fetchall()[0][0]
+        finally:
+            connection.unregister(view_name)
+        elapsed = time.monotonic() - started
+        rate = rows / elapsed if elapsed > 0 else float(rows)
+        log_message(INFO, f"Bulk inserted {rows} rows into {schema_name}.{table_name} "
+                          f"in {elapsed:.3f}s ({rate:,.0f} rows/s)")
+        return rows
+
     def map_datatype_to_sql(self, datatype, column=None):
         """
         Map Fivetran DataType to SQL type.
@@ -258,83 +542,22 @@ class DuckDBHelper:
         Returns:
             SQL type string
         """
-        # Handle DECIMAL specially - needs precision/scale from column definition
-        if datatype == common_pb2.DataType.DECIMAL:
-            if column and column.HasField("params") and column.params.HasField("decimal"):
-                precision = column.params.decimal.precision
-                scale = column.params.decimal.scale
-                return f"DECIMAL({precision}, {scale})"
-            else:
-                # Default fallback when precision/scale not specified
-                return "DECIMAL(38, 10)"
-
-        # Handle STRING specially - may have string_byte_length for VARCHAR sizing
-        if datatype == common_pb2.DataType.STRING:
-            if column and column.HasField("params") and column.params.string_byte_length > 0:
-                return f"VARCHAR({column.params.string_byte_length})"
-            # Default fallback to unlimited VARCHAR
-            return "VARCHAR"
-
-        type_mapping = {
-            common_pb2.DataType.BOOLEAN: "BOOLEAN",
-            common_pb2.DataType.SHORT: "SMALLINT",
-            common_pb2.DataType.INT: "INTEGER",
-            common_pb2.DataType.LONG: "BIGINT",
-            common_pb2.DataType.FLOAT: "REAL",
-            common_pb2.DataType.DOUBLE: "DOUBLE",
-            common_pb2.DataType.NAIVE_DATE: "DATE",
-            common_pb2.DataType.NAIVE_DATETIME: "TIMESTAMP",
-            common_pb2.DataType.UTC_DATETIME: "TIMESTAMPTZ",
-            common_pb2.DataType.NAIVE_TIME: "TIME",
-            common_pb2.DataType.BINARY: "BLOB",
-            common_pb2.DataType.JSON: "JSON",
-            common_pb2.DataType.XML: "VARCHAR",
-            common_pb2.DataType.UNSPECIFIED: "VARCHAR",
-        }
-        return type_mapping.get(datatype, "VARCHAR")
-
-    def _map_sql_type_to_datatype(self, sql_type):
-        """Map SQL type to Fivetran DataType."""
-        sql_type = sql_type.upper()
-
-        # Log the SQL type for debugging
-        log_message(INFO, f"Mapping SQL type: {sql_type}")
-
-        if "BOOL" in sql_type:
-            return common_pb2.DataType.BOOLEAN
-        if "SMALLINT" in sql_type or "INT2" in sql_type:
-            return common_pb2.DataType.SHORT
-        if "INTEGER" in sql_type or "INT4" in sql_type or "INT " in sql_type:
-            return common_pb2.DataType.INT
-        if "BIGINT" in sql_type or "INT8" in sql_type:
-            return common_pb2.DataType.LONG
-        if "DECIMAL" in sql_type or "NUMERIC" in sql_type:
-            return common_pb2.DataType.DECIMAL
-        # Check DOUBLE before FLOAT because "DOUBLE" contains the word but not "FLOAT"
-        if "DOUBLE" in sql_type or "FLOAT8" in sql_type:
-            return common_pb2.DataType.DOUBLE
-        # Check for FLOAT - covers FLOAT, REAL, FLOAT4
-        if "FLOAT" in sql_type or "REAL" in sql_type or "FLOAT4" in sql_type:
-            return common_pb2.DataType.FLOAT
-        if "DATE" in sql_type and "TIME" not in sql_type:
-            return common_pb2.DataType.NAIVE_DATE
-        if "TIMESTAMP" in sql_type and "TZ" in sql_type:
-            return common_pb2.DataType.UTC_DATETIME
-        if "TIMESTAMP" in sql_type:
-            return common_pb2.DataType.NAIVE_DATETIME
-        if "TIME" in sql_type:
-            return common_pb2.DataType.NAIVE_TIME
-        if "BLOB" in sql_type or "BYTEA" in sql_type:
-            return common_pb2.DataType.BINARY
-        if "JSON" in sql_type:
-            return common_pb2.DataType.JSON
-
-        # If no match found, log warning and return STRING as fallback
-        log_message(WARNING, f"Unknown SQL type '{sql_type}', defaulting to STRING")
-        return common_pb2.DataType.STRING
-
-
-def log_message(level, message):
-    import json
-    escaped_message = json.dumps(message)
-    print(f'{{"level": "{level}", "message": {escaped_message}, "message-origin": "sdk_destination"}}')
+        return type_mapping.sql_type(datatype, column)
+
+
+def _arrow_table(columns, buffers):
+    """Build an Arrow table from column buffers, letting pyarrow type each column from its values."""
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError("bulk_insert() needs the pyarrow package for column buffers; "
+                          "install it or pass an Arrow table") from e
+    names = [column.name for column in columns]
+    lengths = {len(buffers[name]) for name in names}
+    if len(lengths) > 1:
+        raise ValueError(f"Column buffers have different lengths: {sorted(lengths)}")
+    return pyarrow.table({name: pyarrow.array(buffers[name]) for name in names})
+
+
+def _sql_string(value):
+    return "'" + value.replace("'", "''") + "'"
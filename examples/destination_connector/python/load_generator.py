@@ -0,0 +1,801 @@
+import argparse
+import base64
+import csv
+import glob
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import grpc
+import zstandard
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+from google.protobuf import timestamp_pb2
+sys.path.append('sdk_pb2')
+
+from sdk_pb2 import common_pb2
+from sdk_pb2 import destination_sdk_pb2
+from sdk_pb2 import destination_sdk_pb2_grpc
+
+DataType = common_pb2.DataType
+
+DEFAULT_PORT = 50052
+DEFAULT_SCHEMA = "load_test"
+# Sentinels written to the batch files; the server reads them from the request's file_params
+NULL_STRING = "null-m8yilkvPsNulehxl2G6pmSQ3G3WWdLP"
+UNMODIFIED_STRING = "unmod-NcK9NIjPUutCsz4mjOQQztbnwnE1sY3"
+# `_fivetran_end` of active history mode rows
+END_OF_TIME = "9999-12-31T23:59:59.999Z"
+PERCENTILES = (50, 95, 99)
+
+FIVETRAN_SYNCED = "_fivetran_synced"
+FIVETRAN_DELETED = "_fivetran_deleted"
+FIVETRAN_ID = "_fivetran_id"
+FIVETRAN_START = "_fivetran_start"
+FIVETRAN_END = "_fivetran_end"
+FIVETRAN_ACTIVE = "_fivetran_active"
+
+# Response oneof values of calls that succeeded (a `success` value must also be true)
+SUCCESSFUL_RESPONSES = {"success", "table", "not_found"}
+
+
+def _column(name, datatype, primary_key=False, precision=None, scale=None):
+    column = common_pb2.Column(name=name, type=datatype, primary_key=primary_key)
+    if precision is not None:
+        column.params.decimal.precision = precision
+        column.params.decimal.scale = scale
+    return column
+
+
+# Columns of the synthetic tables, before the system columns
+SYNTHETIC_COLUMNS = (
+    _column("id", DataType.INT, primary_key=True),
+    _column("name", DataType.STRING),
+    _column("amount", DataType.DECIMAL, precision=18, scale=2),
+    _column("score", DataType.DOUBLE),
+    _column("active", DataType.BOOLEAN),
+    _column("created", DataType.UTC_DATETIME),
+    _column("payload", DataType.STRING),
+)
+
+
+def _utc_text(value):
+    return value.strftime("%Y-%m-%dT%H:%M:%S.") + f"{value.microsecond // 1000:03d}Z"
+
+
+def _parse_utc(text):
+    # fromisoformat() only accepts a trailing "Z" from Python 3.11 on
+    return datetime.fromisoformat(text[:-1] + "+00:00" if text.endswith("Z") else text)
+
+
+def _now_text():
+    return _utc_text(datetime.now(timezone.utc))
+
+
+def _is_history_table(table):
+    return any(column.name == FIVETRAN_START for column in table.columns)
+
+
+class BatchFileWriter:
+    """
+    Writes batch files the way Fivetran does: CSV with a header row, zstd compressed and
+    AES-256-CBC encrypted (a random IV followed by the PKCS7 padded ciphertext), or plain CSV.
+
+    `generation_seconds` adds up the time spent writing files, which is reported separately from
+    the RPCs' throughput.
+    """
+
+    def __init__(self, directory, plain_text=False):
+        self.directory = directory
+        self.plain_text = plain_text
+        if plain_text:
+            compression, encryption = destination_sdk_pb2.Compression.OFF, destination_sdk_pb2.Encryption.NONE
+        else:
+            compression, encryption = destination_sdk_pb2.Compression.ZSTD, destination_sdk_pb2.Encryption.AES
+        self.file_params = destination_sdk_pb2.FileParams(
+            compression=compression, encryption=encryption,
+            null_string=NULL_STRING, unmodified_string=UNMODIFIED_STRING)
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self.generation_seconds = 0.0
+
+    def write(self, header, rows, key):
+        """
+        Write one batch file.
+
+        Returns:
+            (path, size in bytes)
+        """
+        started = time.perf_counter()
+        text = io.StringIO(newline="")
+        writer = csv.writer(text, lineterminator="\n")
+        writer.writerow(header)
+        writer.writerows(rows)
+        data = text.getvalue().encode("utf-8")
+        if not self.plain_text:
+            data = zstandard.ZstdCompressor().compress(data)
+            iv = os.urandom(16)
+            data = iv + AES.new(key, AES.MODE_CBC, iv=iv).encrypt(pad(data, AES.block_size))
+        with self._lock:
+            self._sequence += 1
+            sequence = self._sequence
+        path = os.path.join(self.directory, f"batch_{sequence}.csv" + ("" if self.plain_text else ".zst.aes"))
+        with open(path, "wb") as file:
+            file.write(data)
+        with self._lock:
+            self.generation_seconds += time.perf_counter() - started
+        return path, len(data)
+
+
+class LatencyRecorder:
+    """
+    Collects the start and end, errors, rows and file bytes of every RPC call, per RPC.
+
+    Throughput is divided by each RPC's busy time, the time during which at least one call of it
+    was in flight, so time the client spends between calls (e.g. writing the next batch files)
+    does not count against the server.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Method -> [(started, finished)] of its calls, in time.perf_counter() seconds
+        self._intervals = {}
+        self._errors = {}
+        self._rows = {}
+        self._bytes = {}
+
+    def record(self, method, started, finished, ok, rows=0, size=0):
+        with self._lock:
+            self._intervals.setdefault(method, []).append((started, finished))
+            self._errors[method] = self._errors.get(method, 0) + (0 if ok else 1)
+            self._rows[method] = self._rows.get(method, 0) + rows
+            self._bytes[method] = self._bytes.get(method, 0) + size
+
+    def busy_seconds(self):
+        """Time during which at least one call of any RPC was in flight."""
+        with self._lock:
+            return _busy_seconds([interval for intervals in self._intervals.values() for interval in intervals])
+
+    def report(self):
+        """Return the statistics of each RPC, keyed by method name."""
+        report = {}
+        with self._lock:
+            for method, intervals in sorted(self._intervals.items()):
+                ordered = sorted(finished - started for started, finished in intervals)
+                # Guards against a zero busy time on clocks coarser than the calls
+                busy_seconds = _busy_seconds(intervals) or 1e-9
+                stats = {"calls": len(ordered), "errors": self._errors[method]}
+                for percentile in PERCENTILES:
+                    stats[f"p{percentile}_ms"] = _percentile(ordered, percentile) * 1000
+                stats["max_ms"] = ordered[-1] * 1000
+                stats["busy_seconds"] = busy_seconds
+                stats["calls_per_second"] = len(ordered) / busy_seconds
+                if self._rows[method] or self._bytes[method]:
+                    stats["rows"] = self._rows[method]
+                    stats["rows_per_second"] = self._rows[method] / busy_seconds
+                    stats["bytes"] = self._bytes[method]
+                    stats["bytes_per_second"] = self._bytes[method] / busy_seconds
+                report[method] = stats
+        return report
+
+
+def _busy_seconds(intervals):
+    # Length of the union of (started, finished) intervals
+    busy = 0.0
+    end = None
+    for started, finished in sorted(intervals):
+        if end is None or started > end:
+            busy += finished - started
+            end = finished
+        elif finished > end:
+            busy += finished - end
+            end = finished
+    return busy
+
+
+def _percentile(ordered, percentile):
+    # Nearest-rank percentile of sorted values
+    index = max(0, -(-len(ordered) * percentile // 100) - 1)
+    return ordered[index]
+
+
+def format_report(report, wall_seconds, busy_seconds, generation_seconds):
+    """Format a LatencyRecorder report as a table."""
+    lines = [f"{'RPC':<20}{'calls':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+             f"{'busy s':>9}{'calls/s':>10}{'rows/s':>12}{'MB/s':>9}"]
+    for method, stats in report.items():
+        rows_per_second = f"{stats['rows_per_second']:.0f}" if "rows" in stats else "-"
+        megabytes_per_second = f"{stats['bytes_per_second'] / 1e6:.2f}" if "bytes" in stats else "-"
+        lines.append(f"{method:<20}{stats['calls']:>8}{stats['errors']:>8}{stats['p50_ms']:>10.1f}"
+                     f"{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}"
+                     f"{stats['busy_seconds']:>9.2f}{stats['calls_per_second']:>10.2f}{rows_per_second:>12}"
+                     f"{megabytes_per_second:>9}")
+    lines.append(f"Wall time: {wall_seconds:.2f} s, RPCs in flight: {busy_seconds:.2f} s, "
+                 f"batch file generation: {generation_seconds:.2f} s (outside the RPC timings)")
+    return "\n".join(lines)
+
+
+class LoadClient:
+    """
+    Calls the destination's RPCs and records them. Batch files are written before a call starts,
+    so only the RPC itself is timed; the recorder's busy time leaves out the time in between.
+    """
+
+    def __init__(self, stub, recorder, configuration):
+        self.stub = stub
+        self.recorder = recorder
+        self.configuration = configuration
+
+    def call(self, method, request, rows=0, size=0):
+        """
+        Call an RPC and record it.
+
+        Returns:
+            The response, or None if the call failed with a gRPC error
+        """
+        started = time.perf_counter()
+        try:
+            response = getattr(self.stub, method)(request)
+        except grpc.RpcError as e:
+            self.recorder.record(method, started, time.perf_counter(), False, rows, size)
+            print(f"{method} failed: {e.code().name} {e.details()}", file=sys.stderr)
+            return None
+        finished = time.perf_counter()
+        outcome = response.WhichOneof("response")
+        ok = outcome in SUCCESSFUL_RESPONSES and (outcome != "success" or response.success)
+        if not ok:
+            print(f"{method} did not succeed: {outcome} {getattr(response, outcome) if outcome else ''}",
+                  file=sys.stderr)
+        self.recorder.record(method, started, finished, ok, rows, size)
+        return response
+
+    def describe_table(self, schema, name):
+        """The table as the destination describes it, or None if it does not exist."""
+        response = self.call("DescribeTable", destination_sdk_pb2.DescribeTableRequest(
+            configuration=self.configuration, schema_name=schema, table_name=name))
+        if response is None or response.WhichOneof("response") != "table":
+            return None
+        return response.table
+
+    def create_table(self, schema, table):
+        self.call("CreateTable", destination_sdk_pb2.CreateTableRequest(
+            configuration=self.configuration, schema_name=schema, table=table))
+
+    def ensure_table(self, schema, table):
+        """Create the table unless it exists; an existing table is reused."""
+        if self.describe_table(schema, table.name) is None:
+            self.create_table(schema, table)
+
+
+class SyntheticLoad:
+    """
+    Streams generated batch files through WriteBatch and WriteHistoryBatch.
+
+    `requests` requests are spread over the tables round robin and sent by `concurrency`
+    threads. Requests of the same table are sent one at a time, as Fivetran does.
+    """
+
+    def __init__(self, client, writer, args):
+        self.client = client
+        self.writer = writer
+        self.args = args
+        self.tables = [self._table(f"load_{index}", history=False) for index in range(args.tables)]
+        self.tables += [self._table(f"load_history_{index}", history=True) for index in range(args.history_tables)]
+        self._table_locks = {table.name: threading.Lock() for table in self.tables}
+        # History mode versions start after the versions of earlier runs, one millisecond apart per request
+        self._start = datetime.now(timezone.utc)
+        self._versions = {table.name: 0 for table in self.tables}
+
+    @staticmethod
+    def _table(name, history):
+        columns = list(SYNTHETIC_COLUMNS) + [_column(FIVETRAN_SYNCED, DataType.UTC_DATETIME)]
+        if history:
+            columns += [_column(FIVETRAN_START, DataType.UTC_DATETIME, primary_key=True),
+                        _column(FIVETRAN_END, DataType.UTC_DATETIME),
+                        _column(FIVETRAN_ACTIVE, DataType.BOOLEAN)]
+        else:
+            columns.append(_column(FIVETRAN_DELETED, DataType.BOOLEAN))
+        return common_pb2.Table(name=name, columns=columns)
+
+    def run(self):
+        for table in self.tables:
+            self.client.ensure_table(self.args.schema, table)
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as executor:
+            # list() re-raises the first exception of a request
+            list(executor.map(self._send, range(self.args.requests)))
+
+    def _send(self, sequence):
+        table = self.tables[sequence % len(self.tables)]
+        with self._table_locks[table.name]:
+            if _is_history_table(table):
+                method, request, rows, size = self._history_request(table)
+            else:
+                method, request, rows, size = self._live_request(table)
+            try:
+                self.client.call(method, request, rows, size)
+            finally:
+                if not self.args.keep_files:
+                    for path in request.keys:
+                        os.remove(path)
+
+    def _sample_ids(self, files):
+        return random.sample(range(self.args.key_space), self.args.rows * files)
+
+    def _row(self, key, synced):
+        return [key, f"name-{key}-{random.randrange(1_000_000)}", f"{random.randrange(100_000_000) / 100:.2f}",
+                repr(random.random()), "true" if random.random() < 0.5 else "false", synced,
+                base64.b64encode(os.urandom(self.args.value_bytes * 3 // 4 or 1)).decode("ascii")]
+
+    def _write(self, request, key, header, rows):
+        path, size = self.writer.write(header, rows, key)
+        request.keys[path] = key
+        return path, size
+
+    def _live_request(self, table):
+        args = self.args
+        key = os.urandom(32)
+        request = destination_sdk_pb2.WriteBatchRequest(
+            configuration=self.client.configuration, schema_name=args.schema, table=table,
+            file_params=self.writer.file_params)
+        header = [column.name for column in table.columns]
+        width = len(SYNTHETIC_COLUMNS)
+        synced = _now_text()
+        ids = iter(self._sample_ids(args.replace_files + args.update_files + args.delete_files))
+        size = 0
+        for _ in range(args.replace_files):
+            rows = [self._row(next(ids), synced) + [synced, "false"] for _ in range(args.rows)]
+            path, written = self._write(request, key, header, rows)
+            request.replace_files.append(path)
+            size += written
+        for _ in range(args.update_files):
+            rows = [[next(ids), f"updated-{random.randrange(1_000_000)}"] + [UNMODIFIED_STRING] * (width - 2)
+                    + [synced, UNMODIFIED_STRING] for _ in range(args.rows)]
+            path, written = self._write(request, key, header, rows)
+            request.update_files.append(path)
+            size += written
+        for _ in range(args.delete_files):
+            rows = [[next(ids)] + [NULL_STRING] * (width - 1) + [synced, NULL_STRING] for _ in range(args.rows)]
+            path, written = self._write(request, key, header, rows)
+            request.delete_files.append(path)
+            size += written
+        return "WriteBatch", request, args.rows * len(request.keys), size
+
+    def _history_request(self, table):
+        args = self.args
+        key = os.urandom(32)
+        request = destination_sdk_pb2.WriteHistoryBatchRequest(
+            configuration=self.client.configuration, schema_name=args.schema, table=table,
+            file_params=self.writer.file_params)
+        header = [column.name for column in table.columns]
+        width = len(SYNTHETIC_COLUMNS)
+        synced = _now_text()
+        self._versions[table.name] += 1
+        start = _utc_text(self._start + timedelta(milliseconds=self._versions[table.name]))
+        ids = iter(self._sample_ids(args.replace_files + args.update_files + args.delete_files))
+        started_ids = []
+        size = 0
+        for _ in range(args.replace_files):
+            rows = [self._row(next(ids), synced) + [synced, start, END_OF_TIME, "true"] for _ in range(args.rows)]
+            started_ids += [row[0] for row in rows]
+            path, written = self._write(request, key, header, rows)
+            request.replace_files.append(path)
+            size += written
+        for _ in range(args.update_files):
+            rows = [[next(ids), f"updated-{random.randrange(1_000_000)}"] + [UNMODIFIED_STRING] * (width - 2)
+                    + [synced, start, END_OF_TIME, "true"] for _ in range(args.rows)]
+            started_ids += [row[0] for row in rows]
+            path, written = self._write(request, key, header, rows)
+            request.update_files.append(path)
+            size += written
+        for _ in range(args.delete_files):
+            rows = [[next(ids)] + [NULL_STRING] * (width - 1) + [synced, NULL_STRING, start, NULL_STRING]
+                    for _ in range(args.rows)]
+            path, written = self._write(request, key, header, rows)
+            request.delete_files.append(path)
+            size += written
+        if started_ids:
+            path, written = self._write(request, key, ["id", FIVETRAN_START], [[key_id, start] for key_id in started_ids])
+            request.earliest_start_files.append(path)
+            size += written
+        return "WriteHistoryBatch", request, args.rows * (len(request.keys) - len(request.earliest_start_files)), size
+
+
+class ScenarioReplay:
+    """
+    Replays a destination tester scenario (`tools/destination-connector-tester/input-files/*.json`)
+    into one schema: create_table, alter_table, ops, schema_migration and describe_table, in
+    the order the tester runs them.
+    """
+
+    def __init__(self, client, writer, schema, keep_files=False):
+        self.client = client
+        self.writer = writer
+        self.schema = schema
+        self.keep_files = keep_files
+        # Current definition of each table, described again after migrations change it
+        self.tables = {}
+
+    def run(self, scenario):
+        for name, definition in scenario.get("create_table", {}).items():
+            table = self._table(name, definition)
+            self.client.create_table(self.schema, table)
+            self.tables[name] = table
+        for name, definition in scenario.get("alter_table", {}).items():
+            self._alter_table(self._table(name, definition), drop_columns=False)
+        for operation in scenario.get("ops", []):
+            for kind, argument in operation.items():
+                self._operation(kind, argument)
+        for migration in scenario.get("schema_migration", []):
+            for kind, entries in migration.items():
+                for entry in entries:
+                    self._migration(kind, entry)
+        for name in scenario.get("describe_table", []):
+            self.client.describe_table(self.schema, name)
+
+    @staticmethod
+    def _table(name, definition):
+        primary_key = definition.get("primary_key", [])
+        columns = []
+        for column_name, datatype in definition["columns"].items():
+            if isinstance(datatype, dict):
+                columns.append(_column(column_name, DataType.Value(datatype["type"]), column_name in primary_key,
+                                       datatype.get("precision"), datatype.get("scale")))
+            else:
+                columns.append(_column(column_name, DataType.Value(datatype), column_name in primary_key))
+        if not primary_key:
+            columns.insert(0, _column(FIVETRAN_ID, DataType.STRING, primary_key=True))
+        columns.append(_column(FIVETRAN_SYNCED, DataType.UTC_DATETIME))
+        if definition.get("history_mode"):
+            columns += [_column(FIVETRAN_START, DataType.UTC_DATETIME, primary_key=True),
+                        _column(FIVETRAN_END, DataType.UTC_DATETIME),
+                        _column(FIVETRAN_ACTIVE, DataType.BOOLEAN)]
+        else:
+            columns.append(_column(FIVETRAN_DELETED, DataType.BOOLEAN))
+        return common_pb2.Table(name=name, columns=columns)
+
+    def _current(self, name):
+        table = self.tables.get(name)
+        if table is None:
+            table = self.client.describe_table(self.schema, name)
+            if table is not None:
+                self.tables[name] = table
+        return table
+
+    def _alter_table(self, table, drop_columns):
+        self.client.call("AlterTable", destination_sdk_pb2.AlterTableRequest(
+            configuration=self.client.configuration, schema_name=self.schema, table=table,
+            drop_columns=drop_columns))
+        self.tables.pop(table.name, None)
+
+    def _operation(self, kind, argument):
+        if kind in ("truncate_before", "soft_truncate_before"):
+            for name in argument:
+                request = destination_sdk_pb2.TruncateRequest(
+                    configuration=self.client.configuration, schema_name=self.schema, table_name=name,
+                    synced_column=FIVETRAN_SYNCED, utc_delete_before=timestamp_pb2.Timestamp())
+                request.utc_delete_before.GetCurrentTime()
+                if kind == "soft_truncate_before":
+                    request.soft.deleted_column = FIVETRAN_DELETED
+                self.client.call("Truncate", request)
+            return
+        if kind not in ("upsert", "update", "delete", "soft_delete"):
+            print(f"Skipping unknown operation '{kind}'", file=sys.stderr)
+            return
+        for name, records in argument.items():
+            table = self._current(name)
+            if table is None:
+                print(f"Skipping '{kind}' of {self.schema}.{name}: the table does not exist", file=sys.stderr)
+                continue
+            if _is_history_table(table):
+                self._write_history(table, kind, records)
+            else:
+                self._write_live(table, kind, records)
+
+    def _values(self, table, record, missing, synced, overrides=None):
+        values = []
+        for column in table.columns:
+            if overrides and column.name in overrides:
+                values.append(overrides[column.name])
+            elif column.name == FIVETRAN_SYNCED:
+                values.append(synced)
+            elif column.name == FIVETRAN_ID and column.name not in record:
+                # Fivetran derives `_fivetran_id` from the row's values when the source has no primary key
+                values.append(hashlib.md5(json.dumps(
+                    {key: value for key, value in record.items() if key != "op_time"},
+                    sort_keys=True, default=str).encode("utf-8")).hexdigest())
+            elif column.name in record:
+                values.append(self._text(column, record[column.name]))
+            else:
+                values.append(missing)
+        return values
+
+    @staticmethod
+    def _text(column, value):
+        if value is None:
+            return NULL_STRING
+        if isinstance(value, bool):
+            return "true" if value else "false"
+        if isinstance(value, (dict, list)):
+            return json.dumps(value)
+        if column.type == DataType.BINARY:
+            return base64.b64encode(str(value).encode("utf-8")).decode("ascii")
+        return str(value)
+
+    def _write_live(self, table, kind, records):
+        synced = _now_text()
+        request = destination_sdk_pb2.WriteBatchRequest(
+            configuration=self.client.configuration, schema_name=self.schema, table=table,
+            file_params=self.writer.file_params)
+        if kind == "upsert":
+            rows = [self._values(table, record, NULL_STRING, synced, {FIVETRAN_DELETED: "false"}) for record in records]
+            files = request.replace_files
+        elif kind == "update":
+            rows = [self._values(table, record, UNMODIFIED_STRING, synced) for record in records]
+            files = request.update_files
+        elif kind == "soft_delete":
+            rows = [self._values(table, record, UNMODIFIED_STRING, synced, {FIVETRAN_DELETED: "true"})
+                    for record in records]
+            files = request.update_files
+        else:
+            rows = [self._values(table, record, NULL_STRING, synced) for record in records]
+            files = request.delete_files
+        self._send("WriteBatch", request, files, table, rows)
+
+    def _write_history(self, table, kind, records):
+        synced = _now_text()
+        request = destination_sdk_pb2.WriteHistoryBatchRequest(
+            configuration=self.client.configuration, schema_name=self.schema, table=table,
+            file_params=self.writer.file_params)
+        if kind in ("delete", "soft_delete"):
+            # Soft deletes end the active version in history mode
+            rows = [self._values(table, record, NULL_STRING, synced,
+                                 {FIVETRAN_END: record.get("op_time", synced), FIVETRAN_START: NULL_STRING,
+                                  FIVETRAN_ACTIVE: NULL_STRING})
+                    for record in records]
+            self._send("WriteHistoryBatch", request, request.delete_files, table, rows)
+            return
+        missing = NULL_STRING if kind == "upsert" else UNMODIFIED_STRING
+        rows = [self._values(table, record, missing, synced,
+                             {FIVETRAN_START: record.get("op_time", synced), FIVETRAN_END: END_OF_TIME,
+                              FIVETRAN_ACTIVE: "true"})
+                for record in records]
+        # Versions of a key in one file are chained: each ends 1 ms before the next one starts, and
+        # the earliest `_fivetran_start` of each key goes to the earliest start file
+        key_columns = [index for index, column in enumerate(table.columns)
+                       if column.primary_key and column.name != FIVETRAN_START]
+        names = [column.name for column in table.columns]
+        start_index, end_index, active_index = (names.index(FIVETRAN_START), names.index(FIVETRAN_END),
+                                                names.index(FIVETRAN_ACTIVE))
+        versions = {}
+        for row in rows:
+            versions.setdefault(tuple(row[index] for index in key_columns), []).append(row)
+        earliest = {}
+        for key_values, key_rows in versions.items():
+            key_rows.sort(key=lambda row: _parse_utc(row[start_index]))
+            for row, following in zip(key_rows, key_rows[1:]):
+                row[end_index] = _utc_text(_parse_utc(following[start_index]) - timedelta(milliseconds=1))
+                row[active_index] = "false"
+            earliest[key_values] = key_rows[0][start_index]
+        key = os.urandom(32)
+        header = [table.columns[index].name for index in key_columns] + [FIVETRAN_START]
+        path, size = self.writer.write(header, [list(key_values) + [start] for key_values, start in earliest.items()], key)
+        request.keys[path] = key
+        request.earliest_start_files.append(path)
+        self._send("WriteHistoryBatch", request,
+                   request.replace_files if kind == "upsert" else request.update_files, table, rows, key, size)
+
+    def _send(self, method, request, files, table, rows, key=None, size=0):
+        key = key or os.urandom(32)
+        path, written = self.writer.write([column.name for column in table.columns], rows, key)
+        request.keys[path] = key
+        files.append(path)
+        try:
+            self.client.call(method, request, len(rows), size + written)
+        finally:
+            if not self.keep_files:
+                for file_path in request.keys:
+                    os.remove(file_path)
+
+    def _migration(self, kind, entry):
+        configuration = self.client.configuration
+        name = entry.get("table", entry.get("from_table"))
+        if kind in ("add_column", "change_column_data_type", "drop_column"):
+            table = self._current(name)
+            if table is None:
+                print(f"Skipping '{kind}' of {self.schema}.{name}: the table does not exist", file=sys.stderr)
+                return
+            columns = [column for column in table.columns if column.name != entry["column"]]
+            if kind == "change_column_data_type":
+                columns = [_column(column.name, DataType.Value(entry["data_type"]), column.primary_key)
+                           if column.name == entry["column"] else column for column in table.columns]
+            elif kind == "add_column":
+                columns.append(_column(entry["column"], DataType.Value(entry["data_type"])))
+            self._alter_table(common_pb2.Table(name=name, columns=columns), drop_columns=kind == "drop_column")
+            return
+        details = destination_sdk_pb2.MigrationDetails(schema=self.schema, table=name)
+        if kind == "copy_column":
+            details.copy.copy_column.from_column = entry["from_column"]
+            details.copy.copy_column.to_column = entry["to_column"]
+        elif kind == "copy_table":
+            details.copy.copy_table.from_table = entry["from_table"]
+            details.copy.copy_table.to_table = entry["to_table"]
+        elif kind == "copy_table_to_history_mode":
+            details.copy.copy_table_to_history_mode.from_table = entry["from_table"]
+            details.copy.copy_table_to_history_mode.to_table = entry["to_table"]
+            details.copy.copy_table_to_history_mode.soft_deleted_column = entry.get("deleted_column", "")
+        elif kind == "update_column_value":
+            details.update_column_value.column = entry["column"]
+            details.update_column_value.value = entry["value"]
+        elif kind == "add_column_with_default_value":
+            details.add.add_column_with_default_value.column = entry["column"]
+            details.add.add_column_with_default_value.column_type = DataType.Value(entry["data_type"])
+            details.add.add_column_with_default_value.default_value = entry["default_value"]
+        elif kind == "add_column_in_history_mode":
+            details.add.add_column_in_history_mode.column = entry["column"]
+            details.add.add_column_in_history_mode.column_type = DataType.Value(entry["data_type"])
+            details.add.add_column_in_history_mode.default_value = entry["default_value"]
+            details.add.add_column_in_history_mode.operation_timestamp = entry["operation_timestamp"]
+        elif kind == "rename_column":
+            details.rename.rename_column.from_column = entry["from_column"]
+            details.rename.rename_column.to_column = entry["to_column"]
+        elif kind == "rename_table":
+            details.rename.rename_table.from_table = entry["from_table"]
+            details.rename.rename_table.to_table = entry["to_table"]
+        elif kind == "drop_table":
+            details.drop.drop_table = True
+        elif kind == "drop_column_in_history_mode":
+            details.drop.drop_column_in_history_mode.column = entry["column"]
+            details.drop.drop_column_in_history_mode.operation_timestamp = entry["operation_timestamp"]
+        elif kind in ("migrate_soft_delete_to_history", "migrate_history_to_soft_delete"):
+            migration = details.table_sync_mode_migration
+            migration.type = (destination_sdk_pb2.TableSyncModeMigrationType.SOFT_DELETE_TO_HISTORY
+                              if kind == "migrate_soft_delete_to_history"
+                              else destination_sdk_pb2.TableSyncModeMigrationType.HISTORY_TO_SOFT_DELETE)
+            migration.soft_deleted_column = entry.get("deleted_column", FIVETRAN_DELETED)
+        else:
+            # e.g. set_column_to_null: UpdateColumnValueOperation cannot carry a NULL value
+            print(f"Skipping schema migration '{kind}': it has no Migrate operation", file=sys.stderr)
+            return
+        self.client.call("Migrate", destination_sdk_pb2.MigrateRequest(configuration=configuration, details=details))
+        for table_name in (name, entry.get("to_table")):
+            self.tables.pop(table_name, None)
+
+
+def _scenario_paths(patterns):
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            raise SystemExit(f"No scenario file matches '{pattern}'")
+        paths += matches
+    return paths
+
+
+def _schema_suffix(path):
+    return re.sub(r"[^0-9a-zA-Z_]", "_", os.path.splitext(os.path.basename(path))[0])
+
+
+def replay(client, writer, args):
+    """Replay every scenario `--repeat` times, each copy into its own schema, `--concurrency` at a time."""
+    jobs = []
+    for path in _scenario_paths(args.replay):
+        with open(path) as file:
+            # Decimal keeps the digits of DECIMAL values that a float would round
+            scenario = json.load(file, parse_float=Decimal)
+        for copy in range(args.repeat):
+            jobs.append((f"{args.schema}_{_schema_suffix(path)}_{copy}", scenario))
+
+    def run(job):
+        schema, scenario = job
+        ScenarioReplay(client, writer, schema, args.keep_files).run(scenario)
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(run, jobs))
+
+
+def _configuration(pairs):
+    configuration = {}
+    for pair in pairs:
+        name, separator, value = pair.partition("=")
+        if not separator:
+            raise SystemExit(f"--configuration expects key=value, got '{pair}'")
+        configuration[name] = value
+    return configuration
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Load generator for the destination connector: streams synthetic batch files through "
+                    "WriteBatch and WriteHistoryBatch, or replays destination tester scenarios, and reports "
+                    "latency percentiles and throughput per RPC")
+    parser.add_argument("--host", default="localhost", help="Host of the destination server")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port of the destination server")
+    parser.add_argument("--schema", default=DEFAULT_SCHEMA,
+                        help="Schema of the synthetic tables; prefix of the schemas scenarios are replayed into")
+    parser.add_argument("--configuration", action="append", default=[], metavar="KEY=VALUE",
+                        help="Configuration entry sent with every request (repeatable)")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="Requests (or scenario replays) in flight at the same time")
+    parser.add_argument("--tables", type=int, default=None,
+                        help="Synthetic tables written with WriteBatch (default: --concurrency)")
+    parser.add_argument("--history-tables", type=int, default=0,
+                        help="Synthetic history mode tables written with WriteHistoryBatch")
+    parser.add_argument("--requests", type=int, default=100, help="Synthetic write requests sent in total")
+    parser.add_argument("--rows", type=int, default=1000, help="Rows per synthetic batch file")
+    parser.add_argument("--replace-files", type=int, default=1, help="Replace files per synthetic request")
+    parser.add_argument("--update-files", type=int, default=0, help="Update files per synthetic request")
+    parser.add_argument("--delete-files", type=int, default=0, help="Delete files per synthetic request")
+    parser.add_argument("--key-space", type=int, default=100_000,
+                        help="Primary key values synthetic rows are drawn from")
+    parser.add_argument("--value-bytes", type=int, default=64, help="Size of the payload column of synthetic rows")
+    parser.add_argument("--replay", action="append", default=[], metavar="FILE",
+                        help="Replay a destination tester scenario file instead of the synthetic load; "
+                             "accepts glob patterns (repeatable)")
+    parser.add_argument("--repeat", type=int, default=1, help="Copies of each replayed scenario")
+    parser.add_argument("--plain-text", action="store_true",
+                        help="Write uncompressed, unencrypted batch files instead of zstd + AES")
+    parser.add_argument("--work-dir", default=None,
+                        help="Directory the batch files are written to; the server must be able to read it "
+                             "(default: a temporary directory)")
+    parser.add_argument("--keep-files", action="store_true", help="Keep the batch files after each request")
+    parser.add_argument("--json", default=None, metavar="FILE", help="Also write the report to a JSON file")
+    args = parser.parse_args(argv)
+    if args.tables is None:
+        args.tables = args.concurrency
+    if min(args.concurrency, args.requests, args.rows, args.repeat) < 1:
+        parser.error("--concurrency, --requests, --rows and --repeat must be at least 1")
+    if not args.replay:
+        if args.tables + args.history_tables < 1:
+            parser.error("The synthetic load needs at least one table")
+        files = args.replace_files + args.update_files + args.delete_files
+        if files < 1:
+            parser.error("Synthetic requests need at least one replace, update or delete file")
+        if args.rows * files > args.key_space:
+            parser.error("--key-space must hold the rows of all files of a request (--rows times the file count)")
+    return args
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="load_generator_")
+    os.makedirs(work_dir, exist_ok=True)
+    recorder = LatencyRecorder()
+    writer = BatchFileWriter(os.path.abspath(work_dir), plain_text=args.plain_text)
+    channel = grpc.insecure_channel(f"{args.host}:{args.port}")
+    client = LoadClient(destination_sdk_pb2_grpc.DestinationConnectorStub(channel), recorder,
+                        _configuration(args.configuration))
+    started = time.perf_counter()
+    try:
+        if args.replay:
+            replay(client, writer, args)
+        else:
+            SyntheticLoad(client, writer, args).run()
+    finally:
+        wall_seconds = time.perf_counter() - started
+        channel.close()
+        if args.work_dir is None and not args.keep_files:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    report = recorder.report()
+    busy_seconds = recorder.busy_seconds()
+    print(format_report(report, wall_seconds, busy_seconds, writer.generation_seconds))
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"wall_seconds": wall_seconds, "busy_seconds": busy_seconds,
+                       "generation_seconds": writer.generation_seconds, "rpcs": report}, file, indent=2)
+    # Exit with an error status if any call failed, so the generator can gate scripts
+    return 1 if any(stats["errors"] for stats in report.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,168 @@
+import atexit
+import json
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+INFO = "INFO"
+WARNING = "WARNING"
+SEVERE = "SEVERE"
+# Levels in increasing severity; messages below the configured level are discarded
+LEVELS = {INFO: 0, WARNING: 1, SEVERE: 2}
+MESSAGE_ORIGIN = "sdk_destination"
+
+# Log lines waiting for the writer thread; when full, INFO lines are dropped and others wait
+LOG_QUEUE_SIZE = 10_000
+# Lines written to stdout with a single write call
+WRITE_BATCH_LINES = 512
+# At most this many identical messages are written per window; the repeats are counted instead
+RATE_LIMIT_MESSAGES = 5
+RATE_LIMIT_WINDOW_SECONDS = 10.0
+# Distinct messages tracked by the rate limiter; beyond this the oldest windows are forgotten
+RATE_LIMIT_TRACKED_MESSAGES = 10_000
+
+
+class AsyncLogWriter:
+    """
+    Writes log messages as the JSON lines the SDK expects, from a background thread.
+
+    Callers only filter by level, rate limit and enqueue, so a log call costs no stdout write:
+    the writer thread formats the queued messages and writes them in batches. Identical
+    messages beyond RATE_LIMIT_MESSAGES per RATE_LIMIT_WINDOW_SECONDS (e.g. the same type
+    mapping for every column of a wide table) are counted and summarized in one line.
+    """
+
+    def __init__(self, min_level=INFO, stream=None):
+        """
+        Args:
+            min_level: Lowest level that is written
+            stream: File to write to; defaults to the current sys.stdout
+        """
+        self.min_level = min_level
+        self._stream = stream
+        self._queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        # (level, message) -> [window start, messages in window, repeats suppressed], oldest window first
+        self._windows = OrderedDict()
+        self._dropped = 0
+        self._thread = None
+
+    def log(self, level, message):
+        if LEVELS.get(level, LEVELS[SEVERE]) < LEVELS[self.min_level]:
+            return
+        with self._lock:
+            pending = self._rate_limit(level, message)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+        for item in pending:
+            self._enqueue(*item)
+
+    def flush(self):
+        """Wait until every queued message and pending repeat summary is written."""
+        with self._lock:
+            pending = [self._summary(key, window) for key, window in self._windows.items() if window[2]]
+            for window in self._windows.values():
+                window[2] = 0
+            started = self._thread is not None
+        for item in pending:
+            self._enqueue(*item)
+        if started:
+            self._queue.join()
+
+    def _rate_limit(self, level, message):
+        """Return the (level, message) lines to write for a log call. Call with the lock held."""
+        now = time.monotonic()
+        key = (level, message)
+        window = self._windows.get(key)
+        lines = []
+        if window is None or now - window[0] >= RATE_LIMIT_WINDOW_SECONDS:
+            if window is not None and window[2]:
+                lines.append(self._summary(key, window))
+            if window is None:
+                lines.extend(self._prune(now))
+            window = self._windows[key] = [now, 0, 0]
+            self._windows.move_to_end(key)
+        if window[1] < RATE_LIMIT_MESSAGES:
+            window[1] += 1
+            lines.append(key)
+        else:
+            window[2] += 1
+        return lines
+
+    def _prune(self, now):
+        """Forget expired windows, and the oldest ones beyond RATE_LIMIT_TRACKED_MESSAGES."""
+        summaries = []
+        while self._windows:
+            key, window = next(iter(self._windows.items()))
+            if now - window[0] < RATE_LIMIT_WINDOW_SECONDS and len(self._windows) < RATE_LIMIT_TRACKED_MESSAGES:
+                break
+            if window[2]:
+                summaries.append(self._summary(key, window))
+            del self._windows[key]
+        return summaries
+
+    def _summary(self, key, window):
+        level, message = key
+        return level, f"Suppressed {window[2]} repeats of: {message}"
+
+    def _enqueue(self, level, message):
+        if level == INFO:
+            try:
+                self._queue.put_nowait((level, message))
+            except queue.Full:
+                with self._lock:
+                    self._dropped += 1
+            return
+        self._queue.put((level, message))
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            try:
+                while len(items) < WRITE_BATCH_LINES:
+                    items.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            with self._lock:
+                dropped, self._dropped = self._dropped, 0
+            if dropped:
+                items.append((WARNING, f"Dropped {dropped} INFO log messages because the log queue was full"))
+            try:
+                stream = self._stream or sys.stdout
+                stream.write("".join(format_line(level, message) for level, message in items))
+                stream.flush()
+            except Exception:
+                # Logging must never take the connector down
+                pass
+            finally:
+                for _ in range(len(items) - (1 if dropped else 0)):
+                    self._queue.task_done()
+
+
+def format_line(level, message):
+    """Format one log line exactly as the SDK expects it."""
+    return f'{{"level": "{level}", "message": {json.dumps(message)}, "message-origin": "{MESSAGE_ORIGIN}"}}\n'
+
+
+_writer = AsyncLogWriter()
+atexit.register(_writer.flush)
+
+
+def log_message(level, message):
+    """Log a message at the given level (INFO, WARNING or SEVERE) through the shared writer."""
+    _writer.log(level, message)
+
+
+def set_level(level):
+    """Set the lowest level that is written."""
+    if level not in LEVELS:
+        raise ValueError(f"Unknown log level '{level}', expected one of {list(LEVELS)}")
+    _writer.min_level = level
+
+
+def flush():
+    """Wait until all logged messages are written, e.g. before the process exits."""
+    _writer.flush()
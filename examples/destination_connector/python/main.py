@@ -1,17 +1,23 @@
 from concurrent import futures
+from contextlib import contextmanager
 import grpc
-import read_csv
 import sys
 import argparse
 import socket
+import threading
 sys.path.append('sdk_pb2')
 
 from sdk_pb2 import destination_sdk_pb2
 from sdk_pb2 import common_pb2
 from sdk_pb2 import destination_sdk_pb2_grpc
-from schema_migration_helper import SchemaMigrationHelper
-from duckdb_helper import DuckDBHelper
-from table_operations_helper import TableOperationsHelper
+import log_helper
+import metrics_helper
+import profiling_helper
+from log_helper import log_message
+from duckdb_helper import STORAGE_LAYOUTS, STORAGE_LAYOUT_SINGLE_FILE
+from resource_governor import OPERATION_SCHEMA
+# DuckDB, the batch file decoders and the helpers built on them are imported by
+# DestinationImpl._open(), so that the server is reachable before they are loaded
 
 
 INFO = "INFO"
@@ -22,22 +28,70 @@ class DestinationImpl(destination_sdk_pb2_grpc.DestinationConnectorServicer):
     # DuckDB helper for data persistence
     # To use in-memory storage instead, pass ":memory:" to DuckDBHelper
     db_helper = None
+    # Set by the --storage-layout option before the first DestinationImpl is created
+    storage_layout = STORAGE_LAYOUT_SINGLE_FILE
+    # Background CHECKPOINT and table rewrites for the database file, shared like db_helper
+    maintenance_helper = None
+    # Threads, memory and spill directory budgets for DuckDB, shared like db_helper
+    resource_governor = None
+    # Set by the --lazy-startup option: open DuckDB on the first RPC that needs it, not at startup
+    lazy_startup = False
     default_schema = "fivetran_destination"
+    # ConfigurationFormResponse, built on the first ConfigurationForm call and served from then on
+    _configuration_form = None
+    _open_lock = threading.Lock()
 
     def __init__(self):
         super().__init__()
-        # Initialize DuckDB helper
-        # To use in-memory storage instead, pass ":memory:" to DuckDBHelper
-        if DestinationImpl.db_helper is None:
-            DestinationImpl.db_helper = DuckDBHelper("destination.db")
+        self.migration_helper = None
+        self.table_operations_helper = None
+        self.write_batch_helper = None
+        if not DestinationImpl.lazy_startup:
+            self._open()
 
-        self.migration_helper = SchemaMigrationHelper(DestinationImpl.db_helper)
-        self.table_operations_helper = TableOperationsHelper(DestinationImpl.db_helper)
+    def _open(self):
+        """
+        Open DuckDB and create the helpers, unless that is done already.
 
+        Called by every RPC that uses the database, so with lazy startup the first such RPC
+        pays for importing DuckDB and the batch file decoders and for opening the database
+        (including replaying its WAL), while ConfigurationForm and Test are answered at once.
+        """
+        if self.write_batch_helper is not None:
+            return
+        with DestinationImpl._open_lock:
+            if self.write_batch_helper is not None:
+                return
+            from duckdb_helper import DuckDBHelper
+            from maintenance_helper import MaintenanceHelper
+            from resource_governor import ResourceGovernor
+            from schema_migration_helper import SchemaMigrationHelper
+            from table_operations_helper import TableOperationsHelper
+            from write_batch_helper import WriteBatchHelper
+
+            # To use in-memory storage instead, pass ":memory:" to DuckDBHelper
+            if DestinationImpl.db_helper is None:
+                DestinationImpl.db_helper = DuckDBHelper("destination.db", DestinationImpl.storage_layout)
+            if DestinationImpl.resource_governor is None:
+                DestinationImpl.resource_governor = ResourceGovernor(DestinationImpl.db_helper)
+            if DestinationImpl.maintenance_helper is None:
+                DestinationImpl.maintenance_helper = MaintenanceHelper(
+                    DestinationImpl.db_helper, resource_governor=DestinationImpl.resource_governor)
+                DestinationImpl.maintenance_helper.start()
+
+            self.migration_helper = SchemaMigrationHelper(DestinationImpl.db_helper)
+            self.table_operations_helper = TableOperationsHelper(DestinationImpl.db_helper)
+            self.write_batch_helper = WriteBatchHelper(DestinationImpl.db_helper, DestinationImpl.maintenance_helper,
+                                                       DestinationImpl.resource_governor)
 
     def ConfigurationForm(self, request, context):
         log_message(INFO, "Fetching Configuration form")
+        # The form never changes, so it is built once and the same message is served every time
+        if DestinationImpl._configuration_form is None:
+            DestinationImpl._configuration_form = self._build_configuration_form()
+        return DestinationImpl._configuration_form
 
+    def _build_configuration_form(self):
         # Create the form fields
         form_fields = common_pb2.ConfigurationFormResponse(
             schema_selection_supported=True,
@@ -154,6 +208,42 @@ class DestinationImpl(destination_sdk_pb2_grpc.DestinationConnectorServicer):
             default_value="standard_pooling"
         )
 
+        # clusterBy text field
+        cluster_by = common_pb2.FormField(
+            name="clusterBy",
+            label="Cluster By",
+            description="Sort loaded rows by 'primary_key' or by a column such as _fivetran_synced; "
+                        "leave empty to keep arrival order",
+            text_field=common_pb2.TextField.PlainText,
+            required=False,
+            default_value=""
+        )
+
+        # Resource limits for DuckDB (see resource_governor.py)
+        threads = common_pb2.FormField(
+            name="threads",
+            label="Threads",
+            description="Maximum number of threads DuckDB may use; leave empty to use all cores",
+            text_field=common_pb2.TextField.PlainText,
+            required=False
+        )
+
+        memory_limit = common_pb2.FormField(
+            name="memoryLimit",
+            label="Memory Limit",
+            description="Maximum memory DuckDB may use, e.g. 4GB; leave empty for 80% of the physical memory",
+            text_field=common_pb2.TextField.PlainText,
+            required=False
+        )
+
+        spill_directory = common_pb2.FormField(
+            name="spillDirectory",
+            label="Spill Directory",
+            description="Directory for data that does not fit in the memory limit",
+            text_field=common_pb2.TextField.PlainText,
+            required=False
+        )
+
         # uploadFile upload field
         upload_file = common_pb2.FormField(
             name="uploadFile",
@@ -229,6 +319,10 @@ class DestinationImpl(destination_sdk_pb2_grpc.DestinationConnectorServicer):
             conditional_field_for_database,
             enable_encryption,
             pooling_field,
+            cluster_by,
+            threads,
+            memory_limit,
+            spill_directory,
             upload_file
         ])
 
@@ -250,54 +344,63 @@ class DestinationImpl(destination_sdk_pb2_grpc.DestinationConnectorServicer):
         log_message(INFO, "test name: " + test_name)
         return common_pb2.TestResponse(success=True)
 
+    @contextmanager
+    def _schema_operation(self, configuration, schema_name, table_name):
+        """
+        Budget a schema-changing RPC as a schema operation of the ResourceGovernor.
+
+        The table is also held like a batch write (MaintenanceHelper.table_write()), so background
+        rewrites and checkpoints never run while its schema changes.
+        """
+        self._open()
+        DestinationImpl.resource_governor.configure(configuration)
+        with DestinationImpl.resource_governor.operation(OPERATION_SCHEMA), \
+                DestinationImpl.maintenance_helper.table_write(schema_name or self.default_schema, table_name):
+            yield
+
     def CreateTable(self, request, context):
         """
         Handle table creation.
         Implementation details are in table_operations_helper.py.
         """
-        return self.table_operations_helper.create_table(request, self.default_schema)
+        with self._schema_operation(request.configuration, request.schema_name, request.table.name):
+            return self.table_operations_helper.create_table(request, self.default_schema)
 
     def AlterTable(self, request, context):
         """
         Handle table alterations (add columns, change types, modify primary keys, drop columns).
         Implementation details are in table_operations_helper.py.
         """
-        return self.table_operations_helper.alter_table(request, request.schema_name, self.default_schema)
+        with self._schema_operation(request.configuration, request.schema_name, request.table.name):
+            return self.table_operations_helper.alter_table(request, request.schema_name, self.default_schema)
 
     def Truncate(self, request, context):
         """
         Handle table truncation (both hard and soft truncate).
         Implementation details are in table_operations_helper.py.
         """
-        return self.table_operations_helper.truncate_table(request, self.default_schema)
+        with self._schema_operation(request.configuration, request.schema_name, request.table_name):
+            return self.table_operations_helper.truncate_table(request, self.default_schema)
 
     def WriteBatch(self, request, context):
         """
         Write batch data to the destination.
 
-        This example implementation decrypts and prints batch files for demonstration purposes.
-        For production use, implement your data loading logic here to process REPLACE, UPDATE,
-        and DELETE files and write them to your destination.
+        Replace, update and delete files are loaded into DuckDB in that order, in one transaction.
+        The rows of each kind of file are deduplicated by primary key before they are applied.
+        Implementation details are in write_batch_helper.py.
 
         See: https://github.com/fivetran/fivetran_partner_sdk/blob/main/development-guide/destination-connector-development-guide.md#writebatchrequest
         """
         for replace_file in request.replace_files:
-            print("replace files: " + str(replace_file))
+            log_message(INFO, "replace files: " + str(replace_file))
         for update_file in request.update_files:
-            print("update files: " + str(update_file))
+            log_message(INFO, "update files: " + str(update_file))
         for delete_file in request.delete_files:
-            print("delete files: " + str(delete_file))
+            log_message(INFO, "delete files: " + str(delete_file))
 
-        log_message(WARNING, "Data loading started for table " + request.table.name)
-        for key, value in request.keys.items():
-            print("----------------------------------------------------------------------------")
-            print("Decrypting and printing file :" + str(key))
-            print("----------------------------------------------------------------------------")
-            read_csv.decrypt_file(key, value)
-        log_message(INFO, "\nData loading completed for table " + request.table.name + "\n")
-
-        res: destination_sdk_pb2.WriteBatchResponse = destination_sdk_pb2.WriteBatchResponse(success=True)
-        return res
+        self._open()
+        return self.write_batch_helper.write_batch(request, self.default_schema)
 
     def WriteHistoryBatch(self, request, context):
         '''
@@ -335,39 +438,32 @@ class DestinationImpl(destination_sdk_pb2_grpc.DestinationConnectorServicer):
              - Update `_fivetran_end` to match the corresponding record’s end timestamp from the batch file.
 
         This structured processing ensures data consistency and historical tracking in the destination table.
-        This example implementation decrypts and prints history mode batch files for demonstration purposes.
-        For production use, implement your data loading logic here to process history mode-specific batch files
-        (earliest_start_files, replace_files, update_files, delete_files) and write them to your destination
-        while maintaining history tracking with _fivetran_start, _fivetran_end, and _fivetran_active columns.
+        Implementation details are in write_batch_helper.py. Each batch file is decoded once per request
+        into a DecodedFileCache (decoded_file_cache.py), which every phase reads from.
 
         See: https://github.com/fivetran/fivetran_partner_sdk/blob/main/development-guide/destination-connector-development-guide.md#writehistorybatchrequest
         '''
         for earliest_start_file in request.earliest_start_files:
-            print("earliest_start files: " + str(earliest_start_file))
+            log_message(INFO, "earliest_start files: " + str(earliest_start_file))
         for replace_file in request.replace_files:
-            print("replace files: " + str(replace_file))
+            log_message(INFO, "replace files: " + str(replace_file))
         for update_file in request.update_files:
-            print("update files: " + str(update_file))
+            log_message(INFO, "update files: " + str(update_file))
         for delete_file in request.delete_files:
-            print("delete files: " + str(delete_file))
-
-        log_message(WARNING, "Data loading started for table " + request.table.name)
-        for key, value in request.keys.items():
-            print("----------------------------------------------------------------------------")
-            print("Decrypting and printing file :" + str(key))
-            print("----------------------------------------------------------------------------")
-            read_csv.decrypt_file(key, value)
-        log_message(INFO, "\nData loading completed for table " + request.table.name + "\n")
+            log_message(INFO, "delete files: " + str(delete_file))
 
-        res: destination_sdk_pb2.WriteBatchResponse = destination_sdk_pb2.WriteBatchResponse(success=True)
-        return res
+        self._open()
+        return self.write_batch_helper.write_history_batch(request, self.default_schema)
 
     def DescribeTable(self, request, context):
         """
         Handle table description/metadata retrieval.
         Implementation details are in table_operations_helper.py.
         """
-        return self.table_operations_helper.describe_table(request, self.default_schema)
+        self._open()
+        DestinationImpl.resource_governor.configure(request.configuration)
+        with DestinationImpl.resource_governor.operation(OPERATION_SCHEMA):
+            return self.table_operations_helper.describe_table(request, self.default_schema)
 
     def Migrate(self, request, context):
         """
@@ -391,27 +487,28 @@ class DestinationImpl(destination_sdk_pb2_grpc.DestinationConnectorServicer):
 
         response = None
 
-        if operation_case == "drop":
-            response = self.migration_helper.handle_drop(details.drop, schema, table)
+        with self._schema_operation(request.configuration, schema, table):
+            if operation_case == "drop":
+                response = self.migration_helper.handle_drop(details.drop, schema, table)
 
-        elif operation_case == "copy":
-            response = self.migration_helper.handle_copy(details.copy, schema, table)
+            elif operation_case == "copy":
+                response = self.migration_helper.handle_copy(details.copy, schema, table)
 
-        elif operation_case == "rename":
-            response = self.migration_helper.handle_rename(details.rename, schema, table)
+            elif operation_case == "rename":
+                response = self.migration_helper.handle_rename(details.rename, schema, table)
 
-        elif operation_case == "add":
-            response = self.migration_helper.handle_add(details.add, schema, table)
+            elif operation_case == "add":
+                response = self.migration_helper.handle_add(details.add, schema, table)
 
-        elif operation_case == "update_column_value":
-            response = self.migration_helper.handle_update_column_value(details.update_column_value, schema, table)
+            elif operation_case == "update_column_value":
+                response = self.migration_helper.handle_update_column_value(details.update_column_value, schema, table)
 
-        elif operation_case == "table_sync_mode_migration":
-            response = self.migration_helper.handle_table_sync_mode_migration(details.table_sync_mode_migration, schema, table)
+            elif operation_case == "table_sync_mode_migration":
+                response = self.migration_helper.handle_table_sync_mode_migration(details.table_sync_mode_migration, schema, table)
 
-        else:
-            log_message(WARNING, "[Migrate] Unsupported or missing operation")
-            response = destination_sdk_pb2.MigrateResponse(unsupported=True)
+            else:
+                log_message(WARNING, "[Migrate] Unsupported or missing operation")
+                response = destination_sdk_pb2.MigrateResponse(unsupported=True)
 
         # Example: to return a warning instead:
         # response = destination_sdk_pb2.MigrateResponse(
@@ -428,10 +525,9 @@ class DestinationImpl(destination_sdk_pb2_grpc.DestinationConnectorServicer):
 
         return response
 
-def log_message(level, message):
-    import json
-    escaped_message = json.dumps(message)
-    print(f'{{"level": "{level}", "message": {escaped_message}, "message-origin": "sdk_destination"}}')
+def log_first_response(method, seconds):
+    """Report the time to first response, which cold-starting pods pay on every sync."""
+    log_message(INFO, f"First response ({method}) {seconds:.3f}s after process start")
 
 def is_port_in_use(port):
     """Check if a port is already in use."""
@@ -446,16 +542,34 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("--port", type=int, default=50052,
                         help="The server port")
+    parser.add_argument("--storage-layout", choices=STORAGE_LAYOUTS, default=STORAGE_LAYOUT_SINGLE_FILE,
+                        help="Keep all schemas in destination.db, or give each schema its own database file")
+    parser.add_argument("--log-level", choices=list(log_helper.LEVELS), default=log_helper.INFO,
+                        help="Lowest level of the log messages that are written")
+    parser.add_argument("--lazy-startup", action="store_true",
+                        help="Start serving before DuckDB is loaded and opened; the first RPC that needs it does that")
+    metrics_helper.add_arguments(parser)
+    profiling_helper.add_arguments(parser)
     args = parser.parse_args()
+    DestinationImpl.storage_layout = args.storage_layout
+    DestinationImpl.lazy_startup = args.lazy_startup
+    log_helper.set_level(args.log_level)
 
     # Check if port is already in use BEFORE initializing database connection
     if is_port_in_use(args.port):
         raise RuntimeError(f"Port {args.port} is already in use. Another server may be running.")
 
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=1))
+    interceptors = [metrics_helper.MetricsInterceptor(on_first_response=log_first_response)]
+    profiler = profiling_helper.profiler_from_args(args, log_message)
+    if profiler:
+        interceptors.append(profiling_helper.ProfilingInterceptor(profiler))
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=1), interceptors=interceptors)
     destination_sdk_pb2_grpc.add_DestinationConnectorServicer_to_server(DestinationImpl(), server)
     server.add_insecure_port(f'[::]:{args.port}')
+    metrics_exporter = metrics_helper.exporter_from_args(args)
     try:
+        if metrics_exporter:
+            metrics_exporter.start()
         server.start()
         print(f"Destination gRPC server started on port {args.port}...")
         server.wait_for_termination()
@@ -465,7 +579,13 @@ if __name__ == '__main__':
         print("Shutting down server...")
         # Stop server first with grace period to allow in-flight requests to complete
         server.stop(grace=5)
+        # Let a running maintenance round finish before the database is closed
+        if DestinationImpl.maintenance_helper:
+            DestinationImpl.maintenance_helper.stop()
         # Close database connection after all requests have finished
         if DestinationImpl.db_helper:
             DestinationImpl.db_helper.close()
+        if metrics_exporter:
+            metrics_exporter.stop()
+        log_helper.flush()
         print("Destination gRPC server terminated...")
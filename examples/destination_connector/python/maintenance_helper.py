@@ -0,0 +1,230 @@
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from log_helper import log_message
+from resource_governor import OPERATION_MAINTENANCE
+
+INFO = "INFO"
+WARNING = "WARNING"
+
+# How often the scheduler thread looks at the database
+MAINTENANCE_INTERVAL_SECONDS = 30
+# Checkpoint as soon as the WAL is this large, even while batches keep arriving
+WAL_CHECKPOINT_BYTES = 64 * 1024 * 1024  # 64 MiB
+# Checkpoint whatever the WAL holds once no batch was written for this long
+IDLE_CHECKPOINT_SECONDS = 60
+# DuckDB's own checkpoint on commit only triggers beyond this WAL size, as a safety net; below it
+# checkpoints are left to the scheduler so that they do not stall the commit of a WriteBatch
+AUTOMATIC_CHECKPOINT_THRESHOLD = "1GB"
+# A table is rewritten once this many rows, and this fraction of the table, changed since its last rewrite
+REWRITE_MIN_CHANGED_ROWS = 100_000
+REWRITE_MIN_CHANGED_FRACTION = 0.25
+
+
+class MaintenanceHelper:
+    """
+    Background maintenance of the DuckDB database file.
+
+    Updates and deletes leave the old row versions in the WAL until a checkpoint, and deleted
+    rows keep their row groups half empty, so under sustained churn the WAL grows, startup
+    replays more of it, and scans read mostly dead rows. A scheduler thread therefore:
+      - rewrites tables whose churn counters (rows changed by WriteBatch/WriteHistoryBatch) are
+        high relative to their size, in their clustering order if they have one, which packs
+        the live rows into fresh row groups and frees the old blocks for reuse
+      - runs CHECKPOINT when a WAL reaches WAL_CHECKPOINT_BYTES, when the server has been idle
+        for IDLE_CHECKPOINT_SECONDS, or after a rewrite; in the per-schema storage layout every
+        attached database file has its own WAL and is checkpointed separately
+
+    Maintenance never overlaps a batch write or a schema change: writers and the schema RPCs
+    (CreateTable, AlterTable, Truncate, Migrate) announce themselves with `table_write()`, a table
+    is only rewritten while nobody writes to it, and a checkpoint (which covers the whole database)
+    holds back new writers and waits for the running ones to finish. Writers that arrive during
+    maintenance wait for it to finish.
+    """
+
+    def __init__(self, db_helper, interval_seconds=MAINTENANCE_INTERVAL_SECONDS, resource_governor=None):
+        """
+        Args:
+            db_helper: DuckDBHelper of the destination
+            interval_seconds: Seconds between two maintenance rounds
+            resource_governor: Optional ResourceGovernor; rewrites and checkpoints then run with
+                the small maintenance budget
+        """
+        self.db_helper = db_helper
+        self.interval_seconds = interval_seconds
+        self.resource_governor = resource_governor
+        self._condition = threading.Condition()
+        # (schema, table) -> number of batches currently writing to it
+        self._active_writes = {}
+        # Tables being rewritten; the whole database while checkpointing
+        self._maintained_tables = set()
+        self._checkpointing = False
+        # (schema, table) -> {"changed_rows": ..., "cluster_columns": [...]}
+        self._churn = {}
+        self._last_write = time.monotonic()
+        self._changes_since_checkpoint = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the scheduler thread. In-memory databases have no WAL and are not maintained."""
+        if self.db_helper.db_path == ":memory:" or self._thread is not None:
+            return
+        self.db_helper.get_connection().execute(f"SET checkpoint_threshold = '{AUTOMATIC_CHECKPOINT_THRESHOLD}'")
+        self._thread = threading.Thread(target=self._run, name="maintenance", daemon=True)
+        self._thread.start()
+        log_message(INFO, f"Maintenance scheduler started (every {self.interval_seconds}s)")
+
+    def stop(self):
+        """Stop the scheduler thread, waiting for a running maintenance round to finish."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        log_message(INFO, "Maintenance scheduler stopped")
+
+    @contextmanager
+    def table_write(self, schema_name, table_name):
+        """
+        Context manager around a batch write or schema change of a table.
+
+        Waits while the table is rewritten or the database is checkpointed, and keeps
+        maintenance away from the table until the block exits.
+        """
+        key = (schema_name, table_name)
+        with self._condition:
+            self._condition.wait_for(lambda: not self._checkpointing and key not in self._maintained_tables)
+            self._active_writes[key] = self._active_writes.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._active_writes[key] -= 1
+                if not self._active_writes[key]:
+                    del self._active_writes[key]
+                self._last_write = time.monotonic()
+                self._condition.notify_all()
+
+    def record_changes(self, schema_name, table_name, changed_rows, cluster_columns=None):
+        """Add the rows changed by a committed batch to the table's churn counter."""
+        if not changed_rows:
+            return
+        with self._condition:
+            churn = self._churn.setdefault((schema_name, table_name), {"changed_rows": 0, "cluster_columns": []})
+            churn["changed_rows"] += changed_rows
+            if cluster_columns is not None:
+                churn["cluster_columns"] = list(cluster_columns)
+            self._changes_since_checkpoint = True
+
+    def run_once(self):
+        """Run one maintenance round: rewrite the tables that are due, then checkpoint if due."""
+        rewritten = 0
+        for key in self._tables_due():
+            with self._operation():
+                if self._rewrite_table(key):
+                    rewritten += 1
+        if rewritten or self._checkpoint_due():
+            with self._operation():
+                self._checkpoint()
+
+    def _operation(self):
+        if self.resource_governor is None:
+            return nullcontext()
+        return self.resource_governor.operation(OPERATION_MAINTENANCE)
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.run_once()
+            except Exception as e:
+                log_message(WARNING, f"Maintenance round failed: {str(e)}")
+
+    def _tables_due(self):
+        with self._condition:
+            candidates = [(key, churn["changed_rows"]) for key, churn in self._churn.items()
+                          if churn["changed_rows"] >= REWRITE_MIN_CHANGED_ROWS]
+        due = []
+        for key, changed_rows in candidates:
+            if not self.db_helper.table_exists(*key):
+                with self._condition:
+                    self._churn.pop(key, None)
+                continue
+            if changed_rows >= self.db_helper.row_count(*key) * REWRITE_MIN_CHANGED_FRACTION:
+                due.append(key)
+        return due
+
+    def _rewrite_table(self, key):
+        """Rewrite a table unless a batch is writing to it; it is retried next round otherwise."""
+        with self._condition:
+            if key in self._active_writes:
+                return False
+            self._maintained_tables.add(key)
+            churn = self._churn[key]
+            changed_rows, cluster_columns = churn["changed_rows"], churn["cluster_columns"]
+        try:
+            schema_name, table_name = key
+            with self.db_helper.transaction():
+                if cluster_columns:
+                    self.db_helper.recluster_table(schema_name, table_name, cluster_columns)
+                else:
+                    self.db_helper.rebuild_table(schema_name, self.db_helper.describe_table(schema_name, table_name))
+            with self._condition:
+                churn["changed_rows"] -= changed_rows
+            log_message(INFO, f"Rewrote {schema_name}.{table_name} after {changed_rows} changed rows")
+            return True
+        except Exception as e:
+            log_message(WARNING, f"Rewriting {key[0]}.{key[1]} failed: {str(e)}")
+            return False
+        finally:
+            with self._condition:
+                self._maintained_tables.discard(key)
+                self._condition.notify_all()
+
+    def _checkpoint_due(self):
+        wal_bytes = self._wal_bytes()
+        if wal_bytes >= WAL_CHECKPOINT_BYTES:
+            return True
+        with self._condition:
+            idle = not self._active_writes and time.monotonic() - self._last_write >= IDLE_CHECKPOINT_SECONDS
+            return idle and (wal_bytes > 0 or self._changes_since_checkpoint)
+
+    def _checkpoint(self):
+        """
+        Checkpoint the database once the writes in progress are done.
+
+        New writers are held back from the moment the checkpoint is due, so under back-to-back
+        batches it runs as soon as the current ones commit instead of being skipped.
+        """
+        with self._condition:
+            self._checkpointing = True
+            self._condition.wait_for(lambda: not self._active_writes)
+        try:
+            for database, path in self.db_helper.database_files().items():
+                wal_bytes = _file_size(path + ".wal")
+                started = time.monotonic()
+                self.db_helper.get_connection().execute(
+                    f'CHECKPOINT "{self.db_helper.escape_identifier(database)}"')
+                log_message(INFO, f"Checkpointed {path} ({wal_bytes} WAL bytes) "
+                                  f"in {time.monotonic() - started:.2f}s, file size {_file_size(path)} bytes")
+            with self._condition:
+                self._changes_since_checkpoint = False
+        except Exception as e:
+            log_message(WARNING, f"Checkpoint failed: {str(e)}")
+        finally:
+            with self._condition:
+                self._checkpointing = False
+                self._condition.notify_all()
+
+    def _wal_bytes(self):
+        """Size of the largest WAL among the database files."""
+        return max((_file_size(path + ".wal") for path in self.db_helper.database_files().values()), default=0)
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
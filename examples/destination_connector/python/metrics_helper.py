@@ -0,0 +1,368 @@
+# Metrics of the destination servers. The source connector example has its own metrics_helper.py,
+# trimmed to what its servers record: the examples are self-contained and share no code
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import grpc
+
+# Prefix of every exported metric name
+METRIC_PREFIX = "fivetran_sdk_"
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS_SECONDS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Seconds between two dumps of the metrics file
+DEFAULT_DUMP_INTERVAL_SECONDS = 15
+
+_HELP = {
+    "rpc_duration_seconds": ("histogram", "Time spent handling an RPC, until the last response of a streaming RPC"),
+    "rpc_in_flight": ("gauge", "RPCs currently being handled"),
+    "rpc_errors_total": ("counter", "RPCs whose handler raised an exception"),
+    "phase_duration_seconds": ("histogram", "Time spent in a phase of handling a batch"),
+    "decoded_bytes_total": ("counter", "Plain CSV bytes decoded from batch files"),
+    "decoded_rows_total": ("counter", "Rows decoded from batch files"),
+    "applied_rows_total": ("counter", "Rows inserted, updated or deleted in destination tables"),
+    "applied_file_bytes_total": ("counter", "Bytes of batch files (as received) applied to destination tables"),
+    "time_to_first_response_seconds": ("gauge", "Time from process start until the first RPC was answered"),
+}
+# Fallback start time where the process start time is not available; servers import this module early
+_IMPORTED = time.monotonic()
+
+
+class _Histogram:
+    def __init__(self):
+        # One count per bucket of LATENCY_BUCKETS_SECONDS plus the +Inf bucket; cumulated when rendered
+        self.counts = [0] * (len(LATENCY_BUCKETS_SECONDS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS_SECONDS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Thread-safe store of counters, gauges and histograms, rendered in the Prometheus text format.
+
+    Metrics are identified by a name and a set of labels (e.g. `table`, `method`), and are
+    created on first use. Updates take a single lock for a few dictionary operations, so they
+    are cheap enough for every RPC and every batch file; nothing is recorded per row.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    def increment(self, name, value=1, **labels):
+        """Add `value` to a counter."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def add_gauge(self, name, value, **labels):
+        """Add `value` (which may be negative) to a gauge."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Record one value in a histogram."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Context manager recording the duration of its block in a histogram."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted((key, (list(h.counts), h.sum, h.count))
+                                for key, h in self._histograms.items())
+        lines = []
+        described = set()
+        for (name, labels), value in counters + gauges:
+            _describe(lines, described, name)
+            lines.append(f"{METRIC_PREFIX}{name}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), (counts, total, count) in histograms:
+            _describe(lines, described, name)
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS_SECONDS + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = bound if bound == "+Inf" else _format_value(bound)
+                lines.append(f"{METRIC_PREFIX}{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{METRIC_PREFIX}{name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{METRIC_PREFIX}{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _describe(lines, described, name):
+    if name in described:
+        return
+    described.add(name)
+    kind, description = _HELP.get(name, ("untyped", name))
+    lines.append(f"# HELP {METRIC_PREFIX}{name} {description}")
+    lines.append(f"# TYPE {METRIC_PREFIX}{name} {kind}")
+
+
+_registry = MetricsRegistry()
+
+
+def increment(name, value=1, **labels):
+    """Add `value` to a counter of the shared registry."""
+    _registry.increment(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    """Record one value in a histogram of the shared registry."""
+    _registry.observe(name, value, **labels)
+
+
+def timer(name, **labels):
+    """Context manager recording the duration of its block in a histogram of the shared registry."""
+    return _registry.timer(name, **labels)
+
+
+def render():
+    """Return the metrics of the shared registry in the Prometheus text format."""
+    return _registry.render()
+
+
+def process_age_seconds():
+    """Seconds since the process started (read from /proc on Linux, else since this module was imported)."""
+    try:
+        with open("/proc/self/stat") as stat_file:
+            # Fields after the command name, which is in parentheses; the start time is field 22
+            fields = stat_file.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as uptime_file:
+            uptime = float(uptime_file.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.monotonic() - _IMPORTED
+
+
+class _FirstResponse:
+    """Records the time to the first answered RPC, once per process."""
+
+    def __init__(self, on_first_response):
+        self.on_first_response = on_first_response
+        self.pending = True
+        self._lock = threading.Lock()
+
+    def __call__(self, method):
+        with self._lock:
+            if not self.pending:
+                return
+            self.pending = False
+        seconds = process_age_seconds()
+        _registry.add_gauge("time_to_first_response_seconds", seconds)
+        if self.on_first_response is not None:
+            self.on_first_response(method, seconds)
+
+
+def _method_name(handler_call_details):
+    # "/fivetran_sdk.v2.DestinationConnector/WriteBatch" -> "WriteBatch"
+    return handler_call_details.method.rsplit("/", 1)[-1]
+
+
+def _unary_handler(handler, behavior):
+    """Copy of a unary RPC method handler with another behavior; every destination RPC is unary."""
+    return grpc.unary_unary_rpc_method_handler(behavior, request_deserializer=handler.request_deserializer,
+                                               response_serializer=handler.response_serializer)
+
+
+@contextmanager
+def _measured(method, first_response):
+    """Record the in-flight count, latency and error of one RPC call."""
+    _registry.add_gauge("rpc_in_flight", 1, method=method)
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        _registry.increment("rpc_errors_total", method=method)
+        raise
+    finally:
+        _registry.observe("rpc_duration_seconds", time.perf_counter() - started, method=method)
+        _registry.add_gauge("rpc_in_flight", -1, method=method)
+        if first_response.pending:
+            first_response(method)
+
+
+class MetricsInterceptor(grpc.ServerInterceptor):
+    """
+    Server interceptor recording the latency, in-flight count and errors of every RPC by method.
+
+    The first RPC answered also sets the `time_to_first_response_seconds` gauge and is reported
+    to `on_first_response(method, seconds)`.
+    """
+
+    def __init__(self, on_first_response=None):
+        self._first_response = _FirstResponse(on_first_response)
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None or not handler.unary_unary:
+            return handler
+        method = _method_name(handler_call_details)
+        behavior = handler.unary_unary
+        first_response = self._first_response
+
+        def measured(request, context):
+            with _measured(method, first_response):
+                return behavior(request, context)
+        return _unary_handler(handler, measured)
+
+
+class AsyncMetricsInterceptor(grpc.aio.ServerInterceptor):
+    """grpc.aio variant of MetricsInterceptor, recording the same metrics."""
+
+    def __init__(self, on_first_response=None):
+        self._first_response = _FirstResponse(on_first_response)
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None or not handler.unary_unary:
+            return handler
+        method = _method_name(handler_call_details)
+        behavior = handler.unary_unary
+        first_response = self._first_response
+
+        async def measured(request, context):
+            with _measured(method, first_response):
+                return await behavior(request, context)
+        return _unary_handler(handler, measured)
+
+
+class MetricsExporter:
+    """
+    Makes the metrics readable outside the process: served over HTTP at `/metrics` for
+    Prometheus to scrape, and/or written to a file every few seconds (replaced atomically,
+    so readers never see a partial dump).
+    """
+
+    def __init__(self, port=None, file_path=None, interval_seconds=DEFAULT_DUMP_INTERVAL_SECONDS):
+        """
+        Args:
+            port: Local port of the HTTP endpoint; not served if None
+            file_path: File the metrics are dumped to; not dumped if None
+            interval_seconds: Seconds between two dumps of the file
+        """
+        self.port = port
+        self.file_path = file_path
+        self.interval_seconds = interval_seconds
+        self._server = None
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self.port is not None:
+            # Imported here to keep it out of the server's startup when metrics are not served
+            from http.server import ThreadingHTTPServer
+            self._server = ThreadingHTTPServer(("127.0.0.1", self.port), _metrics_handler())
+            self._start_thread(self._server.serve_forever, "metrics-http")
+        if self.file_path:
+            self._start_thread(self._dump_periodically, "metrics-dump")
+
+    def stop(self):
+        """Stop serving and write the metrics file one last time."""
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self.file_path:
+            self.dump()
+
+    def dump(self):
+        """Write the current metrics to the metrics file."""
+        temp_path = f"{self.file_path}.tmp"
+        with open(temp_path, "w") as metrics_file:
+            metrics_file.write(render())
+        os.replace(temp_path, self.file_path)
+
+    def _start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _dump_periodically(self):
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.dump()
+            except OSError:
+                # A full disk or a removed directory must not take the connector down
+                pass
+
+
+def _metrics_handler():
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Scrapes are not worth a log line each
+            pass
+
+    return MetricsHandler
+
+
+def add_arguments(parser):
+    """Add the command line options that enable the metrics exporter."""
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve metrics in the Prometheus text format at http://127.0.0.1:<port>/metrics")
+    parser.add_argument("--metrics-file", default=None,
+                        help="Dump metrics in the Prometheus text format to this file periodically")
+    parser.add_argument("--metrics-interval", type=float, default=DEFAULT_DUMP_INTERVAL_SECONDS,
+                        help="Seconds between two dumps of the metrics file")
+
+
+def exporter_from_args(args):
+    """Return a MetricsExporter for the parsed command line options, or None if metrics are not exported."""
+    if args.metrics_port is None and not args.metrics_file:
+        return None
+    return MetricsExporter(port=args.metrics_port, file_path=args.metrics_file,
+                           interval_seconds=args.metrics_interval)
@@ -1,13 +1,121 @@
+from collections import deque
+from concurrent import futures
+from contextlib import contextmanager
+import gzip
+import hashlib
+import mmap
+import os
+import time
 from zstandard import ZstdDecompressor
 from Crypto.Cipher import AES
 import csv
+import sys
+sys.path.append('sdk_pb2')
+
+from sdk_pb2 import destination_sdk_pb2
+import metrics_helper
+import csv_converters
+
+
+# Ciphertexts at least this large are decrypted in parallel segments
+PARALLEL_DECRYPT_MIN_BYTES = 8 * 1024 * 1024  # 8 MiB
+# Segment size for parallel decryption; must be a multiple of the AES block size
+DECRYPT_SEGMENT_BYTES = 4 * 1024 * 1024  # 4 MiB
+DECRYPT_WORKERS = os.cpu_count() or 1
+# Segments decrypted ahead of the consumer; bounds the plaintext held in memory
+DECRYPT_WINDOW = DECRYPT_WORKERS * 2
+
+_decrypt_executor = None
+
+
+def _get_decrypt_executor():
+    """Shared thread pool for segment decryption (AES runs in C without holding the GIL)."""
+    global _decrypt_executor
+    if _decrypt_executor is None:
+        _decrypt_executor = futures.ThreadPoolExecutor(max_workers=DECRYPT_WORKERS,
+                                                       thread_name_prefix="aes-decrypt")
+    return _decrypt_executor
+
+
+def _decrypt_segment(key, iv, segment):
+    return AES.new(key, AES.MODE_CBC, iv=iv).decrypt(segment)
+
+
+def aes_decrypt_segments(key, ciphertext):
+    """
+    Decrypt AES-CBC ciphertext (IV in the first block) and yield the plaintext in order.
+
+    `ciphertext` may be any bytes-like object; pass a memoryview (see `mapped_file`) to
+    avoid copying it, since the IV split and the segments are then views into the same buffer.
+
+    CBC decryption of a block only needs the previous ciphertext block, so large inputs are
+    split into block-aligned segments that are decrypted concurrently, each using the last
+    ciphertext block before it as its IV. Segments are yielded in order as soon as they are
+    ready, so the decompressor can start before the whole file is decrypted. At most
+    DECRYPT_WINDOW segments are in flight: the next one is submitted as each is yielded, so
+    a slow consumer holds back decryption instead of piling up plaintext.
+
+    The PKCS padding is validated up front by decrypting only the final block, so a corrupt
+    file or wrong key fails before anything reaches the decompressor. The padding is then cut
+    off the final segment with a memoryview slice rather than a copy.
+    """
+    iv = ciphertext[:AES.block_size]
+    body = ciphertext[AES.block_size:]
+    if len(body) == 0 or len(body) % AES.block_size != 0:
+        raise ValueError(f"Ciphertext length {len(body)} is not a positive multiple of the AES block size")
+    padding_length = _padding_length(key, iv, body)
+
+    if len(body) < PARALLEL_DECRYPT_MIN_BYTES or DECRYPT_WORKERS < 2:
+        yield _strip_padding(_decrypt_segment(key, iv, body), padding_length)
+        return
+
+    executor = _get_decrypt_executor()
+    offsets = iter(range(0, len(body), DECRYPT_SEGMENT_BYTES))
+    pending = deque()
+
+    def submit_next():
+        offset = next(offsets, None)
+        if offset is not None:
+            segment_iv = iv if offset == 0 else body[offset - AES.block_size:offset]
+            pending.append(executor.submit(_decrypt_segment, key, segment_iv,
+                                           body[offset:offset + DECRYPT_SEGMENT_BYTES]))
+
+    try:
+        for _ in range(DECRYPT_WINDOW):
+            submit_next()
+        while pending:
+            plaintext = pending.popleft().result()
+            submit_next()
+            yield _strip_padding(plaintext, padding_length) if not pending else plaintext
+    finally:
+        # The consumer stopped early (error or close()): drop segments nobody will read
+        for future in pending:
+            future.cancel()
 
 
 # AES decryption function
 def aes_decrypt(key, ciphertext):
-    cipher = AES.new(key, AES.MODE_CBC, iv=ciphertext[:AES.block_size])
-    plaintext = cipher.decrypt(ciphertext[AES.block_size:])
-    return plaintext.rstrip(b'\0')
+    return b"".join(aes_decrypt_segments(key, ciphertext))
+
+
+def _padding_length(key, iv, body):
+    """
+    Decrypt the final block and return the length of its PKCS#7 padding (PKCS5Padding in Java).
+
+    Raises:
+        ValueError: If the padding is malformed, i.e. the file is corrupt or the key is wrong
+    """
+    previous_block = iv if len(body) == AES.block_size else body[-2 * AES.block_size:-AES.block_size]
+    last_block = _decrypt_segment(key, previous_block, body[-AES.block_size:])
+    padding_length = last_block[-1]
+    if not 1 <= padding_length <= AES.block_size or last_block[-padding_length:] != bytes([padding_length]) * padding_length:
+        raise ValueError("Invalid PKCS padding in batch file: the file is corrupt or the decryption key is wrong")
+    return padding_length
+
+
+def _strip_padding(plaintext, padding_length):
+    """Drop the padding from the final plaintext segment without copying it."""
+    return memoryview(plaintext)[:len(plaintext) - padding_length]
 
 
 # Zstandard decompression function
@@ -17,16 +125,130 @@ def zstd_decompress(compressed_data):
     return decompressed_data
 
 
+def zstd_decompress_chunks(chunks):
+    """Decompress a Zstandard stream that arrives as an ordered sequence of chunks."""
+    decompressor = ZstdDecompressor().decompressobj()
+    return b"".join(decompressor.decompress(chunk) for chunk in chunks)
+
+
+@contextmanager
+def mapped_file(input_file_path):
+    """
+    Memory-map a batch file read-only and yield a memoryview of its contents.
+
+    Reads go straight to the page cache instead of being copied into a bytes object, and
+    slicing the view does not copy either. All slices must be released before the context exits.
+    """
+    with open(input_file_path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            # Empty files cannot be mapped
+            yield memoryview(b"")
+            return
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        try:
+            yield view
+        finally:
+            view.release()
+            try:
+                mapped.close()
+            except BufferError:
+                # Slices are still referenced, e.g. by the traceback of an exception in flight;
+                # the mapping is released once they are garbage collected
+                pass
+
+
+def fingerprint_digest():
+    """Return a new hash object for the fingerprint of a batch file."""
+    return hashlib.blake2b(digest_size=16)
+
+
+def file_fingerprint(input_file_path):
+    """Return a hex digest of a batch file's contents, as stored on disk."""
+    digest = fingerprint_digest()
+    with mapped_file(input_file_path) as data:
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def decode_file(input_file_path, key, file_params, digest=None):
+    """
+    Decrypt and decompress a batch file as described by the request's FileParams.
+
+    The time spent decrypting and decompressing is recorded in the `phase_duration_seconds`
+    metric. Decryption is streamed into the decompressor, so the decrypt phase is the time the
+    decompressor waited for decrypted segments, and the decompress phase is the rest.
+
+    If `digest` (see fingerprint_digest()) is given, it is updated with the file's contents as
+    stored on disk while they are mapped, so fingerprinting a decoded file costs no second read.
+
+    Returns:
+        The plain CSV contents as bytes
+    """
+    started = time.perf_counter()
+    decrypt_seconds = [0.0]
+    with mapped_file(input_file_path) as data:
+        if digest is not None:
+            digest.update(data)
+        encrypted = file_params.encryption == destination_sdk_pb2.Encryption.AES
+        if encrypted:
+            segments = aes_decrypt_segments(key, data)
+            chunks = _timed_chunks(segments, decrypt_seconds)
+        else:
+            chunks = segments = (chunk for chunk in (data,))
+        try:
+            if file_params.compression == destination_sdk_pb2.Compression.ZSTD:
+                return zstd_decompress_chunks(chunks)
+            if file_params.compression == destination_sdk_pb2.Compression.GZIP:
+                return gzip.decompress(b"".join(chunks))
+            return b"".join(chunks)
+        finally:
+            # Drop the generator's views into the mapping before it is unmapped
+            chunks.close()
+            segments.close()
+            if encrypted:
+                metrics_helper.observe("phase_duration_seconds", decrypt_seconds[0], phase="decrypt")
+            if file_params.compression != destination_sdk_pb2.Compression.OFF:
+                metrics_helper.observe("phase_duration_seconds",
+                                       time.perf_counter() - started - decrypt_seconds[0], phase="decompress")
+
+
+def _timed_chunks(chunks, seconds):
+    """Pass the chunks through, adding the time spent producing them to `seconds[0]`."""
+    while True:
+        started = time.perf_counter()
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            return
+        finally:
+            seconds[0] += time.perf_counter() - started
+        yield chunk
+
+
 # Read the encrypted and compressed data
 def decrypt_file(input_file_path, value):
-    with open(input_file_path, 'rb') as file:
-        encrypted_and_compressed_data = file.read()
-        decrypted_data = aes_decrypt(value, encrypted_and_compressed_data)
-        decompressed_data = zstd_decompress(decrypted_data)
-        csv_data = decompressed_data.decode('utf-8')
-        csv_reader = csv.reader(csv_data.splitlines())
-        headers = next(csv_reader)
-        print(f"{'  |  '.join(headers)}")
-        print('-' * (len(headers) * 15))
-        for row in csv_reader:
-            print(f"{'  |  '.join(row)}")
+    with mapped_file(input_file_path) as encrypted_and_compressed_data:
+        decrypted_segments = aes_decrypt_segments(value, encrypted_and_compressed_data)
+        try:
+            decompressed_data = zstd_decompress_chunks(decrypted_segments)
+        finally:
+            # Drop the generator's views into the mapping before it is unmapped
+            decrypted_segments.close()
+    csv_data = decompressed_data.decode('utf-8')
+    csv_reader = csv.reader(csv_data.splitlines())
+    headers = next(csv_reader)
+    print(f"{'  |  '.join(headers)}")
+    print('-' * (len(headers) * 15))
+    for row in csv_reader:
+        print(f"{'  |  '.join(row)}")
+
+
+def read_typed_blocks(input_file_path, key, file_params, table, block_rows=csv_converters.DEFAULT_BLOCK_ROWS):
+    """
+    Decode a batch file and yield its rows converted to Python values, in blocks.
+
+    The writers load batch files with DuckDB's CSV reader; this is the path for code that has
+    to handle the rows in Python. See csv_converters.read_blocks.
+    """
+    return csv_converters.read_blocks(decode_file(input_file_path, key, file_params), table, file_params, block_rows)
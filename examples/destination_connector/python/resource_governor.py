@@ -0,0 +1,154 @@
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+from log_helper import log_message
+
+INFO = "INFO"
+WARNING = "WARNING"
+
+# Configuration fields (see ConfigurationForm) with the resources the destination may use
+THREADS_FIELD = "threads"
+MEMORY_LIMIT_FIELD = "memoryLimit"
+SPILL_DIRECTORY_FIELD = "spillDirectory"
+
+# Kinds of operations that get a budget
+OPERATION_WRITE = "write"
+OPERATION_SCHEMA = "schema"
+OPERATION_MAINTENANCE = "maintenance"
+# Share of the configured threads and memory each kind of operation may use
+OPERATION_SHARES = {
+    OPERATION_WRITE: 0.7,
+    OPERATION_SCHEMA: 0.2,
+    OPERATION_MAINTENANCE: 0.1,
+}
+# Share the limits fall back to while no governed operation runs, so that ungoverned calls
+# (e.g. Test or a client's first query) do not run with a single thread and the minimum memory
+IDLE_SHARE = OPERATION_SHARES[OPERATION_SCHEMA]
+# DuckDB's default memory limit is 80% of the physical memory; the governor defaults to the same
+DEFAULT_MEMORY_FRACTION = 0.8
+# The memory limit is never lowered below this, so that catalog queries keep working
+MIN_MEMORY_LIMIT_BYTES = 64 * 1024 * 1024  # 64 MiB
+
+_BYTE_UNITS = {
+    "": 1, "b": 1,
+    "kb": 1000, "mb": 1000 ** 2, "gb": 1000 ** 3, "tb": 1000 ** 4,
+    "kib": 1024, "mib": 1024 ** 2, "gib": 1024 ** 3, "tib": 1024 ** 4,
+}
+
+
+class ResourceGovernor:
+    """
+    Caps the threads, memory and spill directory DuckDB uses, and shares them between operations.
+
+    The totals come from the `threads`, `memoryLimit` and `spillDirectory` configuration fields
+    and default to all cores and 80% of the physical memory. Each kind of operation may use its
+    OPERATION_SHARES of them (WriteBatch most, maintenance little), and concurrent operations
+    of the same kind split their kind's share.
+
+    DuckDB's `threads` and `memory_limit` settings are global to the database, so they cannot be
+    set per query. Instead, while operations run, the settings are kept at the sum of the budgets
+    of the running kinds, never above the totals: maintenance running alone is held to its small
+    share, and the limits are raised before a WriteBatch starts. While nothing runs they fall
+    back to IDLE_SHARE. Queries that need more memory than the limit spill to `temp_directory`
+    rather than failing.
+    """
+
+    def __init__(self, db_helper):
+        self.db_helper = db_helper
+        self._lock = threading.Lock()
+        # Operation kind -> number of running operations
+        self._active = {}
+        self.total_threads = os.cpu_count() or 1
+        self.total_memory_bytes = _default_memory_bytes()
+        self.spill_directory = None
+        self._applied = None
+
+    def configure(self, configuration):
+        """
+        Take the totals from a request's configuration, if it sets them.
+
+        Invalid values are logged and ignored, keeping the previous totals.
+        """
+        with self._lock:
+            try:
+                threads = configuration.get(THREADS_FIELD, "").strip()
+                if threads:
+                    self.total_threads = max(1, int(threads))
+                memory_limit = configuration.get(MEMORY_LIMIT_FIELD, "").strip()
+                if memory_limit:
+                    self.total_memory_bytes = max(MIN_MEMORY_LIMIT_BYTES, parse_bytes(memory_limit))
+            except ValueError as e:
+                log_message(WARNING, f"Ignoring invalid resource configuration: {str(e)}")
+            spill_directory = configuration.get(SPILL_DIRECTORY_FIELD, "").strip()
+            if spill_directory and spill_directory != self.spill_directory:
+                self._set_spill_directory(spill_directory)
+            self._apply()
+
+    @contextmanager
+    def operation(self, kind):
+        """
+        Context manager around an operation of the given kind.
+
+        Raises the DuckDB limits to cover the operation before it starts, and lowers them again
+        after it ends. Yields the operation's memory budget in bytes, for memory the operation
+        manages itself (e.g. the DecodedFileCache of a WriteBatch).
+        """
+        with self._lock:
+            self._active[kind] = self._active.get(kind, 0) + 1
+            budget = int(self.total_memory_bytes * OPERATION_SHARES[kind] / self._active[kind])
+            self._apply()
+        try:
+            yield budget
+        finally:
+            with self._lock:
+                self._active[kind] -= 1
+                if not self._active[kind]:
+                    del self._active[kind]
+                self._apply()
+
+    def _apply(self):
+        """Set DuckDB's limits to the budgets of the running kinds. Call with the lock held."""
+        share = min(1.0, sum(OPERATION_SHARES[kind] for kind in self._active)) if self._active else IDLE_SHARE
+        threads = max(1, round(self.total_threads * share))
+        memory_bytes = max(MIN_MEMORY_LIMIT_BYTES, int(self.total_memory_bytes * share))
+        if self._applied == (threads, memory_bytes):
+            return
+        connection = self.db_helper.get_connection()
+        try:
+            connection.execute(f"SET memory_limit = '{memory_bytes}B'")
+            connection.execute(f"SET threads = {threads}")
+            self._applied = (threads, memory_bytes)
+        except Exception as e:
+            # DuckDB refuses to lower the limit below memory still in use; the next change retries
+            log_message(WARNING, f"Could not set DuckDB limits to {threads} threads and {memory_bytes} bytes: {str(e)}")
+
+    def _set_spill_directory(self, spill_directory):
+        try:
+            os.makedirs(spill_directory, exist_ok=True)
+            self.db_helper.get_connection().execute(f"SET temp_directory = {_sql_string(spill_directory)}")
+            self.spill_directory = spill_directory
+            log_message(INFO, f"DuckDB spills to {spill_directory}")
+        except Exception as e:
+            log_message(WARNING, f"Could not set spill directory {spill_directory}: {str(e)}")
+
+
+def parse_bytes(value):
+    """Parse a size such as `512MB`, `2GiB` or `1073741824` into bytes."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([a-zA-Z]*)\s*", value)
+    if not match or match.group(2).lower() not in _BYTE_UNITS:
+        raise ValueError(f"'{value}' is not a size like 512MB or 2GiB")
+    return int(float(match.group(1)) * _BYTE_UNITS[match.group(2).lower()])
+
+
+def _default_memory_bytes():
+    try:
+        physical = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        physical = 4 * 1024 ** 3
+    return int(physical * DEFAULT_MEMORY_FRACTION)
+
+
+def _sql_string(value):
+    return "'" + value.replace("'", "''") + "'"
@@ -2,8 +2,9 @@ import sys
 sys.path.append('sdk_pb2')
 
 from sdk_pb2 import destination_sdk_pb2
-from sdk_pb2 import common_pb2
-from table_metadata_helper import TableMetadataHelper, FIVETRAN_START, FIVETRAN_END, FIVETRAN_ACTIVE
+from log_helper import log_message
+from table_schema import ColumnSchema
+from table_metadata_helper import TableMetadataHelper, FIVETRAN_START, FIVETRAN_END, FIVETRAN_ACTIVE, FIVETRAN_END_OF_TIME
 
 INFO = "INFO"
 WARNING = "WARNING"
@@ -64,30 +65,24 @@ class SchemaMigrationHelper:
                     log_message(WARNING, f"[Migrate:CopyColumn] Table {schema}.{table} does not exist")
                     return destination_sdk_pb2.MigrateResponse(success=False)
 
-                column_found = False
-                for col in table_obj.columns:
-                    if col.name == copy_column.from_column:
-                        # Wrap column copy in transaction (add column + copy data)
-                        with self.db_helper.transaction():
-                            # Add new column with same type and params (preserves DECIMAL precision/scale, VARCHAR length, etc.)
-                            new_col = common_pb2.Column()
-                            new_col.CopyFrom(col)
-                            new_col.name = copy_column.to_column
-                            self.db_helper.add_column(schema, table, new_col)
-                            # Copy data from old column to new column using escaped identifiers
-                            escaped_schema = self.db_helper.escape_identifier(schema)
-                            escaped_table = self.db_helper.escape_identifier(table)
-                            escaped_to_col = self.db_helper.escape_identifier(copy_column.to_column)
-                            escaped_from_col = self.db_helper.escape_identifier(copy_column.from_column)
-                            sql = f'UPDATE "{escaped_schema}"."{escaped_table}" SET "{escaped_to_col}" = "{escaped_from_col}"'
-                            self.db_helper.get_connection().execute(sql)
-                        column_found = True
-                        break
-
-                if not column_found:
+                col = table_obj.column(copy_column.from_column)
+                if col is None:
                     log_message(WARNING, f"[Migrate:CopyColumn] Column {copy_column.from_column} not found in {schema}.{table}")
                     return destination_sdk_pb2.MigrateResponse(success=False)
 
+                # Wrap column copy in transaction (add column + copy data)
+                with self.db_helper.transaction():
+                    # Add new column with same type and params (preserves DECIMAL precision/scale, VARCHAR length, etc.)
+                    new_col = col.replace(name=copy_column.to_column)
+                    self.db_helper.add_column(schema, table, new_col)
+                    # Copy data from old column to new column using escaped identifiers
+                    escaped_schema = self.db_helper.escape_identifier(schema)
+                    escaped_table = self.db_helper.escape_identifier(table)
+                    escaped_to_col = self.db_helper.escape_identifier(copy_column.to_column)
+                    escaped_from_col = self.db_helper.escape_identifier(copy_column.from_column)
+                    sql = f'UPDATE "{escaped_schema}"."{escaped_table}" SET "{escaped_to_col}" = "{escaped_from_col}"'
+                    self.db_helper.get_connection().execute(sql)
+
                 log_message(INFO, f"[Migrate:CopyColumn] table={schema}.{table} from_col={copy_column.from_column} to_col={copy_column.to_column}")
                 return destination_sdk_pb2.MigrateResponse(success=True)
 
@@ -101,22 +96,26 @@ class SchemaMigrationHelper:
 
                 # Create new table metadata without soft delete column and with history columns
                 new_table = TableMetadataHelper.create_table_copy(from_table_obj, copy_table_history_mode.to_table)
-                TableMetadataHelper.remove_column_from_table(new_table, copy_table_history_mode.soft_deleted_column)
-                TableMetadataHelper.add_history_mode_columns(new_table)
+                new_table = TableMetadataHelper.remove_column_from_table(new_table, copy_table_history_mode.soft_deleted_column)
+                new_table = TableMetadataHelper.add_history_mode_columns(new_table)
 
                 # Wrap table creation and data copy in transaction
                 with self.db_helper.transaction():
                     # Create the new table in DuckDB
                     self.db_helper.create_table(schema, new_table)
 
-                    # Copy data (excluding soft deleted column) with escaped identifiers
+                    # Copy data (excluding soft deleted column) with escaped identifiers; copied rows
+                    # become active versions, since `_fivetran_start` is part of the primary key
                     columns_to_copy = [col.name for col in new_table.columns
                                       if col.name not in [FIVETRAN_START, FIVETRAN_END, FIVETRAN_ACTIVE]]
                     columns_str = ", ".join([f'"{self.db_helper.escape_identifier(col)}"' for col in columns_to_copy])
+                    history_columns_str = f'"{FIVETRAN_START}", "{FIVETRAN_END}", "{FIVETRAN_ACTIVE}"'
                     escaped_schema = self.db_helper.escape_identifier(schema)
                     escaped_to_table = self.db_helper.escape_identifier(copy_table_history_mode.to_table)
                     escaped_from_table = self.db_helper.escape_identifier(copy_table_history_mode.from_table)
-                    sql = f'INSERT INTO "{escaped_schema}"."{escaped_to_table}" ({columns_str}) SELECT {columns_str} FROM "{escaped_schema}"."{escaped_from_table}"'
+                    sql = (f'INSERT INTO "{escaped_schema}"."{escaped_to_table}" ({columns_str}, {history_columns_str}) '
+                           f'SELECT {columns_str}, now(), {FIVETRAN_END_OF_TIME}, TRUE '
+                           f'FROM "{escaped_schema}"."{escaped_from_table}"')
                     self.db_helper.get_connection().execute(sql)
 
                 log_message(INFO, f"[Migrate:CopyTableToHistoryMode] from={copy_table_history_mode.from_table} to={copy_table_history_mode.to_table} soft_deleted_column={copy_table_history_mode.soft_deleted_column}")
@@ -160,10 +159,7 @@ class SchemaMigrationHelper:
         try:
             if entity_case == "add_column_in_history_mode":
                 add_col_history_mode = add_op.add_column_in_history_mode
-                new_col = common_pb2.Column(
-                    name=add_col_history_mode.column,
-                    type=add_col_history_mode.column_type
-                )
+                new_col = ColumnSchema.of(add_col_history_mode.column, add_col_history_mode.column_type)
 
                 # Wrap add column + optional update in transaction
                 with self.db_helper.transaction():
@@ -178,10 +174,7 @@ class SchemaMigrationHelper:
 
             elif entity_case == "add_column_with_default_value":
                 add_col_default_with_value = add_op.add_column_with_default_value
-                new_col = common_pb2.Column(
-                    name=add_col_default_with_value.column,
-                    type=add_col_default_with_value.column_type
-                )
+                new_col = ColumnSchema.of(add_col_default_with_value.column, add_col_default_with_value.column_type)
 
                 # Wrap add column + optional update in transaction
                 with self.db_helper.transaction():
@@ -244,9 +237,3 @@ class SchemaMigrationHelper:
         except Exception as e:
             log_message(WARNING, f"[Migrate:TableSyncModeMigration] Failed: {str(e)}")
             return destination_sdk_pb2.MigrateResponse(success=False)
-
-
-def log_message(level, message):
-    import json
-    escaped_message = json.dumps(message)
-    print(f'{{"level": "{level}", "message": {escaped_message}, "message-origin": "sdk_destination"}}')
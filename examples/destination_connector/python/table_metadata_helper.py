@@ -2,11 +2,21 @@ import sys
 sys.path.append('sdk_pb2')
 
 from sdk_pb2 import common_pb2
+from log_helper import log_message
+from table_schema import ColumnSchema
 
 # Constants for system columns
 FIVETRAN_START = "_fivetran_start"
 FIVETRAN_END = "_fivetran_end"
 FIVETRAN_ACTIVE = "_fivetran_active"
+# `_fivetran_end` of active history mode rows
+FIVETRAN_END_OF_TIME = "TIMESTAMPTZ '9999-12-31 23:59:59.999+00'"
+# Definitions of the history mode columns, in the order they are added
+HISTORY_MODE_COLUMNS = (
+    ColumnSchema.of(FIVETRAN_START, common_pb2.DataType.UTC_DATETIME),
+    ColumnSchema.of(FIVETRAN_END, common_pb2.DataType.UTC_DATETIME),
+    ColumnSchema.of(FIVETRAN_ACTIVE, common_pb2.DataType.BOOLEAN),
+)
 
 INFO = "INFO"
 WARNING = "WARNING"
@@ -17,60 +27,63 @@ class TableMetadataHelper:
 
     @staticmethod
     def create_table_copy(table_obj, new_name):
-        """Creates a copy of a table."""
-        table_copy = table_obj.__class__.FromString(table_obj.SerializeToString())
-        if hasattr(table_copy, "name"):
-            table_copy.name = new_name
-        return table_copy
+        """Returns a copy of a table (a TableSchema) under a new name."""
+        return table_obj.renamed(new_name)
 
     @staticmethod
     def remove_column_from_table(table_obj, column_name):
-        """Removes a column from a table."""
-        if not column_name or not hasattr(table_obj, 'columns'):
-            return
-        # Create a new list of columns excluding the specified column
-        columns_to_keep = [col for col in table_obj.columns if col.name != column_name]
-        # Clear and repopulate
-        del table_obj.columns[:]
-        table_obj.columns.extend(columns_to_keep)
+        """Returns the table (a TableSchema) without a column."""
+        if not column_name:
+            return table_obj
+        return table_obj.without_column(column_name)
 
     @staticmethod
     def add_history_mode_columns(table_obj):
-        """Adds history mode columns to a table."""
-        if not hasattr(table_obj, 'columns'):
-            return
-        start_col = table_obj.columns.add()
-        start_col.name = FIVETRAN_START
-        start_col.type = common_pb2.DataType.UTC_DATETIME
-
-        end_col = table_obj.columns.add()
-        end_col.name = FIVETRAN_END
-        end_col.type = common_pb2.DataType.UTC_DATETIME
-
-        active_col = table_obj.columns.add()
-        active_col.name = FIVETRAN_ACTIVE
-        active_col.type = common_pb2.DataType.BOOLEAN
+        """
+        Returns the table (a TableSchema) with the history mode columns added.
+        `_fivetran_start` joins the primary key, if there is one.
+        """
+        start_col, end_col, active_col = HISTORY_MODE_COLUMNS
+        return table_obj.with_columns(start_col.replace(primary_key=bool(table_obj.primary_key)), end_col, active_col)
 
     @staticmethod
     def add_history_mode_columns_to_db(db_helper, schema, table):
         """Adds history mode columns to a table in the database."""
-        columns_to_add = [
-            common_pb2.Column(name=FIVETRAN_START, type=common_pb2.DataType.UTC_DATETIME),
-            common_pb2.Column(name=FIVETRAN_END, type=common_pb2.DataType.UTC_DATETIME),
-            common_pb2.Column(name=FIVETRAN_ACTIVE, type=common_pb2.DataType.BOOLEAN)
-        ]
-
-        for column in columns_to_add:
+        for column in HISTORY_MODE_COLUMNS:
             try:
                 db_helper.add_column(schema, table, column)
             except Exception as e:
                 log_message(WARNING, f"Failed to add column {column.name} to {schema}.{table}: {str(e)}")
 
+        # Existing rows become the active versions, and `_fivetran_start` joins the primary key
+        escaped_table = f'"{db_helper.escape_identifier(schema)}"."{db_helper.escape_identifier(table)}"'
+        db_helper.get_connection().execute(
+            f'UPDATE {escaped_table} SET "{FIVETRAN_START}" = now(), "{FIVETRAN_END}" = {FIVETRAN_END_OF_TIME}, '
+            f'"{FIVETRAN_ACTIVE}" = TRUE WHERE "{FIVETRAN_START}" IS NULL'
+        )
+        primary_key = db_helper.primary_key_columns(schema, table)
+        if primary_key and FIVETRAN_START not in primary_key:
+            table_obj = db_helper.describe_table(schema, table)
+            db_helper.rebuild_table(schema, table_obj.with_primary_key(primary_key + [FIVETRAN_START]))
+
     @staticmethod
     def remove_history_mode_columns_from_db(db_helper, schema, table):
         """Removes history mode columns from a table in the database."""
         columns_to_drop = [FIVETRAN_START, FIVETRAN_END, FIVETRAN_ACTIVE]
 
+        primary_key = db_helper.primary_key_columns(schema, table)
+        if FIVETRAN_START in primary_key:
+            # Keep only the latest version of each key, so the key stays unique without `_fivetran_start`
+            keys = [name for name in primary_key if name != FIVETRAN_START]
+            escaped_table = f'"{db_helper.escape_identifier(schema)}"."{db_helper.escape_identifier(table)}"'
+            key_list = ", ".join(f'"{db_helper.escape_identifier(name)}"' for name in keys)
+            key_match = " AND ".join(f't."{db_helper.escape_identifier(name)}" = l."{db_helper.escape_identifier(name)}"'
+                                     for name in keys)
+            db_helper.get_connection().execute(
+                f'DELETE FROM {escaped_table} AS t USING (SELECT {key_list}, max("{FIVETRAN_START}") AS latest '
+                f'FROM {escaped_table} GROUP BY ALL) AS l WHERE {key_match} AND t."{FIVETRAN_START}" < l.latest'
+            )
+
         for column in columns_to_drop:
             try:
                 db_helper.drop_column(schema, table, column)
@@ -81,11 +94,5 @@ class TableMetadataHelper:
     def add_soft_delete_column_to_db(db_helper, schema, table, column_name):
         """Adds a soft delete column to a table in the database."""
         if column_name:
-            soft_del_col = common_pb2.Column(name=column_name, type=common_pb2.DataType.BOOLEAN)
+            soft_del_col = ColumnSchema.of(column_name, common_pb2.DataType.BOOLEAN)
             db_helper.add_column(schema, table, soft_del_col)
-
-
-def log_message(level, message):
-    import json
-    escaped_message = json.dumps(message)
-    print(f'{{"level": "{level}", "message": {escaped_message}, "message-origin": "sdk_destination"}}')
@@ -0,0 +1,169 @@
+import dataclasses
+import sys
+from dataclasses import dataclass
+sys.path.append('sdk_pb2')
+
+from sdk_pb2 import common_pb2
+import type_mapping
+
+DataType = common_pb2.DataType
+
+# Columns Fivetran adds to every table (_fivetran_synced, _fivetran_deleted, the history mode columns, ...)
+SYSTEM_COLUMN_PREFIX = "_fivetran_"
+
+
+@dataclass(frozen=True)
+class ColumnSchema:
+    """
+    Immutable definition of a table column.
+
+    Mirrors `common_pb2.Column`; `decimal` is the (precision, scale) of a DECIMAL column, or None
+    if they are not specified, and `string_byte_length` is 0 for an unlimited STRING. The SQL
+    type is computed once, when the column is created.
+    """
+    # `sql_type` is derived, so it has a slot but is not a dataclass field (nor compared or hashed)
+    __slots__ = ("name", "type", "primary_key", "decimal", "string_byte_length", "sql_type")
+
+    name: str
+    type: int
+    primary_key: bool
+    decimal: tuple
+    string_byte_length: int
+
+    def __post_init__(self):
+        object.__setattr__(self, "sql_type",
+                           type_mapping.sized_sql_type(self.type, self.decimal, self.string_byte_length))
+
+    @classmethod
+    def of(cls, name, type, primary_key=False, decimal=None, string_byte_length=0):
+        """Create a column; the type parameters default to unspecified."""
+        return cls(name, type, primary_key, decimal, string_byte_length)
+
+    @classmethod
+    def from_proto(cls, column):
+        """Create a column from a `common_pb2.Column`."""
+        decimal = None
+        string_byte_length = 0
+        if column.HasField("params"):
+            if column.params.HasField("decimal"):
+                decimal = (column.params.decimal.precision, column.params.decimal.scale)
+            string_byte_length = column.params.string_byte_length
+        return cls(column.name, column.type, column.primary_key, decimal, string_byte_length)
+
+    def to_proto(self):
+        """Return the column as a `common_pb2.Column`."""
+        column = common_pb2.Column(name=self.name, type=self.type, primary_key=self.primary_key)
+        if self.decimal is not None:
+            column.params.decimal.precision, column.params.decimal.scale = self.decimal
+        elif self.string_byte_length:
+            column.params.string_byte_length = self.string_byte_length
+        return column
+
+    def replace(self, **changes):
+        """Return a copy of the column with the given fields changed."""
+        return dataclasses.replace(self, **changes)
+
+    def same_type(self, other):
+        """
+        Whether two columns have the same type.
+
+        DECIMAL columns also compare precision and scale, and STRING columns their byte length,
+        which matters for destinations with VARCHAR size limits.
+        """
+        if self.type != other.type:
+            return False
+        if self.type == DataType.DECIMAL:
+            return self.decimal == other.decimal
+        if self.type == DataType.STRING:
+            return self.string_byte_length == other.string_byte_length
+        return True
+
+
+@dataclass(frozen=True)
+class SchemaDiff:
+    """Differences between the current and the requested schema of a table."""
+    __slots__ = ("added", "dropped", "retyped")
+
+    # Requested columns that do not exist yet, in requested order
+    added: tuple
+    # Names of the current columns that are not requested, in table order
+    dropped: tuple
+    # Requested definitions of the columns whose type changes
+    retyped: tuple
+
+
+@dataclass(frozen=True)
+class TableSchema:
+    """
+    Immutable definition of a table: its name and columns, in table order.
+
+    Mirrors `common_pb2.Table`, which is only used at the RPC boundary. Column lookup by name,
+    the primary key and the system columns are computed once, when the schema is created, and
+    copies share the unchanged ColumnSchema objects.
+    """
+    __slots__ = ("name", "columns", "_by_name", "primary_key", "system_columns")
+
+    name: str
+    columns: tuple
+
+    def __post_init__(self):
+        columns = tuple(self.columns)
+        object.__setattr__(self, "columns", columns)
+        object.__setattr__(self, "_by_name", {column.name: column for column in columns})
+        object.__setattr__(self, "primary_key", tuple(column.name for column in columns if column.primary_key))
+        object.__setattr__(self, "system_columns",
+                           frozenset(column.name for column in columns if column.name.startswith(SYSTEM_COLUMN_PREFIX)))
+
+    @classmethod
+    def from_proto(cls, table):
+        """Create a schema from a `common_pb2.Table`."""
+        return cls(table.name, tuple(ColumnSchema.from_proto(column) for column in table.columns))
+
+    def to_proto(self):
+        """Return the schema as a `common_pb2.Table`."""
+        return common_pb2.Table(name=self.name, columns=[column.to_proto() for column in self.columns])
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def column(self, name):
+        """The column with the given name, or None."""
+        return self._by_name.get(name)
+
+    def renamed(self, name):
+        """Return a copy of the schema under another table name."""
+        return TableSchema(name, self.columns)
+
+    def without_column(self, name):
+        """Return a copy of the schema without the named column."""
+        if name not in self._by_name:
+            return self
+        return TableSchema(self.name, tuple(column for column in self.columns if column.name != name))
+
+    def with_columns(self, *columns):
+        """Return a copy of the schema with the columns appended."""
+        return TableSchema(self.name, self.columns + columns)
+
+    def with_primary_key(self, names):
+        """Return a copy of the schema whose primary key is the named columns."""
+        names = set(names)
+        return TableSchema(self.name, tuple(
+            column if column.primary_key == (column.name in names) else column.replace(primary_key=column.name in names)
+            for column in self.columns))
+
+    def with_column_types(self, columns):
+        """Return a copy of the schema with the types of the given columns, keeping the primary key."""
+        replacements = {column.name: column for column in columns}
+        return TableSchema(self.name, tuple(
+            replacements[column.name].replace(primary_key=column.primary_key) if column.name in replacements
+            else column
+            for column in self.columns))
+
+    def diff(self, requested):
+        """Return the SchemaDiff that turns this schema into the requested one."""
+        current = self._by_name
+        added = tuple(column for column in requested.columns if column.name not in current)
+        dropped = tuple(column.name for column in self.columns if column.name not in requested)
+        retyped = tuple(column for column in requested.columns
+                        if column.name in current and not current[column.name].same_type(column))
+        return SchemaDiff(added, dropped, retyped)
@@ -0,0 +1,192 @@
+import base64
+import re
+import sys
+from datetime import date, datetime, time, timezone
+from decimal import Decimal
+from functools import lru_cache
+sys.path.append('sdk_pb2')
+
+from sdk_pb2 import common_pb2
+from log_helper import log_message
+
+WARNING = "WARNING"
+
+DataType = common_pb2.DataType
+
+# SQL type of each Fivetran DataType, for columns without type parameters
+DATATYPE_TO_SQL = {
+    DataType.UNSPECIFIED: "VARCHAR",
+    DataType.BOOLEAN: "BOOLEAN",
+    DataType.SHORT: "SMALLINT",
+    DataType.INT: "INTEGER",
+    DataType.LONG: "BIGINT",
+    # Fallback when precision/scale are not specified
+    DataType.DECIMAL: "DECIMAL(38, 10)",
+    DataType.FLOAT: "REAL",
+    DataType.DOUBLE: "DOUBLE",
+    DataType.NAIVE_DATE: "DATE",
+    DataType.NAIVE_DATETIME: "TIMESTAMP",
+    DataType.UTC_DATETIME: "TIMESTAMPTZ",
+    DataType.BINARY: "BLOB",
+    DataType.XML: "VARCHAR",
+    DataType.STRING: "VARCHAR",
+    DataType.JSON: "JSON",
+    DataType.NAIVE_TIME: "TIME",
+}
+DEFAULT_SQL_TYPE = "VARCHAR"
+
+# Fivetran DataType of each SQL type name (without parameters), including the aliases DuckDB accepts
+SQL_TO_DATATYPE = {
+    "BOOLEAN": DataType.BOOLEAN, "BOOL": DataType.BOOLEAN, "LOGICAL": DataType.BOOLEAN,
+    "SMALLINT": DataType.SHORT, "INT2": DataType.SHORT, "SHORT": DataType.SHORT, "USMALLINT": DataType.SHORT,
+    "INTEGER": DataType.INT, "INT": DataType.INT, "INT4": DataType.INT, "SIGNED": DataType.INT,
+    "UINTEGER": DataType.INT,
+    "BIGINT": DataType.LONG, "INT8": DataType.LONG, "LONG": DataType.LONG, "UBIGINT": DataType.LONG,
+    "DECIMAL": DataType.DECIMAL, "NUMERIC": DataType.DECIMAL,
+    "REAL": DataType.FLOAT, "FLOAT": DataType.FLOAT, "FLOAT4": DataType.FLOAT,
+    "DOUBLE": DataType.DOUBLE, "FLOAT8": DataType.DOUBLE,
+    "DATE": DataType.NAIVE_DATE,
+    "TIMESTAMP": DataType.NAIVE_DATETIME, "DATETIME": DataType.NAIVE_DATETIME,
+    "TIMESTAMP_S": DataType.NAIVE_DATETIME, "TIMESTAMP_MS": DataType.NAIVE_DATETIME,
+    "TIMESTAMP_US": DataType.NAIVE_DATETIME, "TIMESTAMP_NS": DataType.NAIVE_DATETIME,
+    # information_schema reports TIMESTAMPTZ columns by the long name
+    "TIMESTAMPTZ": DataType.UTC_DATETIME, "TIMESTAMP WITH TIME ZONE": DataType.UTC_DATETIME,
+    "TIME": DataType.NAIVE_TIME, "TIMETZ": DataType.NAIVE_TIME, "TIME WITH TIME ZONE": DataType.NAIVE_TIME,
+    "BLOB": DataType.BINARY, "BYTEA": DataType.BINARY, "BINARY": DataType.BINARY, "VARBINARY": DataType.BINARY,
+    "JSON": DataType.JSON,
+    "VARCHAR": DataType.STRING, "CHAR": DataType.STRING, "BPCHAR": DataType.STRING, "TEXT": DataType.STRING,
+    "STRING": DataType.STRING,
+}
+DEFAULT_DATATYPE = DataType.STRING
+
+# Conversions of a raw CSV value (VARCHAR) to a column's type that are not a plain CAST
+CSV_CONVERSIONS = {
+    # Binary values are base64 encoded in batch files
+    DataType.BINARY: "from_base64({expression})",
+}
+
+
+def _boolean(text):
+    return text.lower() == "true"
+
+
+def _utc_datetime(text):
+    # fromisoformat() only accepts a trailing "Z" from Python 3.11 on
+    if text.endswith(("Z", "z")):
+        text = text[:-1] + "+00:00"
+    value = datetime.fromisoformat(text)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def _from_base64(text):
+    return base64.b64decode(text)
+
+
+# Conversion of a raw CSV value (str) to a Python value of each DataType, the Python counterpart
+# of CSV_CONVERSIONS and the casts; types missing here keep the text (STRING, XML, JSON)
+PYTHON_CONVERSIONS = {
+    DataType.BOOLEAN: _boolean,
+    DataType.SHORT: int,
+    DataType.INT: int,
+    DataType.LONG: int,
+    DataType.DECIMAL: Decimal,
+    DataType.FLOAT: float,
+    DataType.DOUBLE: float,
+    DataType.NAIVE_DATE: date.fromisoformat,
+    DataType.NAIVE_DATETIME: datetime.fromisoformat,
+    DataType.UTC_DATETIME: _utc_datetime,
+    DataType.NAIVE_TIME: time.fromisoformat,
+    DataType.BINARY: _from_base64,
+}
+
+# Distinct parameterized types and SQL type names remembered; schemas rarely use more than a few hundred
+TYPE_CACHE_SIZE = 1024
+
+_SQL_TYPE_PATTERN = re.compile(r"\s*([A-Z_][A-Z0-9_ ]*?)\s*(?:\(([^)]*)\))?\s*")
+
+
+def sql_type(datatype, column=None):
+    """
+    SQL type of a Fivetran DataType.
+
+    Args:
+        datatype: The Fivetran DataType enum value
+        column: Optional `common_pb2.Column` with type parameters (decimal precision/scale,
+            string byte length)
+
+    Returns:
+        SQL type string
+    """
+    if column is None or not column.HasField("params"):
+        return DATATYPE_TO_SQL.get(datatype, DEFAULT_SQL_TYPE)
+    params = column.params
+    decimal = (params.decimal.precision, params.decimal.scale) if params.HasField("decimal") else None
+    return sized_sql_type(datatype, decimal, params.string_byte_length)
+
+
+def sized_sql_type(datatype, decimal=None, string_byte_length=0):
+    """SQL type of a Fivetran DataType, sized by a DECIMAL's (precision, scale) or a STRING's byte length."""
+    if datatype == DataType.DECIMAL and decimal is not None:
+        return decimal_sql_type(*decimal)
+    if datatype == DataType.STRING and string_byte_length > 0:
+        return varchar_sql_type(string_byte_length)
+    return DATATYPE_TO_SQL.get(datatype, DEFAULT_SQL_TYPE)
+
+
+@lru_cache(maxsize=TYPE_CACHE_SIZE)
+def decimal_sql_type(precision, scale):
+    return f"DECIMAL({precision}, {scale})"
+
+
+@lru_cache(maxsize=TYPE_CACHE_SIZE)
+def varchar_sql_type(length):
+    return f"VARCHAR({length})"
+
+
+@lru_cache(maxsize=TYPE_CACHE_SIZE)
+def parse_sql_type(sql_type_name):
+    """
+    Parse an SQL type such as `DECIMAL(18,3)`, `VARCHAR(255)` or `TIMESTAMP WITH TIME ZONE`.
+
+    Unknown types map to STRING, with a warning logged once per type.
+
+    Returns:
+        (Fivetran DataType, tuple of the integer type parameters)
+    """
+    normalized = sql_type_name.upper()
+    match = _SQL_TYPE_PATTERN.fullmatch(normalized)
+    if match is None:
+        name, parameters = normalized.strip(), ()
+    else:
+        name = match.group(1)
+        parameters = tuple(int(part) for part in (match.group(2) or "").split(",") if part.strip().isdigit())
+    datatype = SQL_TO_DATATYPE.get(name)
+    if datatype is None:
+        log_message(WARNING, f"Unknown SQL type '{normalized}', defaulting to STRING")
+        datatype = DEFAULT_DATATYPE
+    return datatype, parameters
+
+
+def datatype_for_sql(sql_type_name):
+    """Fivetran DataType of an SQL type."""
+    return parse_sql_type(sql_type_name)[0]
+
+
+def cast(column, expression):
+    """SQL casting an expression to the SQL type of a column (a ColumnSchema)."""
+    return f"CAST({expression} AS {column.sql_type})"
+
+
+def python_conversion(datatype):
+    """Function converting a raw CSV value (str) of a DataType to a Python value, or None to keep the text."""
+    return PYTHON_CONVERSIONS.get(datatype)
+
+
+def csv_conversion(column, expression):
+    """SQL converting a raw CSV value (VARCHAR) to the SQL type of a column (a ColumnSchema)."""
+    template = CSV_CONVERSIONS.get(column.type)
+    if template is not None:
+        return template.format(expression=expression)
+    return cast(column, expression)
@@ -0,0 +1,457 @@
+import sys
+from contextlib import contextmanager, nullcontext
+sys.path.append('sdk_pb2')
+
+from sdk_pb2 import destination_sdk_pb2
+from sdk_pb2 import common_pb2
+import metrics_helper
+from applied_files_manifest import AppliedFilesManifest
+from log_helper import log_message
+from decoded_file_cache import DecodedFileCache, DEFAULT_MEMORY_BUDGET_BYTES, ROW_ORDER_COLUMN
+from resource_governor import OPERATION_WRITE
+from table_metadata_helper import FIVETRAN_START, FIVETRAN_END, FIVETRAN_ACTIVE
+import type_mapping
+from table_schema import TableSchema
+
+INFO = "INFO"
+WARNING = "WARNING"
+
+# Replace batches with at least this many distinct keys load with secondary indexes suspended
+INDEX_SUSPEND_MIN_ROWS = 100_000
+
+# Configuration field naming the clustering order: empty for arrival order, "primary_key", or a column name
+CLUSTER_BY_FIELD = "clusterBy"
+CLUSTER_BY_PRIMARY_KEY = "primary_key"
+# Share of a batch's memory budget (see ResourceGovernor) for its decoded files; the rest is left
+# to DuckDB for staging and merging
+DECODED_FILE_CACHE_SHARE = 0.25
+
+
+class WriteBatchHelper:
+    """Helper class for loading batch files into the destination (WriteBatch and WriteHistoryBatch)."""
+
+    def __init__(self, db_helper, maintenance_helper=None, resource_governor=None):
+        """
+        Args:
+            db_helper: DuckDBHelper of the destination
+            maintenance_helper: Optional MaintenanceHelper, which is kept away from tables while
+                they are written and told how many rows each batch changed
+            resource_governor: Optional ResourceGovernor, which budgets the memory and threads
+                of each batch
+        """
+        self.db_helper = db_helper
+        self.maintenance_helper = maintenance_helper
+        self.resource_governor = resource_governor
+        self.manifest = AppliedFilesManifest(db_helper)
+
+    def write_batch(self, request, default_schema):
+        """
+        Handle WriteBatch operation.
+
+        Replace, update and delete files are applied in that order, inside one transaction.
+        The rows of all files of a kind are staged together and deduplicated first, so the
+        table is touched once per primary key however often the key occurs in the batch.
+        Files recorded in the applied-files manifest by an earlier attempt are skipped.
+
+        Args:
+            request: WriteBatchRequest from Fivetran
+            default_schema: Default schema name
+
+        Returns:
+            WriteBatchResponse with success, or a task describing the failure
+        """
+        schema_name = request.schema_name if request.schema_name else default_schema
+        log_message(INFO, f"Data loading started for table {schema_name}.{request.table.name}")
+        with self._decoded_file_budget(request.configuration) as memory_budget:
+            cache = DecodedFileCache(self.db_helper, request.keys, request.file_params, memory_budget,
+                                     f"{schema_name}.{request.table.name}")
+            try:
+                batch = _UpsertBatch(self.db_helper, schema_name, TableSchema.from_proto(request.table),
+                                     request.file_params, cache, request.configuration.get(CLUSTER_BY_FIELD, "").strip())
+                stats = self.manifest.stat_files(
+                    list(request.replace_files) + list(request.update_files) + list(request.delete_files))
+                with self._table_write(schema_name, request.table.name), self.db_helper.transaction():
+                    applied = self._applied_files(stats, schema_name, request.table.name)
+                    replace_files = _pending(request.replace_files, applied)
+                    update_files = _pending(request.update_files, applied)
+                    delete_files = _pending(request.delete_files, applied)
+                    if replace_files:
+                        batch.apply_replace_files(replace_files)
+                    if update_files:
+                        batch.apply_update_files(update_files)
+                    if delete_files:
+                        batch.apply_delete_files(delete_files)
+                    new_files = {path: stat for path, stat in stats.items() if path not in applied}
+                    self.manifest.record(schema_name, request.table.name, new_files, cache.fingerprints)
+            except Exception as e:
+                log_message(WARNING, f"WriteBatch failed for {schema_name}.{request.table.name}: {str(e)}")
+                return destination_sdk_pb2.WriteBatchResponse(task=common_pb2.Task(message=str(e)))
+            finally:
+                cache.close()
+        log_message(INFO, f"Data loading completed for table {schema_name}.{request.table.name}")
+        self._record_changes(batch, new_files)
+        return destination_sdk_pb2.WriteBatchResponse(success=True)
+
+    def write_history_batch(self, request, default_schema):
+        """
+        Handle WriteHistoryBatch operation.
+
+        The files are applied in the order required by history mode, inside one transaction:
+        earliest_start_files, replace_files, update_files, delete_files. Every file is decoded
+        once into a DecodedFileCache, and each phase queries the decoded rows from there.
+        Files recorded in the applied-files manifest by an earlier attempt are skipped.
+
+        Args:
+            request: WriteHistoryBatchRequest from Fivetran
+            default_schema: Default schema name
+
+        Returns:
+            WriteBatchResponse with success, or a task describing the failure
+        """
+        schema_name = request.schema_name if request.schema_name else default_schema
+        log_message(INFO, f"Data loading started for history mode table {schema_name}.{request.table.name}")
+        with self._decoded_file_budget(request.configuration) as memory_budget:
+            cache = DecodedFileCache(self.db_helper, request.keys, request.file_params, memory_budget,
+                                     f"{schema_name}.{request.table.name}")
+            try:
+                batch = _HistoryBatch(self.db_helper, schema_name, TableSchema.from_proto(request.table),
+                                      request.file_params, cache, request.configuration.get(CLUSTER_BY_FIELD, "").strip())
+                stats = self.manifest.stat_files(
+                    list(request.earliest_start_files) + list(request.replace_files)
+                    + list(request.update_files) + list(request.delete_files))
+                with self._table_write(schema_name, request.table.name), self.db_helper.transaction():
+                    applied = self._applied_files(stats, schema_name, request.table.name)
+                    for path in _pending(request.earliest_start_files, applied):
+                        batch.apply_earliest_start_file(path)
+                    for path in _pending(request.replace_files, applied):
+                        batch.apply_replace_file(path)
+                    for path in _pending(request.update_files, applied):
+                        batch.apply_update_file(path)
+                    for path in _pending(request.delete_files, applied):
+                        batch.apply_delete_file(path)
+                    new_files = {path: stat for path, stat in stats.items() if path not in applied}
+                    self.manifest.record(schema_name, request.table.name, new_files, cache.fingerprints)
+            except Exception as e:
+                log_message(WARNING, f"WriteHistoryBatch failed for {schema_name}.{request.table.name}: {str(e)}")
+                return destination_sdk_pb2.WriteBatchResponse(task=common_pb2.Task(message=str(e)))
+            finally:
+                cache.close()
+        log_message(INFO, f"Data loading completed for history mode table {schema_name}.{request.table.name} "
+                          f"({cache.decoded_files} files decoded)")
+        self._record_changes(batch, new_files)
+        return destination_sdk_pb2.WriteBatchResponse(success=True)
+
+    @contextmanager
+    def _decoded_file_budget(self, configuration):
+        """Run a batch as a governed write operation and yield the memory budget for its decoded files."""
+        if self.resource_governor is None:
+            yield DEFAULT_MEMORY_BUDGET_BYTES
+            return
+        self.resource_governor.configure(configuration)
+        with self.resource_governor.operation(OPERATION_WRITE) as memory_budget:
+            yield int(memory_budget * DECODED_FILE_CACHE_SHARE)
+
+    def _table_write(self, schema_name, table_name):
+        if self.maintenance_helper is None:
+            return nullcontext()
+        return self.maintenance_helper.table_write(schema_name, table_name)
+
+    def _record_changes(self, batch, new_files):
+        """Count the rows and files a committed batch applied, in the metrics and for maintenance."""
+        table_label = f"{batch.schema_name}.{batch.table_name}"
+        metrics_helper.increment("applied_rows_total", batch.changed_rows, table=table_label)
+        metrics_helper.increment("applied_file_bytes_total", sum(size for size, _ in new_files.values()),
+                                 table=table_label)
+        if self.maintenance_helper is not None:
+            self.maintenance_helper.record_changes(batch.schema_name, batch.table_name,
+                                                   batch.changed_rows, batch.cluster_columns)
+
+    def _applied_files(self, stats, schema_name, table_name):
+        applied = self.manifest.applied_files(schema_name, stats)
+        if applied:
+            log_message(INFO, f"Skipping {len(applied)} of {len(stats)} batch files for "
+                              f"{schema_name}.{table_name} that were already applied")
+        return applied
+
+
+def _pending(paths, applied):
+    """The paths that are not in the set of applied files, in request order."""
+    return [path for path in paths if path not in applied]
+
+
+class _TableBatch:
+    """SQL building blocks shared by the batch loaders of one table."""
+
+    def __init__(self, db_helper, schema_name, table, file_params, cache, cluster_by=""):
+        self.db_helper = db_helper
+        self.file_params = file_params
+        self.cache = cache
+        self.schema_name = schema_name
+        self.table_name = table.name
+        self.target = (f'"{db_helper.escape_identifier(schema_name)}".'
+                       f'"{db_helper.escape_identifier(table.name)}"')
+        self.columns = {column.name: column for column in table.columns}
+        self.key_columns = [name for name in table.primary_key if name != FIVETRAN_START]
+        if not self.key_columns:
+            raise ValueError(f"Table {table.name} has no primary key")
+        self.cluster_columns = self._cluster_columns(table, cluster_by)
+        # Rows inserted, updated or deleted by this batch
+        self.changed_rows = 0
+
+    def _cluster_columns(self, table, cluster_by):
+        if not cluster_by:
+            return []
+        if cluster_by == CLUSTER_BY_PRIMARY_KEY:
+            return list(table.primary_key)
+        if cluster_by in self.columns:
+            return [cluster_by]
+        log_message(WARNING, f"Clustering column {cluster_by} is not in table {table.name}, keeping arrival order")
+        return []
+
+    def _order_by(self, columns):
+        """ORDER BY clause that sorts inserted rows into clustering order, or an empty string."""
+        names = [name for name in self.cluster_columns if name in columns]
+        if not names:
+            return ""
+        return " ORDER BY " + ", ".join(self._quote(name) for name in names)
+
+    def _loaded_columns(self, path):
+        """Columns of the batch file that exist in the table; other columns are ignored."""
+        return [name for name in self.cache.columns(path) if name in self.columns]
+
+    def _key_match(self, target_alias, batch_alias, typed=True):
+        conditions = []
+        for name in self.key_columns:
+            quoted = self._quote(name)
+            batch_value = f"{batch_alias}.{quoted}"
+            if typed:
+                batch_value = self._typed(name, batch_value)
+            conditions.append(f"{target_alias}.{quoted} = {batch_value}")
+        return " AND ".join(conditions)
+
+    def _typed_select(self, alias, names):
+        """Select list casting the given raw columns of `alias`, keeping their names."""
+        return ", ".join(f"{self._typed(name, f'{alias}.{self._quote(name)}')} AS {self._quote(name)}"
+                         for name in names)
+
+    def _typed(self, name, expression):
+        """Cast a raw CSV value (VARCHAR) to the SQL type of its column."""
+        return type_mapping.csv_conversion(self.columns[name], expression)
+
+    def _quote(self, name):
+        return f'"{self.db_helper.escape_identifier(name)}"'
+
+    def _execute(self, sql):
+        self.db_helper.get_connection().execute(sql)
+
+    def _apply(self, sql):
+        """Run a statement that changes the target table, counting the rows it changed."""
+        with metrics_helper.timer("phase_duration_seconds", phase="apply"):
+            result = self.db_helper.get_connection().execute(sql).fetchone()
+        self.changed_rows += result[0] if result else 0
+
+
+class _UpsertBatch(_TableBatch):
+    """SQL for the replace, update and delete files of one WriteBatchRequest."""
+
+    def apply_replace_files(self, paths):
+        """
+        Replace the rows of every key in the replace files.
+
+        When a key occurs several times, only its last occurrence is kept, in file order and
+        then row order within a file. The deduplication is a single window function over the
+        staged rows, so each key is deleted and inserted at most once.
+        """
+        columns = self._loaded_columns_of(paths)
+        self._execute(
+            f"CREATE OR REPLACE TEMP TABLE staged_replace AS "
+            f"SELECT {self._typed_select('b', columns)} "
+            f"FROM {self._staged(paths)} AS b "
+            f"QUALIFY row_number() OVER (PARTITION BY {self._typed_keys('b')} "
+            f"ORDER BY b.file_order DESC, b.{self._quote(ROW_ORDER_COLUMN)} DESC) = 1"
+        )
+        unique_keys = self._log_deduplication("replace", paths, "staged_replace")
+        if unique_keys >= INDEX_SUSPEND_MIN_ROWS:
+            with self.db_helper.suspended_indexes(self.schema_name, self.table_name):
+                self._replace_staged_rows(columns)
+        else:
+            self._replace_staged_rows(columns)
+        # Dropped on success only: a failed statement aborts the transaction, which then rejects
+        # every statement until it is rolled back, and the rollback removes the staged table
+        self._execute("DROP TABLE staged_replace")
+
+    def _replace_staged_rows(self, columns):
+        self._apply(f"DELETE FROM {self.target} AS t USING staged_replace AS s "
+                    f"WHERE {self._key_match('t', 's', typed=False)}")
+        quoted_columns = ", ".join(self._quote(name) for name in columns)
+        self._apply(f"INSERT INTO {self.target} ({quoted_columns}) SELECT {quoted_columns} FROM staged_replace"
+                    f"{self._order_by(columns)}")
+
+    def apply_update_files(self, paths):
+        """
+        Update the existing rows of every key in the update files.
+
+        The updates of a key are merged first: each column takes its last value that is not
+        `unmodified_string`, in file order and then row order, so each key is updated once.
+        Columns that stay unmodified keep their current value in the table.
+        """
+        columns = [name for name in self._loaded_columns_of(paths) if name not in self.key_columns]
+        unmodified = _literal(self.file_params.unmodified_string)
+        merged = [
+            # Wrap values in a struct so that NULLs (null_string) are kept by IGNORE NULLS
+            f"last_value(CASE WHEN b.{self._quote(name)} IS DISTINCT FROM {unmodified} "
+            f"THEN struct_pack(v := b.{self._quote(name)}) END IGNORE NULLS) OVER updates AS {self._quote(name)}"
+            for name in columns
+        ]
+        typed_keys = self._typed_select("b", self.key_columns)
+        self._execute(
+            f"CREATE OR REPLACE TEMP TABLE staged_update AS "
+            f"SELECT {', '.join([typed_keys] + merged)} FROM {self._staged(paths)} AS b "
+            f"WINDOW updates AS (PARTITION BY {self._typed_keys('b')} "
+            f"ORDER BY b.file_order, b.{self._quote(ROW_ORDER_COLUMN)} "
+            f"ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) "
+            f"QUALIFY row_number() OVER (PARTITION BY {self._typed_keys('b')}) = 1"
+        )
+        self._log_deduplication("update", paths, "staged_update")
+        if columns:
+            assignments = ", ".join(
+                f"{self._quote(name)} = CASE WHEN s.{self._quote(name)} IS NULL THEN t.{self._quote(name)} "
+                f"ELSE {self._typed(name, f's.{self._quote(name)}.v')} END"
+                for name in columns
+            )
+            self._apply(f"UPDATE {self.target} AS t SET {assignments} FROM staged_update AS s "
+                        f"WHERE {self._key_match('t', 's', typed=False)}")
+        # Dropped on success only, see apply_replace_files()
+        self._execute("DROP TABLE staged_update")
+
+    def apply_delete_files(self, paths):
+        """Delete the rows of every key in the delete files."""
+        self._apply(f"DELETE FROM {self.target} AS t USING {self._staged(paths)} AS b "
+                    f"WHERE {self._key_match('t', 'b')}")
+
+    def _staged(self, paths):
+        """All rows of the given files as one relation, with a `file_order` column."""
+        selects = [f"SELECT {index} AS file_order, * FROM {self.cache.relation(path)}"
+                   for index, path in enumerate(paths)]
+        return "(" + " UNION ALL BY NAME ".join(selects) + ")"
+
+    def _loaded_columns_of(self, paths):
+        columns = []
+        for path in paths:
+            columns.extend(name for name in self._loaded_columns(path) if name not in columns)
+        return columns
+
+    def _typed_keys(self, alias):
+        return ", ".join(self._typed(name, f"{alias}.{self._quote(name)}") for name in self.key_columns)
+
+    def _log_deduplication(self, kind, paths, staged_table):
+        staged_rows = self.db_helper.get_connection().execute(
+            f"SELECT COUNT(*) FROM {self._staged(paths)}").fetchone()[0]
+        unique_keys = self.db_helper.get_connection().execute(
+            f"SELECT COUNT(*) FROM {staged_table}").fetchone()[0]
+        log_message(INFO, f"Staged {staged_rows} {kind} rows for {self.target}, {unique_keys} unique keys")
+        return unique_keys
+
+
+class _HistoryBatch(_TableBatch):
+    """SQL for the four history mode phases of one WriteHistoryBatchRequest."""
+
+    def apply_earliest_start_file(self, path):
+        """
+        Delete the destination versions that the batch supersedes, i.e. those starting at or
+        after the earliest `_fivetran_start` of their key, and close the active version that
+        precedes them by setting `_fivetran_end` to 1 ms before that earliest start.
+        """
+        relation = self.cache.relation(path)
+        start = self._typed(FIVETRAN_START, f"b.{self._quote(FIVETRAN_START)}")
+        self._apply(
+            f"DELETE FROM {self.target} AS t USING {relation} AS b "
+            f"WHERE {self._key_match('t', 'b')} AND t.{self._quote(FIVETRAN_START)} >= {start}"
+        )
+        self._apply(
+            f"UPDATE {self.target} AS t SET {self._quote(FIVETRAN_ACTIVE)} = FALSE, "
+            f"{self._quote(FIVETRAN_END)} = {start} - INTERVAL 1 MILLISECOND "
+            f"FROM {relation} AS b "
+            f"WHERE {self._key_match('t', 'b')} AND t.{self._quote(FIVETRAN_ACTIVE)}"
+        )
+
+    def apply_replace_file(self, path):
+        """Insert the rows of a replace file as they are."""
+        relation = self.cache.relation(path)
+        columns = self._loaded_columns(path)
+        typed_columns = ", ".join(f"{self._typed(name, f'b.{self._quote(name)}')} AS {self._quote(name)}"
+                                  for name in columns)
+        self._apply(
+            f"INSERT INTO {self.target} ({', '.join(self._quote(name) for name in columns)}) "
+            f"SELECT * FROM (SELECT {typed_columns} FROM {relation} AS b){self._order_by(columns)}"
+        )
+
+    def apply_update_file(self, path):
+        """
+        Insert the rows of an update file as new versions.
+
+        Columns holding `unmodified_string` take the value of the previous version of the key:
+        the previous row of the same file if there is one (rows are chained in `_fivetran_start`
+        order), otherwise the latest destination version that starts before the key's first row
+        in the file. Table columns missing from the file are taken from that version as well.
+        """
+        relation = self.cache.relation(path)
+        file_columns = self._loaded_columns(path)
+        unmodified = _literal(self.file_params.unmodified_string)
+        raw_keys = ", ".join(f"b.{self._quote(name)}" for name in self.key_columns)
+        typed_keys = self._typed_select("b", self.key_columns)
+
+        filled = []
+        for name in file_columns:
+            quoted = self._quote(name)
+            if name in self.key_columns:
+                continue
+            # Wrap values in a struct so that NULLs (null_string) are kept by IGNORE NULLS
+            filled.append(
+                f"last_value(CASE WHEN b.{quoted} IS DISTINCT FROM {unmodified} "
+                f"THEN struct_pack(v := b.{quoted}) END IGNORE NULLS) OVER chain AS {quoted}"
+            )
+
+        selected = []
+        for name in self.columns:
+            quoted = self._quote(name)
+            if name in self.key_columns:
+                selected.append(f"f.{quoted} AS {quoted}")
+            elif name in file_columns:
+                selected.append(f"CASE WHEN f.{quoted} IS NULL THEN p.{quoted} "
+                                f"ELSE {self._typed(name, f'f.{quoted}.v')} END AS {quoted}")
+            else:
+                selected.append(f"p.{quoted} AS {quoted}")
+
+        start = self._quote(FIVETRAN_START)
+        target_keys = ", ".join(f"t.{self._quote(name)}" for name in self.key_columns)
+        self._apply(
+            f"INSERT INTO {self.target} ({', '.join(self._quote(name) for name in self.columns)}) "
+            f"WITH filled AS ("
+            f"  SELECT {typed_keys}, {', '.join(filled) if filled else 'NULL AS _unused'} FROM {relation} AS b"
+            f"  WINDOW chain AS (PARTITION BY {raw_keys} ORDER BY {self._typed(FIVETRAN_START, f'b.{start}')} "
+            f"                   ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW)"
+            f"), first_starts AS ("
+            f"  SELECT {typed_keys}, MIN({self._typed(FIVETRAN_START, f'b.{start}')}) AS first_start "
+            f"  FROM {relation} AS b GROUP BY ALL"
+            f"), previous AS ("
+            f"  SELECT t.* FROM {self.target} AS t JOIN first_starts AS s "
+            f"  ON {self._key_match('t', 's', typed=False)} AND t.{start} < s.first_start"
+            f"  QUALIFY row_number() OVER (PARTITION BY {target_keys} ORDER BY t.{start} DESC) = 1"
+            f") "
+            f"SELECT * FROM (SELECT {', '.join(selected)} FROM filled AS f "
+            f"LEFT JOIN previous AS p ON {self._key_match('p', 'f', typed=False)}){self._order_by(self.columns)}"
+        )
+
+    def apply_delete_file(self, path):
+        """Deactivate the active version of each key, ending it at the file's `_fivetran_end`."""
+        relation = self.cache.relation(path)
+        self._apply(
+            f"UPDATE {self.target} AS t SET {self._quote(FIVETRAN_ACTIVE)} = FALSE, "
+            f"{self._quote(FIVETRAN_END)} = {self._typed(FIVETRAN_END, f'b.{self._quote(FIVETRAN_END)}')} "
+            f"FROM {relation} AS b "
+            f"WHERE {self._key_match('t', 'b')} AND t.{self._quote(FIVETRAN_ACTIVE)}"
+        )
+
+def _literal(value):
+    return "'" + value.replace("'", "''") + "'"
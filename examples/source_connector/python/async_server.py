@@ -0,0 +1,149 @@
+import asyncio
+import grpc
+import itertools
+import sys
+from concurrent import futures
+sys.path.append('sdk_pb2')
+
+from sdk_pb2 import connector_sdk_pb2_grpc
+import metrics_helper
+import profiling_helper
+from main import (ConnectorService, build_arg_parser, parse_args, service_options, log_first_response, log_message,
+                  INFO, WARNING, SEVERE)
+
+# Records produced per hop to the source thread of an Update
+SOURCE_PAGE_RECORDS = 256
+
+
+class AsyncConnectorService(ConnectorService):
+    """
+    asyncio-native variant of ConnectorService for use with grpc.aio.
+
+    Many RPCs can be in flight at once, and while one Update awaits the source, the event loop
+    keeps serving the others. ConfigurationForm, Test and Schema are cheap and reuse the
+    synchronous handlers as they are. Update awaits source I/O and writes each response with
+    `context.write`, which waits for the client to accept it (HTTP/2 flow control), so a slow
+    reader throttles the source instead of buffering responses in memory.
+    """
+
+    async def ConfigurationForm(self, request, context):
+        return super().ConfigurationForm(request, context)
+
+    async def Test(self, request, context):
+        return super().Test(request, context)
+
+    async def Schema(self, request, context):
+        return super().Schema(request, context)
+
+    async def _fetch_records(self, source_thread, records):
+        """
+        Stand-in for awaiting the source. A real connector awaits its async HTTP client
+        (aiohttp, httpx, ...) here and yields the records of each page as it arrives.
+
+        The records are produced a page at a time on `source_thread`, because producing them
+        reads and writes the fingerprint store, and sqlite3 calls would block the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        records = iter(records)
+        while True:
+            page = await loop.run_in_executor(source_thread, _next_page, records)
+            if not page:
+                return
+            for rec in page:
+                await asyncio.sleep(0)
+                yield rec
+
+    async def _write_all(self, context, responses):
+        for response in self._counted(responses):
+            await context.write(response)
+
+    async def Update(self, request, context):
+        """
+        Async update handler: same record pipeline as ConnectorService.Update (fingerprint
+        suppression, coalescing, batching), driven by awaited source reads.
+
+        Everything that touches the fingerprint store (opening it, producing records, the
+        commit of the checkpoint, closing it) runs on one worker thread per call, in order,
+        so the store's sqlite3 connection is never used concurrently.
+        """
+        log_message(WARNING, "Sync Start")
+        loop = asyncio.get_running_loop()
+        source_thread = futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="update-source")
+        state = self._initialize_state(request)
+        fingerprints = None
+        coalescer = self._new_coalescer()
+        batcher = self._new_batcher()
+
+        async def emit(rec):
+            if coalescer is None:
+                await self._write_all(context, batcher.add(rec))
+                return
+            for released in coalescer.add(rec):
+                await self._write_all(context, batcher.add(released))
+
+        try:
+            fingerprints = await loop.run_in_executor(source_thread, self._open_fingerprint_store, state)
+            async for rec in self._fetch_records(source_thread,
+                                                 self._generate_batched_records(state, fingerprints)):
+                await emit(rec)
+
+            if coalescer is None:
+                await self._write_all(context, batcher.flush())
+                async for rec in self._fetch_records(source_thread,
+                                                     self._generate_individual_records(state, fingerprints)):
+                    await self._write_all(context, self._emit_individual_records([rec]))
+            else:
+                # Coalescing needs every operation in one window, so all records go through batching
+                async for rec in self._fetch_records(source_thread,
+                                                     self._generate_individual_records(state, fingerprints)):
+                    await emit(rec)
+                for released in coalescer.flush():
+                    await self._write_all(context, batcher.add(released))
+                await self._write_all(context, batcher.flush())
+
+            checkpoint = await loop.run_in_executor(source_thread, list, self._emit_checkpoint(state, fingerprints))
+            await self._write_all(context, checkpoint)
+        finally:
+            if fingerprints is not None:
+                await loop.run_in_executor(source_thread, fingerprints.close)
+            source_thread.shutdown(wait=False)
+
+        log_message(SEVERE, "Completed Update with batched + individual records")
+
+
+def _next_page(records):
+    return list(itertools.islice(records, SOURCE_PAGE_RECORDS))
+
+
+async def serve(args):
+    interceptors = [metrics_helper.AsyncMetricsInterceptor(on_first_response=log_first_response)]
+    profiler = profiling_helper.profiler_from_args(args, log_message)
+    if profiler:
+        interceptors.append(profiling_helper.AsyncProfilingInterceptor(profiler))
+    server = grpc.aio.server(interceptors=interceptors)
+    connector_sdk_pb2_grpc.add_SourceConnectorServicer_to_server(AsyncConnectorService(**service_options(args)), server)
+    server.add_insecure_port(f'[::]:{args.port}')
+    metrics_exporter = metrics_helper.exporter_from_args(args)
+    if metrics_exporter:
+        metrics_exporter.start()
+    await server.start()
+    print(f"Async server started on port {args.port}...")
+    try:
+        await server.wait_for_termination()
+    finally:
+        # Let in-flight RPCs finish before shutting down
+        await server.stop(grace=5)
+        if metrics_exporter:
+            metrics_exporter.stop()
+        print("Server terminated.")
+
+
+def start_async_server():
+    args = parse_args(build_arg_parser())
+    log_message(INFO, "Using the grpc.aio server")
+    asyncio.run(serve(args))
+
+
+if __name__ == '__main__':
+    print("Starting the async server...")
+    start_async_server()
@@ -0,0 +1,141 @@
+import hashlib
+import sqlite3
+
+from log_helper import log_message
+
+INFO = "INFO"
+WARNING = "WARNING"
+
+
+class FingerprintStore:
+    """
+    Persistent, size-bounded store of row fingerprints keyed by (table, primary key).
+
+    Used to drop UPSERTs of rows that have not changed since they were last sent, which is
+    what full re-read sources produce for most rows. Fingerprints live in a local SQLite file
+    and the least recently used entries are evicted once the store exceeds `max_entries`.
+
+    Changes are only made durable by commit(), which must happen when the checkpoint that
+    covers the emitted rows is sent. Each commit bumps a generation number that is recorded in
+    the checkpoint state; a store whose generation does not match the state it is opened with
+    (first sync, re-sync, or a checkpoint that Fivetran never persisted) is cleared, so rows
+    are never suppressed unless the destination is known to have them.
+    """
+
+    def __init__(self, path, max_entries, generation=None):
+        """
+        Args:
+            path: Location of the SQLite file
+            max_entries: Maximum number of fingerprints kept after each commit
+            generation: Generation recorded in the checkpoint state, or None if there is none
+        """
+        self.path = path
+        self.max_entries = max_entries
+        # Accessed from whichever thread drives the Update stream, never concurrently
+        self._connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                table_name TEXT NOT NULL,
+                pk BLOB NOT NULL,
+                digest BLOB NOT NULL,
+                last_used INTEGER NOT NULL,
+                PRIMARY KEY (table_name, pk)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS fingerprints_last_used ON fingerprints (last_used);
+            CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        """)
+        self.generation = self._read_metadata("generation", 0)
+        if generation != self.generation:
+            log_message(WARNING, f"Fingerprint store {path} does not match checkpoint state, clearing it")
+            self._connection.execute("DELETE FROM fingerprints")
+            self.generation = self.generation + 1
+            self._write_metadata("generation", self.generation)
+        self._clock = self._read_metadata("clock", 0)
+        self._connection.execute("BEGIN")
+
+    def is_unchanged(self, table, pk_values, data):
+        """
+        Check whether a row matches the fingerprint stored for its key, and record the row.
+
+        Args:
+            table: Table name
+            pk_values: Dict of primary key column -> ValueType
+            data: Dict of column -> ValueType for the whole row
+
+        Returns:
+            True if the row was sent before with identical values, False otherwise
+        """
+        pk = _encode(pk_values)
+        digest = hashlib.blake2b(_encode(data), digest_size=16).digest()
+        self._clock += 1
+        row = self._connection.execute(
+            "SELECT digest FROM fingerprints WHERE table_name = ? AND pk = ?", (table, pk)
+        ).fetchone()
+        self._connection.execute(
+            "INSERT INTO fingerprints (table_name, pk, digest, last_used) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (table_name, pk) DO UPDATE SET digest = excluded.digest, last_used = excluded.last_used",
+            (table, pk, digest, self._clock),
+        )
+        return row is not None and row[0] == digest
+
+    def forget(self, table, pk_values):
+        """Drop the fingerprint of a key whose row was deleted or partially updated."""
+        self._connection.execute(
+            "DELETE FROM fingerprints WHERE table_name = ? AND pk = ?", (table, _encode(pk_values))
+        )
+
+    def commit(self):
+        """
+        Evict least recently used entries beyond `max_entries` and make all changes durable.
+
+        Returns:
+            The new generation, to be recorded in the checkpoint state
+        """
+        count = self._connection.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+        if count > self.max_entries:
+            self._connection.execute(
+                "DELETE FROM fingerprints WHERE (table_name, pk) IN "
+                "(SELECT table_name, pk FROM fingerprints ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,),
+            )
+            log_message(INFO, f"Evicted {count - self.max_entries} fingerprints from {self.path}")
+        self.generation += 1
+        self._write_metadata("generation", self.generation)
+        self._write_metadata("clock", self._clock)
+        self._connection.execute("COMMIT")
+        self._connection.execute("BEGIN")
+        return self.generation
+
+    def close(self):
+        """Discard uncommitted changes and close the store."""
+        if self._connection is None:
+            return
+        try:
+            if self._connection.in_transaction:
+                self._connection.execute("ROLLBACK")
+            self._connection.close()
+        finally:
+            self._connection = None
+
+    def _read_metadata(self, name, default):
+        row = self._connection.execute("SELECT value FROM metadata WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else default
+
+    def _write_metadata(self, name, value):
+        self._connection.execute(
+            "INSERT INTO metadata (name, value) VALUES (?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET value = excluded.value",
+            (name, value),
+        )
+
+
+def _encode(values):
+    """Deterministic byte encoding of a column -> ValueType map."""
+    parts = []
+    for col in sorted(values):
+        encoded_col = col.encode("utf-8")
+        encoded_val = values[col].SerializeToString(deterministic=True)
+        parts.append(len(encoded_col).to_bytes(4, "big") + encoded_col)
+        parts.append(len(encoded_val).to_bytes(4, "big") + encoded_val)
+    return b"".join(parts)
+
@@ -0,0 +1,16 @@
+import json
+
+INFO = "INFO"
+WARNING = "WARNING"
+SEVERE = "SEVERE"
+MESSAGE_ORIGIN = "sdk_connector"
+
+
+def format_line(level, message):
+    """Format one log line as the SDK expects it; the message is escaped, so quotes and backslashes are safe."""
+    return f'{{"level": "{level}", "message": {json.dumps(message)}, "message-origin": "{MESSAGE_ORIGIN}"}}'
+
+
+def log_message(level, message):
+    """Log a message at the given level (INFO, WARNING or SEVERE) to stdout."""
+    print(format_line(level, message))
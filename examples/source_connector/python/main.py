@@ -3,21 +3,51 @@ from concurrent import futures
 import json
 import sys
 import argparse
+import itertools
+import os
+from collections import Counter
 sys.path.append('sdk_pb2')
 
 from sdk_pb2 import connector_sdk_pb2_grpc
 from sdk_pb2 import common_pb2
 from sdk_pb2 import connector_sdk_pb2
+from record_packer import GreedyBatcher, RecordPacker
+from record_coalescer import RecordCoalescer
+import metrics_helper
+import profiling_helper
+from log_helper import log_message
 
 INFO = "INFO"
 WARNING = "WARNING"
 SEVERE = "SEVERE"
 MAX_BATCH_RECORDS = 100 # The maximum number of records in a batch allowed by Fivetran
 MAX_BATCH_SIZE_IN_BYTES = 100 * 1024  # 100 KiB
+DEFAULT_PACKING_WINDOW = 0  # Records buffered per table for bin-packing; 0 keeps the greedy batcher
+DEFAULT_COALESCE_WINDOW = 0  # Primary keys held pending for coalescing; 0 disables coalescing
+DEFAULT_FINGERPRINT_MAX_ENTRIES = 1_000_000  # Rows remembered by the fingerprint store before LRU eviction
 
 class ConnectorService(connector_sdk_pb2_grpc.SourceConnectorServicer):
+    # ConfigurationFormResponse, built on the first ConfigurationForm call and served from then on
+    _configuration_form = None
+
+    def __init__(self, packing_window=DEFAULT_PACKING_WINDOW, coalesce_window=DEFAULT_COALESCE_WINDOW,
+                 fingerprint_store_path=None, fingerprint_max_entries=DEFAULT_FINGERPRINT_MAX_ENTRIES):
+        super().__init__()
+        self.packing_window = packing_window
+        self.coalesce_window = coalesce_window
+        # Unchanged-row suppression is enabled when a fingerprint store path is configured
+        self.fingerprint_store_path = fingerprint_store_path
+        self.fingerprint_max_entries = fingerprint_max_entries
+        self._primary_keys = None
+
     def ConfigurationForm(self, request, context):
         log_message(INFO, "Fetching configuration form")
+        # The form never changes, so it is built once and the same message is served every time
+        if ConnectorService._configuration_form is None:
+            ConnectorService._configuration_form = self._build_configuration_form()
+        return ConnectorService._configuration_form
+
+    def _build_configuration_form(self):
         form_fields = common_pb2.ConfigurationFormResponse(schema_selection_supported=True,
                                                            table_selection_supported=True)
         # Add the 'apiBaseURL' field
@@ -250,18 +280,6 @@ class ConnectorService(connector_sdk_pb2_grpc.SourceConnectorServicer):
             rec.data[col].CopyFrom(val)
         return rec
 
-    def _records_byte_size(self, records_list):
-        """Compute serialized size (bytes) of a Records batch via protobuf ByteSize()."""
-        return connector_sdk_pb2.Records(records=records_list).ByteSize()
-
-    def _flush_batch_if_not_empty(self, batch):
-        """Yield a batched UpdateResponse if the batch is not empty, then clear it."""
-        if batch:
-            yield connector_sdk_pb2.UpdateResponse(
-                records=connector_sdk_pb2.Records(records=batch)
-            )
-            batch.clear()
-
     def _initialize_state(self, request) -> dict:
         state_json = "{}"
         if request.HasField('state_json'):
@@ -271,91 +289,155 @@ class ConnectorService(connector_sdk_pb2_grpc.SourceConnectorServicer):
             state["cursor"] = 0
         return state
 
-    def _emit_batched_records(self, state: dict):
+    def _primary_keys_by_table(self) -> dict:
+        """Map each table declared by Schema() to its primary key column names."""
+        if self._primary_keys is None:
+            # Call the base handler directly: subclasses may override Schema as a coroutine
+            schema = ConnectorService.Schema(self, None, None)
+            self._primary_keys = {
+                table.name: [col.name for col in table.columns if col.primary_key]
+                for table in schema.without_schema.tables
+            }
+        return self._primary_keys
+
+    def _open_fingerprint_store(self, state: dict):
         """
-        Batch records while enforcing BOTH:
-          - <= MAX_BATCH_RECORDS per batch
-          - <= MAX_BATCH_SIZE_IN_BYTES serialized size per batch
+        Open the fingerprint store referenced by the checkpoint state, falling back to the
+        configured path. Returns None when unchanged-row suppression is disabled.
+        """
+        if not self.fingerprint_store_path:
+            return None
+        # Imported on first use, so that connectors without a store do not load sqlite3 at startup
+        from fingerprint_store import FingerprintStore
+        reference = state.get("fingerprint_store") or {}
+        path = reference.get("path") or os.path.abspath(self.fingerprint_store_path)
+        return FingerprintStore(path, self.fingerprint_max_entries, generation=reference.get("generation"))
+
+    def _is_unchanged_upsert(self, fingerprints, table: str, data: dict) -> bool:
+        """True if the fingerprint store has already seen this exact row for its primary key."""
+        if fingerprints is None:
+            return False
+        pk_columns = self._primary_keys_by_table().get(table)
+        if not pk_columns:
+            return False
+        pk_values = {col: data[col] for col in pk_columns}
+        return fingerprints.is_unchanged(table, pk_values, data)
+
+    def _forget_fingerprint(self, fingerprints, table: str, data: dict):
+        """Drop the stored fingerprint for a row that is deleted or only partially updated."""
+        if fingerprints is None:
+            return
+        pk_columns = self._primary_keys_by_table().get(table)
+        if pk_columns:
+            fingerprints.forget(table, {col: data[col] for col in pk_columns})
+
+    def _generate_batched_records(self, state: dict, fingerprints=None):
+        """
+        Produce the records that are sent in batches, advancing the cursor for each.
+        UPSERTs of rows that are unchanged since the last checkpoint are dropped when a
+        fingerprint store is given.
         """
-        batch = []
-
-        def can_append_without_exceeding_caps(candidate: connector_sdk_pb2.Record) -> bool:
-            # Count cap
-            if len(batch) + 1 > MAX_BATCH_RECORDS:
-                return False
-            # Byte-size cap (exact via proto ByteSize)
-            return self._records_byte_size(batch + [candidate]) <= MAX_BATCH_SIZE_IN_BYTES
-
-        def append_or_flush_then_append(candidate: connector_sdk_pb2.Record):
-            """Append candidate or flush first; if still too big alone, emit individually."""
-            nonlocal batch
-            if can_append_without_exceeding_caps(candidate):
-                batch.append(candidate)
-                return
-
-            # Flush current batch first
-            yield from self._flush_batch_if_not_empty(batch)
-
-            # If candidate still exceeds size cap by itself, send individually
-            if self._records_byte_size([candidate]) > MAX_BATCH_SIZE_IN_BYTES:
-                log_message(WARNING, "Single record exceeds 100KiB, emitting individually")
-                yield connector_sdk_pb2.UpdateResponse(record=candidate)
-            else:
-                batch.append(candidate)
-
         # Demo data: UPSERTs for table1
         for t in range(0, 3):
-            rec = self._build_record(
-                table="table1",
-                record_type=common_pb2.RecordType.UPSERT,
-                data={
-                    "a1": self._make_string_value(f"a-{t}"),
-                    "a2": self._make_double_value(t * 0.234),
-                },
-            )
+            data = {
+                "a1": self._make_string_value(f"a-{t}"),
+                "a2": self._make_double_value(t * 0.234),
+            }
             state["cursor"] += 1
-            yield from append_or_flush_then_append(rec)
+            if self._is_unchanged_upsert(fingerprints, "table1", data):
+                continue
+            yield self._build_record(table="table1", record_type=common_pb2.RecordType.UPSERT, data=data)
 
         # Demo data: UPSERT for table2
-        rec = self._build_record(
-            table="table2",
-            record_type=common_pb2.RecordType.UPSERT,
-            data={
-                "b1": self._make_string_value("b1"),
-                "b2": self._make_string_value("ben"),
-            },
-        )
+        data = {
+            "b1": self._make_string_value("b1"),
+            "b2": self._make_string_value("ben"),
+        }
         state["cursor"] += 1
-        yield from append_or_flush_then_append(rec)
+        if not self._is_unchanged_upsert(fingerprints, "table2", data):
+            yield self._build_record(table="table2", record_type=common_pb2.RecordType.UPSERT, data=data)
+
+    def _new_batcher(self):
+        """
+        Create the batcher for one Update call. Both batchers enforce:
+          - <= MAX_BATCH_RECORDS per batch
+          - <= MAX_BATCH_SIZE_IN_BYTES serialized size per batch
+        The bin-packing RecordPacker buffers up to `packing_window` records per table to fill
+        batches closer to the caps; records sharing a primary key keep their relative order.
+        """
+        if self.packing_window > 0:
+            return RecordPacker(
+                max_records=MAX_BATCH_RECORDS,
+                max_bytes=MAX_BATCH_SIZE_IN_BYTES,
+                window_size=self.packing_window,
+                primary_keys=self._primary_keys_by_table(),
+            )
+        return GreedyBatcher(MAX_BATCH_RECORDS, MAX_BATCH_SIZE_IN_BYTES)
+
+    def _new_coalescer(self):
+        """Create the coalescer for one Update call, or None if coalescing is disabled."""
+        if self.coalesce_window > 0:
+            return RecordCoalescer(self.coalesce_window, self._primary_keys_by_table())
+        return None
+
+    def _emit_batched_records(self, records):
+        """Batch records and yield the resulting UpdateResponses."""
+        batcher = self._new_batcher()
+        for rec in records:
+            yield from batcher.add(rec)
 
         # Final flush of leftovers
-        yield from self._flush_batch_if_not_empty(batch)
+        yield from batcher.flush()
 
-    def _emit_individual_records(self, state: dict):
+    def _coalesce_records(self, records):
+        """
+        Collapse successive operations on the same primary key (as declared by Schema())
+        into one net operation, holding up to `coalesce_window` keys pending at a time.
+        """
+        coalescer = self._new_coalescer()
+        for rec in records:
+            yield from coalescer.add(rec)
+        yield from coalescer.flush()
+
+    def _generate_individual_records(self, state: dict, fingerprints=None):
+        """Produce the records that are sent one per UpdateResponse, advancing the cursor for each."""
         # UPDATE
-        update_record = self._build_record(
-            table="table1",
-            record_type=common_pb2.RecordType.UPDATE,
-            data={
-                "a1": self._make_string_value("a-0"),
-                "a2": self._make_double_value(110.234),
-            },
-        )
-        yield connector_sdk_pb2.UpdateResponse(record=update_record)
+        data = {
+            "a1": self._make_string_value("a-0"),
+            "a2": self._make_double_value(110.234),
+        }
+        self._forget_fingerprint(fingerprints, "table1", data)
+        yield self._build_record(table="table1", record_type=common_pb2.RecordType.UPDATE, data=data)
         state["cursor"] += 1
-        log_message(WARNING, "Emitted individual UPDATE record")
 
         # DELETE
-        delete_record = self._build_record(
-            table="table1",
-            record_type=common_pb2.RecordType.DELETE,
-            data={"a1": self._make_string_value("a-2")},
-        )
-        yield connector_sdk_pb2.UpdateResponse(record=delete_record)
+        data = {"a1": self._make_string_value("a-2")}
+        self._forget_fingerprint(fingerprints, "table1", data)
+        yield self._build_record(table="table1", record_type=common_pb2.RecordType.DELETE, data=data)
         state["cursor"] += 1
-        log_message(WARNING, "Emitted individual DELETE record")
 
-    def _emit_checkpoint(self, state: dict):
+    def _emit_individual_records(self, records):
+        for rec in records:
+            yield connector_sdk_pb2.UpdateResponse(record=rec)
+            log_message(WARNING, f"Emitted individual {common_pb2.RecordType.Name(rec.type)} record")
+
+    def _counted(self, responses):
+        """Pass UpdateResponses through, adding their records and bytes to the metrics."""
+        for response in responses:
+            operation = response.WhichOneof("operation")
+            if operation in ("record", "records"):
+                records = [response.record] if operation == "record" else response.records.records
+                for (table, record_type), count in Counter(
+                        (rec.table_name, rec.type) for rec in records).items():
+                    metrics_helper.increment("records_total", count, table=table,
+                                             type=common_pb2.RecordType.Name(record_type))
+            metrics_helper.increment("response_bytes_total", response.ByteSize())
+            yield response
+
+    def _emit_checkpoint(self, state: dict, fingerprints=None):
+        if fingerprints is not None:
+            # Fingerprints become durable together with the checkpoint that covers their rows
+            state["fingerprint_store"] = {"path": fingerprints.path, "generation": fingerprints.commit()}
         checkpoint = connector_sdk_pb2.Checkpoint()
         checkpoint.state_json = json.dumps(state)
         yield connector_sdk_pb2.UpdateResponse(checkpoint=checkpoint)
@@ -366,34 +448,93 @@ class ConnectorService(connector_sdk_pb2_grpc.SourceConnectorServicer):
         """
         log_message(WARNING, "Sync Start")
         state = self._initialize_state(request)
+        fingerprints = self._open_fingerprint_store(state)
+
+        try:
+            if self.coalesce_window > 0:
+                # Coalescing needs every operation in one window, so all records go through batching
+                records = itertools.chain(self._generate_batched_records(state, fingerprints),
+                                          self._generate_individual_records(state, fingerprints))
+                yield from self._counted(self._emit_batched_records(self._coalesce_records(records)))
+            else:
+                yield from self._counted(
+                    self._emit_batched_records(self._generate_batched_records(state, fingerprints)))
 
-        yield from self._emit_batched_records(state)
-
-        yield from self._emit_individual_records(state)
+                yield from self._counted(
+                    self._emit_individual_records(self._generate_individual_records(state, fingerprints)))
 
-        yield from self._emit_checkpoint(state)
+            yield from self._counted(self._emit_checkpoint(state, fingerprints))
+        finally:
+            if fingerprints is not None:
+                fingerprints.close()
 
         log_message(SEVERE, "Completed Update with batched + individual records")
 
 
-def log_message(level, message):
-    print(f'{{"level":"{level}", "message": "{message}", "message-origin": "sdk_connector"}}')
 
+def log_first_response(method, seconds):
+    """Report the time to first response, which cold-starting pods pay on every sync."""
+    log_message(INFO, f"First response ({method}) {seconds:.3f}s after process start")
 
-def start_server():
+
+def build_arg_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument("--port", type=int, default=50051,
                         help="The server port")
+    parser.add_argument("--packing-window", type=int, default=DEFAULT_PACKING_WINDOW,
+                        help="Records buffered per table for bin-packed batches "
+                             f"(0 disables packing; otherwise must be >= {MAX_BATCH_RECORDS})")
+    parser.add_argument("--coalesce-window", type=int, default=DEFAULT_COALESCE_WINDOW,
+                        help="Primary keys held pending while collapsing repeated operations "
+                             "on the same key (0 disables coalescing)")
+    parser.add_argument("--fingerprint-store", default=None,
+                        help="SQLite file used to suppress UPSERTs of unchanged rows (disabled if not set)")
+    parser.add_argument("--fingerprint-max-entries", type=int, default=DEFAULT_FINGERPRINT_MAX_ENTRIES,
+                        help="Maximum number of row fingerprints kept, least recently used are evicted first")
+    metrics_helper.add_arguments(parser)
+    profiling_helper.add_arguments(parser)
+    return parser
+
+
+def parse_args(parser):
     args = parser.parse_args()
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=1))
-    connector_sdk_pb2_grpc.add_SourceConnectorServicer_to_server(ConnectorService(), server)
+    if args.coalesce_window < 0:
+        parser.error("--coalesce-window must not be negative")
+    if 0 < args.packing_window < MAX_BATCH_RECORDS:
+        parser.error(f"--packing-window must be 0 or at least {MAX_BATCH_RECORDS}")
+    return args
+
+
+def service_options(args) -> dict:
+    """Keyword arguments for ConnectorService (or a subclass) built from parsed arguments."""
+    return dict(packing_window=args.packing_window,
+                coalesce_window=args.coalesce_window,
+                fingerprint_store_path=args.fingerprint_store,
+                fingerprint_max_entries=args.fingerprint_max_entries)
+
+
+def start_server():
+    args = parse_args(build_arg_parser())
+    interceptors = [metrics_helper.MetricsInterceptor(on_first_response=log_first_response)]
+    profiler = profiling_helper.profiler_from_args(args, log_message)
+    if profiler:
+        interceptors.append(profiling_helper.ProfilingInterceptor(profiler))
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=1), interceptors=interceptors)
+    connector_sdk_pb2_grpc.add_SourceConnectorServicer_to_server(ConnectorService(**service_options(args)), server)
     server.add_insecure_port(f'[::]:{args.port}')
+    metrics_exporter = metrics_helper.exporter_from_args(args)
+    if metrics_exporter:
+        metrics_exporter.start()
     server.start()
     print(f"Server started on port {args.port}...")
-    server.wait_for_termination()
+    try:
+        server.wait_for_termination()
+    finally:
+        if metrics_exporter:
+            metrics_exporter.stop()
     print("Server terminated.")
 
 
 if __name__ == '__main__':
     print("Starting the server...")
-    start_server()
\ No newline at end of file
+    start_server()
@@ -0,0 +1,273 @@
+# RPC profiling of the source servers. The destination connector example has its own
+# profiling_helper.py: the examples are self-contained and share no code
+import itertools
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import grpc
+
+INFO = "INFO"
+WARNING = "WARNING"
+
+MODE_CPROFILE = "cprofile"
+MODE_TRACEMALLOC = "tracemalloc"
+MODE_BOTH = "both"
+MODES = (MODE_CPROFILE, MODE_TRACEMALLOC, MODE_BOTH)
+# Directory the profiles are written to, relative to the working directory
+DEFAULT_PROFILE_DIRECTORY = "profiles"
+# Allocation sites listed in a tracemalloc report
+TRACEMALLOC_TOP_LINES = 30
+# Frames kept per traced allocation
+TRACEMALLOC_FRAMES = 5
+# Invocation metadata keys that carry a request ID, if the client sends one
+REQUEST_ID_METADATA_KEYS = ("x-request-id", "request-id")
+
+
+class RpcProfiler:
+    """
+    Profiles sampled calls of selected RPCs with cProfile and/or tracemalloc.
+
+    Every `every`-th call of each selected method is profiled. When `slower_than_seconds` is
+    set, the profile is only kept if the call took at least that long; the call still has to
+    be profiled from its start, so all sampled calls pay the profiling overhead. Profiles are
+    written to `directory`, named after the method and request ID of the call:
+      - `<name>.prof`: cProfile statistics, for `pstats` or a viewer such as snakeviz
+      - `<name>.tracemalloc.txt`: allocation sites that grew the most during the call, and
+        the peak of traced memory
+
+    cProfile only sees the thread it was enabled in, so the profiled function must run in one
+    thread. tracemalloc traces the whole process, and runs only while a sampled call does.
+    """
+
+    def __init__(self, methods, directory=DEFAULT_PROFILE_DIRECTORY, mode=MODE_CPROFILE, every=1,
+                 slower_than_seconds=0.0, log_message=None):
+        """
+        Args:
+            methods: Names of the RPCs to profile, e.g. {"WriteBatch", "Migrate"}
+            directory: Directory the profiles are written to
+            mode: MODE_CPROFILE, MODE_TRACEMALLOC or MODE_BOTH
+            every: Profile every n-th call of each method
+            slower_than_seconds: Only keep the profiles of calls that took at least this long
+            log_message: Optional function(level, message) reporting the profiles written
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode '{mode}', expected one of {list(MODES)}")
+        if every < 1:
+            raise ValueError("Profiling every n-th call needs n >= 1")
+        self.methods = set(methods)
+        self.directory = directory
+        self.mode = mode
+        self.every = every
+        self.slower_than_seconds = slower_than_seconds
+        self.log_message = log_message
+        self._lock = threading.Lock()
+        # Method -> calls seen so far
+        self._calls = {}
+        self._sequence = itertools.count(1)
+        self._tracing_calls = 0
+
+    def sampled(self, method):
+        """Count a call of the method and return whether it is profiled."""
+        if method not in self.methods:
+            return False
+        with self._lock:
+            calls = self._calls.get(method, 0)
+            self._calls[method] = calls + 1
+        return calls % self.every == 0
+
+    @contextmanager
+    def profile(self, method, context=None):
+        """Context manager profiling its block, if this call of the method is sampled."""
+        if not self.sampled(method):
+            yield
+            return
+        name = self._profile_name(method, context)
+        profiler = self._enable_cprofile() if self.mode in (MODE_CPROFILE, MODE_BOTH) else None
+        tracing = self.mode in (MODE_TRACEMALLOC, MODE_BOTH)
+        snapshot = self._start_tracemalloc() if tracing else None
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started
+            if profiler is not None:
+                profiler.disable()
+            report = self._tracemalloc_report(snapshot) if tracing else None
+            if duration >= self.slower_than_seconds:
+                self._write(name, method, duration, profiler, report)
+
+    def _enable_cprofile(self):
+        # The profilers are imported on first use, so that they cost nothing while profiling is off
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # Newer Pythons allow a single active profiler at a time
+            self._log(WARNING, f"Not profiling with cProfile: {str(e)}")
+            return None
+        return profiler
+
+    def _start_tracemalloc(self):
+        import tracemalloc
+        with self._lock:
+            self._tracing_calls += 1
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+            tracemalloc.reset_peak()
+            return tracemalloc.take_snapshot()
+
+    def _tracemalloc_report(self, start_snapshot):
+        import tracemalloc
+        with self._lock:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            self._tracing_calls -= 1
+            if not self._tracing_calls:
+                tracemalloc.stop()
+        lines = [f"Peak traced memory: {peak} bytes (all threads)", "",
+                 f"Top {TRACEMALLOC_TOP_LINES} allocation sites by growth during the call:"]
+        lines.extend(str(stat) for stat in snapshot.compare_to(start_snapshot, "lineno")[:TRACEMALLOC_TOP_LINES])
+        return "\n".join(lines) + "\n"
+
+    def _profile_name(self, method, context):
+        request_id = _request_id(context) or f"{os.getpid()}-{next(self._sequence)}"
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{method}-{request_id}"
+        return re.sub(r"[^A-Za-z0-9._-]+", "_", name)
+
+    def _write(self, name, method, duration, profiler, report):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, name)
+            written = []
+            if profiler is not None:
+                profiler.dump_stats(f"{path}.prof")
+                written.append(f"{path}.prof")
+            if report is not None:
+                with open(f"{path}.tracemalloc.txt", "w") as report_file:
+                    report_file.write(report)
+                written.append(f"{path}.tracemalloc.txt")
+            if written:
+                self._log(INFO, f"Profiled {method} ({duration:.3f}s): {', '.join(written)}")
+        except OSError as e:
+            self._log(WARNING, f"Could not write the profile of {method}: {str(e)}")
+
+    def _log(self, level, message):
+        if self.log_message is not None:
+            self.log_message(level, message)
+
+
+def _request_id(context):
+    if context is None:
+        return ""
+    try:
+        metadata = context.invocation_metadata() or ()
+    except Exception:
+        return ""
+    for key, value in metadata:
+        if key in REQUEST_ID_METADATA_KEYS:
+            return str(value)
+    return ""
+
+
+def _method_name(handler_call_details):
+    return handler_call_details.method.rsplit("/", 1)[-1]
+
+
+class ProfilingInterceptor(grpc.ServerInterceptor):
+    """Server interceptor profiling the sampled calls of the RPCs selected in an RpcProfiler."""
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        method = _method_name(handler_call_details)
+        if handler is None or method not in self.profiler.methods:
+            return handler
+        profiler = self.profiler
+        serializers = dict(request_deserializer=handler.request_deserializer,
+                           response_serializer=handler.response_serializer)
+        if handler.unary_unary:
+            behavior = handler.unary_unary
+
+            def unary(request, context):
+                with profiler.profile(method, context):
+                    return behavior(request, context)
+            return grpc.unary_unary_rpc_method_handler(unary, **serializers)
+        if handler.unary_stream:
+            behavior = handler.unary_stream
+
+            def stream(request, context):
+                with profiler.profile(method, context):
+                    yield from behavior(request, context)
+            return grpc.unary_stream_rpc_method_handler(stream, **serializers)
+        return handler
+
+
+class AsyncProfilingInterceptor(grpc.aio.ServerInterceptor):
+    """
+    grpc.aio variant of ProfilingInterceptor.
+
+    The handler is profiled on the event loop thread, so cProfile also records the other
+    coroutines that run while it awaits, and misses work the handler hands to executor threads.
+    """
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        method = _method_name(handler_call_details)
+        if handler is None or method not in self.profiler.methods:
+            return handler
+        profiler = self.profiler
+        serializers = dict(request_deserializer=handler.request_deserializer,
+                           response_serializer=handler.response_serializer)
+        if handler.unary_unary:
+            behavior = handler.unary_unary
+
+            async def unary(request, context):
+                with profiler.profile(method, context):
+                    return await behavior(request, context)
+            return grpc.unary_unary_rpc_method_handler(unary, **serializers)
+        if handler.unary_stream:
+            behavior = handler.unary_stream
+
+            async def stream(request, context):
+                # Streaming handlers write their responses with `context.write`
+                with profiler.profile(method, context):
+                    return await behavior(request, context)
+            return grpc.unary_stream_rpc_method_handler(stream, **serializers)
+        return handler
+
+
+def add_arguments(parser):
+    """Add the command line options of the profiling mode; each defaults to an environment variable."""
+    parser.add_argument("--profile-rpcs", default=os.environ.get("FIVETRAN_PROFILE_RPCS", ""),
+                        help="Comma-separated RPCs to profile, e.g. WriteBatch,Migrate "
+                             "(env FIVETRAN_PROFILE_RPCS; profiling is off if empty)")
+    parser.add_argument("--profile-mode", choices=MODES,
+                        default=os.environ.get("FIVETRAN_PROFILE_MODE", MODE_CPROFILE),
+                        help="Profile CPU time with cProfile, allocations with tracemalloc, or both "
+                             "(env FIVETRAN_PROFILE_MODE)")
+    parser.add_argument("--profile-every", type=int, default=int(os.environ.get("FIVETRAN_PROFILE_EVERY", "1")),
+                        help="Profile every n-th call of each selected RPC (env FIVETRAN_PROFILE_EVERY)")
+    parser.add_argument("--profile-slower-than", type=float,
+                        default=float(os.environ.get("FIVETRAN_PROFILE_SLOWER_THAN", "0")),
+                        help="Only keep profiles of calls that took at least this many seconds "
+                             "(env FIVETRAN_PROFILE_SLOWER_THAN)")
+    parser.add_argument("--profile-dir", default=os.environ.get("FIVETRAN_PROFILE_DIR", DEFAULT_PROFILE_DIRECTORY),
+                        help="Directory the profiles are written to (env FIVETRAN_PROFILE_DIR)")
+
+
+def profiler_from_args(args, log_message=None):
+    """Return an RpcProfiler for the parsed command line options, or None if profiling is off."""
+    methods = {method.strip() for method in args.profile_rpcs.split(",") if method.strip()}
+    if not methods:
+        return None
+    return RpcProfiler(methods, directory=args.profile_dir, mode=args.profile_mode, every=args.profile_every,
+                       slower_than_seconds=args.profile_slower_than, log_message=log_message)
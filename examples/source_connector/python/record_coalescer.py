@@ -0,0 +1,102 @@
+import sys
+sys.path.append('sdk_pb2')
+
+from sdk_pb2 import common_pb2
+from sdk_pb2 import connector_sdk_pb2
+
+UPSERT = common_pb2.RecordType.UPSERT
+UPDATE = common_pb2.RecordType.UPDATE
+DELETE = common_pb2.RecordType.DELETE
+TRUNCATE = common_pb2.RecordType.TRUNCATE
+
+
+class RecordCoalescer:
+    """
+    Collapses successive operations on the same primary key into one net operation.
+
+    Up to `window_size` keys are held pending. Each new record for a pending key is merged
+    into the pending record using these rules (earlier -> later = result):
+      - UPSERT -> UPSERT: the later UPSERT
+      - UPSERT -> UPDATE: an UPSERT with the updated columns applied on top
+      - UPDATE -> UPDATE: an UPDATE carrying the union of the changed columns
+      - any    -> DELETE: the DELETE
+      - DELETE -> UPSERT: the UPSERT (it carries the full row)
+      - DELETE -> UPDATE: not mergeable; the DELETE is released and the UPDATE becomes pending
+      - UPDATE -> UPSERT: the UPSERT
+
+    Records of different keys are independent, so only the per-key order matters. A TRUNCATE
+    releases every pending record of its table before it, and records of tables without
+    declared primary keys (or missing a key value) pass through after their table is released.
+    When the window is full, the oldest pending key is released.
+    """
+
+    def __init__(self, window_size, primary_keys):
+        """
+        Args:
+            window_size: Maximum number of distinct keys held pending
+            primary_keys: Dict of table name -> list of primary key column names
+        """
+        if window_size < 1:
+            raise ValueError("Coalescing window must be at least 1")
+        self.window_size = window_size
+        self.primary_keys = primary_keys
+        # (schema, table, key values) -> pending record; dict keeps insertion order
+        self._pending = {}
+
+    def add(self, record):
+        """Accept a record. Returns the records released for emission, in order."""
+        key = self._key(record)
+        if key is None:
+            released = self._release_table(record.schema_name, record.table_name)
+            released.append(record)
+            return released
+
+        pending = self._pending.get(key)
+        if pending is None:
+            self._pending[key] = record
+            if len(self._pending) > self.window_size:
+                oldest = next(iter(self._pending))
+                return [self._pending.pop(oldest)]
+            return []
+
+        merged = self._merge(pending, record)
+        if merged is None:
+            # DELETE followed by UPDATE: keep both, in order
+            self._pending[key] = record
+            return [pending]
+        self._pending[key] = merged
+        return []
+
+    def flush(self):
+        """Release every pending record."""
+        released = list(self._pending.values())
+        self._pending.clear()
+        return released
+
+    def _key(self, record):
+        if record.type == TRUNCATE:
+            return None
+        pk_columns = self.primary_keys.get(record.table_name)
+        if not pk_columns or any(col not in record.data for col in pk_columns):
+            return None
+        return (record.schema_name, record.table_name) + tuple(
+            record.data[col].SerializeToString(deterministic=True) for col in pk_columns
+        )
+
+    def _release_table(self, schema_name, table_name):
+        keys = [key for key in self._pending if key[0] == schema_name and key[1] == table_name]
+        return [self._pending.pop(key) for key in keys]
+
+    @staticmethod
+    def _merge(earlier, later):
+        """Return the net record for `earlier` followed by `later`, or None if they cannot merge."""
+        if later.type in (UPSERT, DELETE):
+            return later
+        # later is an UPDATE
+        if earlier.type == DELETE:
+            return None
+        merged = connector_sdk_pb2.Record()
+        merged.CopyFrom(earlier)
+        for col, val in later.data.items():
+            merged.data[col].CopyFrom(val)
+        return merged
@@ -0,0 +1,190 @@
+import sys
+sys.path.append('sdk_pb2')
+
+from sdk_pb2 import common_pb2
+from sdk_pb2 import connector_sdk_pb2
+from log_helper import log_message
+
+WARNING = "WARNING"
+
+
+class GreedyBatcher:
+    """
+    Default batcher: appends records to the current batch until the next record would exceed
+    either cap, then flushes. Records that exceed the byte cap on their own are sent individually.
+    """
+
+    def __init__(self, max_records, max_bytes):
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self._batch = []
+
+    def add(self, record):
+        """Append the record, or flush first. Returns the UpdateResponses that became ready."""
+        if self._can_append_without_exceeding_caps(record):
+            self._batch.append(record)
+            return []
+
+        # Flush current batch first
+        responses = self.flush()
+
+        # If the record still exceeds the size cap by itself, send it individually
+        if _records_byte_size([record]) > self.max_bytes:
+            log_message(WARNING, "Single record exceeds 100KiB, emitting individually")
+            responses.append(connector_sdk_pb2.UpdateResponse(record=record))
+        else:
+            self._batch.append(record)
+        return responses
+
+    def flush(self):
+        """Emit the current batch if it is not empty."""
+        if not self._batch:
+            return []
+        response = connector_sdk_pb2.UpdateResponse(records=connector_sdk_pb2.Records(records=self._batch))
+        self._batch = []
+        return [response]
+
+    def _can_append_without_exceeding_caps(self, candidate):
+        # Count cap
+        if len(self._batch) + 1 > self.max_records:
+            return False
+        # Byte-size cap (exact via proto ByteSize)
+        return _records_byte_size(self._batch + [candidate]) <= self.max_bytes
+
+
+class RecordPacker:
+    """
+    Size-aware batcher that packs records into as few UpdateResponse messages as possible.
+
+    Records are buffered in a small window per table. When a table's window fills up, the
+    buffered records are packed first-fit into batches that respect both the record-count
+    and the serialized byte-size caps, and every batch except the last (least complete) one
+    is emitted. The records of the last batch stay buffered and are packed again together
+    with the next window, so batches only go out partially filled on the final flush.
+
+    Ordering: records that share a primary key are never reordered. A record is only placed
+    into a batch at or after the batch holding the previous record with the same key, and
+    records inside a batch keep their arrival order. Records of tables without known primary
+    keys are treated as a single key, and TRUNCATE records flush their table first.
+    """
+
+    def __init__(self, max_records, max_bytes, window_size, primary_keys=None):
+        """
+        Args:
+            max_records: Maximum number of records per batch
+            max_bytes: Maximum serialized size (bytes) of a Records batch
+            window_size: Number of records buffered per table before packing
+            primary_keys: Optional dict of table name -> list of primary key column names
+        """
+        if window_size < max_records:
+            raise ValueError(f"Packing window ({window_size}) must hold at least one full batch ({max_records})")
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.window_size = window_size
+        self.primary_keys = primary_keys or {}
+        # table name -> list of (record, framed size, ordering key), in arrival order
+        self._windows = {}
+
+    def add(self, record):
+        """Buffer a record. Returns the UpdateResponses that became ready, in emission order."""
+        if record.type == common_pb2.RecordType.TRUNCATE:
+            # A truncate applies to every earlier record of its table, so nothing may pass it
+            responses = self._pack_and_emit(self._windows.pop(record.table_name, []), keep_last=False)
+            responses.extend(self._pack_and_emit([self._entry(record)], keep_last=False))
+            return responses
+
+        window = self._windows.setdefault(record.table_name, [])
+        window.append(self._entry(record))
+        if len(window) < self.window_size:
+            return []
+        self._windows[record.table_name] = []
+        return self._pack_and_emit(window, keep_last=True, table=record.table_name)
+
+    def flush(self):
+        """Pack and emit everything that is still buffered, across all tables."""
+        entries = [entry for window in self._windows.values() for entry in window]
+        self._windows.clear()
+        return self._pack_and_emit(entries, keep_last=False)
+
+    def _entry(self, record):
+        size = record.ByteSize()
+        # Size of the record as an element of Records.records: tag + length prefix + payload
+        framed_size = 1 + _varint_size(size) + size
+        return record, framed_size, self._ordering_key(record)
+
+    def _ordering_key(self, record):
+        pk_columns = self.primary_keys.get(record.table_name)
+        if not pk_columns:
+            return (record.table_name,)
+        return (record.table_name,) + tuple(
+            record.data[col].SerializeToString(deterministic=True) if col in record.data else b""
+            for col in pk_columns
+        )
+
+    def _pack(self, entries):
+        """
+        First-fit packing in arrival order, constrained so records with the same ordering key
+        land in non-decreasing batch positions.
+
+        Returns a list of bins; each bin is a dict with 'size', 'records' and 'single' (set for
+        records that exceed the byte cap on their own and must be sent individually).
+        """
+        bins = []
+        last_bin_for_key = {}
+        for record, size, key in entries:
+            lowest = last_bin_for_key.get(key, 0)
+            if size > self.max_bytes:
+                bins.append({"size": size, "records": [record], "single": True})
+                last_bin_for_key[key] = len(bins) - 1
+                continue
+
+            for index in range(lowest, len(bins)):
+                candidate = bins[index]
+                if (not candidate["single"]
+                        and len(candidate["records"]) < self.max_records
+                        and candidate["size"] + size <= self.max_bytes):
+                    candidate["records"].append(record)
+                    candidate["size"] += size
+                    last_bin_for_key[key] = index
+                    break
+            else:
+                bins.append({"size": size, "records": [record], "single": False})
+                last_bin_for_key[key] = len(bins) - 1
+        return bins
+
+    def _pack_and_emit(self, entries, keep_last, table=None):
+        if not entries:
+            return []
+        bins = self._pack(entries)
+
+        if keep_last and len(bins) > 1 and not bins[-1]["single"]:
+            # Every record of the last bin comes after all same-key records in earlier bins,
+            # so it is safe to hold them back and pack them with the next window.
+            carried_over = bins.pop()["records"]
+            self._windows[table] = [self._entry(record) for record in carried_over]
+
+        responses = []
+        for packed in bins:
+            if packed["single"]:
+                log_message(WARNING, "Single record exceeds 100KiB, emitting individually")
+                responses.append(connector_sdk_pb2.UpdateResponse(record=packed["records"][0]))
+            else:
+                responses.append(connector_sdk_pb2.UpdateResponse(
+                    records=connector_sdk_pb2.Records(records=packed["records"])
+                ))
+        return responses
+
+
+def _records_byte_size(records_list):
+    """Compute serialized size (bytes) of a Records batch via protobuf ByteSize()."""
+    return connector_sdk_pb2.Records(records=records_list).ByteSize()
+
+
+def _varint_size(value):
+    """Number of bytes needed to encode value as a protobuf varint."""
+    size = 1
+    while value >= 0x80:
+        value >>= 7
+        size += 1
+    return size
+